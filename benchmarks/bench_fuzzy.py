@@ -0,0 +1,84 @@
+"""
+Query latency of the fuzzy card name matcher.
+
+    poetry run python benchmarks/bench_fuzzy.py [names file]
+
+The names file can be Scryfall's /catalog/card-names JSON or one name per line.
+Without one, names come from the local card index (if it's been built) or are
+generated.
+"""
+import argparse
+import json
+import random
+import string
+import time
+from pathlib import Path
+from typing import List
+
+from theburgbot.name_index import FuzzyIndex
+from theburgbot.scry_index import ScryCardIndex, card_index_dir
+
+
+def load_names(path) -> List[str]:
+    if path:
+        text = Path(path).read_text(encoding="utf-8")
+        if text.lstrip().startswith("{"):
+            return json.loads(text)["data"]
+        return [line.strip() for line in text.splitlines() if line.strip()]
+    card_index = ScryCardIndex.load(card_index_dir())
+    if card_index is not None:
+        return card_index.names()
+    rng = random.Random(0)
+    words = [
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))).title()
+        for _ in range(4000)
+    ]
+    return [" ".join(rng.choices(words, k=rng.randint(1, 4))) for _ in range(30000)]
+
+
+def typo(rng: random.Random, name: str) -> str:
+    chars = list(name.lower())
+    for _ in range(rng.randint(0, 2)):
+        pos = rng.randrange(len(chars))
+        op = rng.choice(["drop", "swap", "replace"])
+        if op == "drop" and len(chars) > 1:
+            del chars[pos]
+        elif op == "swap" and pos + 1 < len(chars):
+            (chars[pos], chars[pos + 1]) = (chars[pos + 1], chars[pos])
+        else:
+            chars[pos] = rng.choice(string.ascii_lowercase)
+    return "".join(chars)
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    args.add_argument("names_file", nargs="?")
+    args.add_argument("--queries", type=int, default=2000)
+    args.add_argument("--seed", type=int, default=1)
+    args = args.parse_args()
+
+    names = load_names(args.names_file)
+    start = time.perf_counter()
+    index = FuzzyIndex(names)
+    print(f"Indexed {len(index)} names in {time.perf_counter() - start:.2f}s")
+
+    rng = random.Random(args.seed)
+    queries = [(name, typo(rng, name)) for name in rng.choices(names, k=args.queries)]
+    timings = []
+    hits = 0
+    for expected, query in queries:
+        start = time.perf_counter()
+        found = index.match(query)
+        timings.append(time.perf_counter() - start)
+        hits += found is not None and found[0] == expected
+    timings.sort()
+    (p50, p95, p99) = [timings[int(len(timings) * p)] for p in [0.5, 0.95, 0.99]]
+    print(
+        f"{len(queries)} queries: p50 {p50 * 1000:.2f}ms, p95 {p95 * 1000:.2f}ms, "
+        f"p99 {p99 * 1000:.2f}ms, max {timings[-1] * 1000:.2f}ms"
+    )
+    print(f"Matched the intended name for {hits / len(queries):.1%} of queries")
+
+
+if __name__ == "__main__":
+    main()
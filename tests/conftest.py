@@ -0,0 +1,23 @@
+import os
+from pathlib import Path
+
+import pytest
+
+FIXTURES_PATH = Path(__file__).resolve().parent / "fixtures"
+# theburgbot.config reads these on import, which the command handlers all do
+os.environ.setdefault(
+    "THEBURGBOT_DISCORD_IDS_JSON_PATH", str(FIXTURES_PATH / "discord_ids.json")
+)
+os.environ.setdefault(
+    "THEBURGBOT_REACTION_ROLES_JSON_PATH", str(FIXTURES_PATH / "reaction_roles.json")
+)
+
+from theburgbot import resilience
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr("theburgbot.constants.RETRY_BASE_DELAY_SECS", 0.001)
+    resilience.BREAKERS.clear()
+    yield
+    resilience.BREAKERS.clear()
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+from theburgbot import common
+
+
+async def _serve_keepalive(connections):
+    async def handle(reader, writer):
+        connections.append(writer)
+        try:
+            while True:
+                await reader.readuntil(b"\r\n\r\n")
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+@pytest.mark.asyncio
+async def test_shared_client_reuses_connections(monkeypatch):
+    monkeypatch.setattr(
+        "theburgbot.constants.HTTP_PER_HOST_MAX_CONNECTIONS", {"127.0.0.1": 2}
+    )
+    connections = []
+    server = await _serve_keepalive(connections)
+    url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/"
+    common.set_http_client(None)
+    try:
+        client = common.http_client()
+        assert common.http_client() is client
+        # the host gets its own mounted pool, shared by every call to it
+        transport = client._transport_for_url(httpx.URL(url))
+        assert transport is not client._transport
+        assert client._transport_for_url(httpx.URL(f"{url}other")) is transport
+
+        for _ in range(3):
+            assert (await common.http_client().get(url)).text == "ok"
+        assert len(connections) == 1
+
+        await common.close_http_client()
+        assert client.is_closed
+        assert common.http_client() is not client
+    finally:
+        await common.close_http_client()
+        server.close()
+        await server.wait_closed()
+
+
+def test_lazy_import(tmp_path, monkeypatch):
+    (tmp_path / "lazy_probe.py").write_text(
+        "import os\nos.environ['LAZY_PROBE_IMPORTED'] = '1'\nVALUE = 42\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delenv("LAZY_PROBE_IMPORTED", raising=False)
+    try:
+        module = common.lazy_import("lazy_probe")
+        assert "LAZY_PROBE_IMPORTED" not in os.environ
+        assert common.lazy_import("lazy_probe") is module
+        assert module.VALUE == 42
+        assert os.environ["LAZY_PROBE_IMPORTED"] == "1"
+    finally:
+        sys.modules.pop("lazy_probe", None)
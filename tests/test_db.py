@@ -137,3 +137,52 @@ async def test_json_kv_store_setnx():
     assert await json_kv.get("test-setnx") == 42
     await json_kv.setnx("test-setnx", 43)
     assert await json_kv.get("test-setnx") == 42
+
+
+@pytest.mark.asyncio
+async def test_update_http_static():
+    db = TheBurgBotDB(TEST_DB_PATH)
+    await db.initialize()
+    src_obj = {"title": "Report", "sections": [{"heading": "One", "body": "first"}]}
+    url_id = await db.add_http_static("-1", "test", "admin_report", src_obj, "Title")
+    assert "first" in await db.get_http_static_rendered(url_id)
+
+    src_obj["sections"][0]["body"] = "second"
+    assert await db.update_http_static(url_id, src_obj)
+    rendered = await db.get_http_static_rendered(url_id)
+    assert "second" in rendered and "first" not in rendered
+    assert not await db.update_http_static("no-such-id", src_obj)
+
+
+@pytest.mark.asyncio
+async def test_gpt_cache():
+    db = TheBurgBotDB(TEST_DB_PATH)
+    await db.initialize()
+    assert await db.get_gpt_cached("key", 60) is None
+    await db.set_gpt_cached("key", "model", "prompt", True, "first", "url-1")
+    await db.set_gpt_cached("key", "model", "prompt", True, "second", "url-2")
+    assert tuple(await db.get_gpt_cached("key", 60)) == ("second", "url-2")
+    assert await db.get_gpt_cached("key", 0) is None
+
+
+@pytest.mark.asyncio
+async def test_http_static_rendered_lazily(tmp_path, monkeypatch):
+    monkeypatch.setattr("theburgbot.db.TEMPLATES_PATH", tmp_path)
+    (tmp_path / "page.html").write_text("<p>{{body}}</p>")
+    db = TheBurgBotDB(TEST_DB_PATH)
+    await db.initialize()
+    url_id = await db.add_http_static("-1", "test", "page", {"body": "hi"}, "Title")
+    other_id = await db.add_http_static("-1", "test", "page", {"body": "yo"}, "Title")
+    rows = await db._direct_exec("select rendered, rendered_version from http_static")
+    assert rows == [("", None), ("", None)]
+
+    assert await db.get_http_static_rendered(url_id) == "<p>hi</p>"
+    assert await db.render_stale_http_statics() == 1
+    assert await db.render_stale_http_statics() == 0
+    assert await db.get_http_static_rendered(other_id) == "<p>yo</p>"
+
+    (tmp_path / "page.html").write_text("<div>{{body}}</div>")
+    os.utime(tmp_path / "page.html", ns=(0, 0))
+    assert await db.get_http_static_rendered(url_id) == "<div>hi</div>"
+    assert await db.render_stale_http_statics() == 1
+    assert await db.get_http_static_rendered("no-such-id") is None
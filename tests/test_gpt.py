@@ -0,0 +1,232 @@
+import types
+
+import pytest
+
+from theburgbot import constants
+from theburgbot.cmd_handlers import gpt
+
+
+class OpenAIObject(dict):
+    # openai's response objects are dicts that can also be read as attributes
+    def __getattr__(self, name):
+        return self[name]
+
+
+class APIError(Exception):
+    http_status = 500
+
+
+class ServiceUnavailableError(Exception):
+    pass
+
+
+def fake_openai(responses):
+    calls = []
+
+    async def acreate(**kwargs):
+        calls.append(kwargs)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    module = types.SimpleNamespace(
+        ChatCompletion=types.SimpleNamespace(acreate=acreate),
+        error=types.SimpleNamespace(
+            APIError=APIError,
+            ServiceUnavailableError=ServiceUnavailableError,
+            RateLimitError=ServiceUnavailableError,
+            APIConnectionError=ServiceUnavailableError,
+            Timeout=ServiceUnavailableError,
+            TryAgain=ServiceUnavailableError,
+        ),
+    )
+    return (module, calls)
+
+
+def completion(content):
+    return OpenAIObject(choices=[OpenAIObject(message=OpenAIObject(content=content))])
+
+
+async def chunk_stream(*contents):
+    for content in contents:
+        yield OpenAIObject(
+            choices=[
+                OpenAIObject(delta=OpenAIObject(content=content), finish_reason=None)
+            ]
+        )
+    yield OpenAIObject(
+        choices=[OpenAIObject(delta=OpenAIObject(), finish_reason="stop")]
+    )
+
+
+class AuditLog:
+    def __init__(self):
+        self.events = []
+
+    async def __call__(self, event, obj):
+        self.events.append((event, obj))
+
+
+@pytest.mark.asyncio
+async def test_query_openai(monkeypatch):
+    (module, calls) = fake_openai(
+        [ServiceUnavailableError("overloaded"), completion("Hello!")]
+    )
+    monkeypatch.setattr(gpt, "openai", module)
+    audit_log = AuditLog()
+    response = await gpt.query_openai("Hi", audit_logger=audit_log, model="gpt-x")
+    assert response == "Hello!"
+    assert len(calls) == 2
+    assert calls[-1]["model"] == "gpt-x"
+    assert calls[-1]["messages"] == [{"role": "user", "content": "Hi"}]
+    assert [event for (event, _obj) in audit_log.events] == [
+        "CHAT_COMPLETETION_CREATE",
+        "SERVICE_UNAVAILABLE",
+        "ALL_RESPONSES",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_query_openai_unavailable(monkeypatch):
+    monkeypatch.setattr(constants, "GPT_RETRY_ATTEMPTS", 2)
+    (module, _calls) = fake_openai([ServiceUnavailableError("down")] * 2)
+    monkeypatch.setattr(gpt, "openai", module)
+    audit_log = AuditLog()
+    response = await gpt.query_openai("Hi", audit_logger=audit_log, model="gpt-x")
+    assert response == constants.GPT_UNAVAILABLE_RESPONSE
+    assert audit_log.events[-1][0] == "UNAVAILABLE"
+
+    # errors that aren't retryable aren't swallowed
+    (module, calls) = fake_openai([ValueError("bad request")])
+    monkeypatch.setattr(gpt, "openai", module)
+    with pytest.raises(ValueError):
+        await gpt.query_openai("Hi", audit_logger=audit_log, model="gpt-x")
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_openai(monkeypatch):
+    (module, calls) = fake_openai([chunk_stream("Hel", "lo", "!")])
+    monkeypatch.setattr(gpt, "openai", module)
+    audit_log = AuditLog()
+    contents = [
+        content
+        async for content in gpt.stream_openai(
+            "Hi", audit_logger=audit_log, model="gpt-x"
+        )
+    ]
+    assert contents == ["Hel", "lo", "!"]
+    assert calls[0]["stream"] is True
+    assert audit_log.events[-1] == ("STREAM_FINISHED", {"finish_reason": "stop"})
+
+    monkeypatch.setattr(constants, "GPT_RETRY_ATTEMPTS", 1)
+    (module, _calls) = fake_openai([ServiceUnavailableError("down")])
+    monkeypatch.setattr(gpt, "openai", module)
+    contents = [
+        content
+        async for content in gpt.stream_openai(
+            "Hi", audit_logger=audit_log, model="gpt-x"
+        )
+    ]
+    assert contents == [constants.GPT_UNAVAILABLE_RESPONSE]
+
+
+class FakeMessage:
+    def __init__(self, content):
+        self.contents = [content]
+
+    async def edit(self, *, content):
+        self.contents.append(content)
+
+
+class FakeInteraction:
+    def __init__(self):
+        self.messages = []
+        self.followup = self
+
+    async def send(self, content, *, ephemeral, wait):
+        self.messages.append(FakeMessage(content))
+        return self.messages[-1]
+
+
+class FakeDB:
+    def __init__(self):
+        self.pages = {}
+
+    async def update_http_static(self, url_id, obj):
+        self.pages[url_id] = obj
+
+
+@pytest.mark.asyncio
+async def test_stream_reply(monkeypatch):
+    clock = types.SimpleNamespace(now=0.0)
+    monkeypatch.setattr(gpt, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    chunks = ["word " * 50] * 12
+
+    async def stream(query, *, model, audit_logger):
+        for chunk in chunks:
+            clock.now += 0.5
+            yield chunk
+
+    monkeypatch.setattr(gpt, "stream_openai", stream)
+    interaction = FakeInteraction()
+    db = FakeDB()
+    response = await gpt._stream_reply(
+        interaction,
+        db,
+        "url-id",
+        "> Hi",
+        "_postfix_",
+        "Hi",
+        "gpt-x",
+        False,
+        audit_logger=AuditLog(),
+    )
+    assert response == "".join(chunks)
+    [message] = interaction.messages
+    # the placeholder, an edit per GPT_STREAM_EDIT_INTERVAL_SECS (3 chunks) until it
+    # overflows and stops changing, then the final reply
+    assert len(message.contents) == 1 + 3 + 1
+    assert [len(c.split("word")) - 1 for c in message.contents[1:3]] == [150, 300]
+    assert all([len(c) <= constants.DISCORD_MAX_MESSAGE_LEN for c in message.contents])
+    assert message.contents[1].startswith(
+        "# Prompt:\n> Hi\n# Response:\n" + "word " * 150
+    )
+    # the overflow is only on the page, which has the whole response
+    assert message.contents[-1].endswith(
+        "_... the rest is at the URL below!_\n\n_postfix_"
+    )
+    assert "word " * 400 not in message.contents[-1]
+    assert db.pages["url-id"]["response"].count("word") == 12 * 50
+
+
+@pytest.mark.asyncio
+async def test_stream_reply_interrupted(monkeypatch):
+    async def stream(query, *, model, audit_logger):
+        yield "Partial"
+        raise ConnectionResetError()
+
+    monkeypatch.setattr(gpt, "stream_openai", stream)
+    db = FakeDB()
+    interaction = FakeInteraction()
+    with pytest.raises(ConnectionResetError):
+        await gpt._stream_reply(
+            interaction,
+            db,
+            "url-id",
+            "> Hi",
+            "",
+            "Hi",
+            "gpt-x",
+            False,
+            audit_logger=AuditLog(),
+        )
+    # whatever was streamed is still saved to the page
+    assert "Partial" in db.pages["url-id"]["response"]
+    # and the message says that it's incomplete
+    [message] = interaction.messages
+    assert message.contents[-1] == (
+        "# Prompt:\n> Hi\n# Response:\nPartial\n\n"
+        "_... the response was cut short by an error!_\n\n"
+    )
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from theburgbot.gpt_scheduler import GPTQueueFull, GPTScheduler
+
+
+async def _request(scheduler, user_id, tag, order, *, tokens=1, hold=0.01, **kwargs):
+    async with scheduler.slot(user_id, tokens, **kwargs):
+        order.append(tag)
+        await asyncio.sleep(hold)
+
+
+@pytest.mark.asyncio
+async def test_fair_turns_and_concurrency_cap():
+    scheduler = GPTScheduler(
+        max_concurrent=1, tokens_per_minute=1000, max_queued_per_user=5
+    )
+    order = []
+    tasks = [
+        asyncio.create_task(_request(scheduler, "a", f"a{i}", order)) for i in range(3)
+    ]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(_request(scheduler, "b", "b0", order)))
+    await asyncio.sleep(0)
+    assert scheduler.running == 1
+    await asyncio.gather(*tasks)
+    # b's only request doesn't wait behind all of a's
+    assert order == ["a0", "b0", "a1", "a2"]
+    assert scheduler.stats()["completed"] == 4
+
+
+@pytest.mark.asyncio
+async def test_queue_positions_and_limits():
+    scheduler = GPTScheduler(
+        max_concurrent=1, tokens_per_minute=1000, max_queued_per_user=1
+    )
+    positions = {"b": [], "c": []}
+
+    def recorder(user_id):
+        async def _record(position):
+            positions[user_id].append(position)
+
+        return _record
+
+    order = []
+    tasks = [asyncio.create_task(_request(scheduler, "a", "a0", order, hold=0.05))]
+    await asyncio.sleep(0)
+    for user_id in ["b", "c"]:
+        tasks.append(
+            asyncio.create_task(
+                _request(
+                    scheduler, user_id, user_id, order, on_position=recorder(user_id)
+                )
+            )
+        )
+        await asyncio.sleep(0)
+
+    with pytest.raises(GPTQueueFull):
+        async with scheduler.slot("b", 1):
+            pass
+
+    await asyncio.gather(*tasks)
+    assert positions == {"b": [0], "c": [1, 0]}
+
+
+@pytest.mark.asyncio
+async def test_token_budget_and_cancellation():
+    scheduler = GPTScheduler(
+        max_concurrent=5, tokens_per_minute=100, max_queued_per_user=5
+    )
+    order = []
+    # bigger than the whole budget, but nothing else is running so it goes anyway
+    await _request(scheduler, "a", "big", order, tokens=500)
+    waiting = asyncio.create_task(_request(scheduler, "b", "small", order, tokens=10))
+    await asyncio.sleep(0.05)
+    assert order == ["big"]
+    assert scheduler.stats()["queued"] == 1
+
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert scheduler.stats()["queued"] == 0
+    assert scheduler.running == 0
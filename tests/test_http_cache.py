@@ -0,0 +1,101 @@
+import asyncio
+import datetime
+import json
+
+import httpx
+import pytest
+
+from theburgbot.common import HTTPCache, set_http_client
+
+TEST_URL = "https://example.com/calendar.ics"
+
+
+class MockUpstream:
+    def __init__(self):
+        self.requests = []
+        self.fail = False
+        self.body = "BEGIN:VCALENDAR"
+
+    async def handler(self, request: httpx.Request):
+        self.requests.append(request)
+        await asyncio.sleep(0.01)
+        if self.fail:
+            return httpx.Response(500)
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, text=self.body, headers={"ETag": '"v1"'})
+
+
+@pytest.fixture
+def upstream():
+    mock = MockUpstream()
+    set_http_client(httpx.AsyncClient(transport=httpx.MockTransport(mock.handler)))
+    yield mock
+    set_http_client(None)
+
+
+def age_entry(cache: HTTPCache, url: str, hours: float):
+    (_body_path, meta_path) = cache._paths(url, "")
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    meta["fetched_at"] = datetime.datetime.now().timestamp() - hours * 60 * 60
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+
+
+@pytest.mark.asyncio
+async def test_http_cache_fresh_hit(tmp_path, upstream):
+    cache = HTTPCache(tmp_path)
+    assert await (await cache.get(TEST_URL)).read_text() == upstream.body
+    assert await (await cache.get(TEST_URL)).read_text() == upstream.body
+    assert len(upstream.requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_http_cache_single_flight(tmp_path, upstream):
+    cache = HTTPCache(tmp_path)
+    results = await asyncio.gather(*[cache.get(TEST_URL) for _ in range(10)])
+    assert len(upstream.requests) == 1
+    assert all([await r.read_text() == upstream.body for r in results])
+
+
+@pytest.mark.asyncio
+async def test_http_cache_conditional_revalidation(tmp_path, upstream):
+    cache = HTTPCache(tmp_path)
+    await cache.get(TEST_URL, ttl_hours=1, stale_hours=0)
+    age_entry(cache, TEST_URL, 2)
+    res = await cache.get(TEST_URL, ttl_hours=1, stale_hours=0)
+    assert not res.stale
+    assert len(upstream.requests) == 2
+    assert upstream.requests[-1].headers["If-None-Match"] == '"v1"'
+    assert await res.read_text() == upstream.body
+
+    # the 304 counts as a refresh, so the entry is fresh again
+    await cache.get(TEST_URL, ttl_hours=1, stale_hours=0)
+    assert len(upstream.requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_http_cache_stale_while_revalidate(tmp_path, upstream):
+    cache = HTTPCache(tmp_path)
+    await cache.get(TEST_URL, ttl_hours=1, stale_hours=1)
+    age_entry(cache, TEST_URL, 1.5)
+    res = await cache.get(TEST_URL, ttl_hours=1, stale_hours=1)
+    assert res.stale
+    assert len(cache._inflight) == 1
+    await asyncio.gather(*cache._inflight.values())
+    assert len(upstream.requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_http_cache_serves_stale_on_error(tmp_path, upstream):
+    cache = HTTPCache(tmp_path)
+    await cache.get(TEST_URL, ttl_hours=1, stale_hours=0)
+    age_entry(cache, TEST_URL, 2)
+    upstream.fail = True
+    res = await cache.get(TEST_URL, ttl_hours=1, stale_hours=0)
+    assert res.stale
+    assert await res.read_text() == upstream.body
+
+    with pytest.raises(Exception):
+        await cache.get("https://example.com/never-fetched.ics")
@@ -0,0 +1,183 @@
+import asyncio
+import datetime
+
+import httpx
+import pytest
+
+from theburgbot import common
+from theburgbot.common import HTTPCache, set_http_client
+from theburgbot.db import TheBurgBotKeyedJSONStore
+from theburgbot.ical import (fetch_calendars, get_current_events_from_ICS_urls,
+                             mtg_current_events, occurrence_index,
+                             parse_calendar, prune_parsed, shutdown_parse_pool,
+                             summary_matcher)
+
+CALENDARS = {
+    "Fast": "https://fast.example.com/cal.ics",
+    "Slow": "https://slow.example.com/cal.ics",
+    "Huge": "https://huge.example.com/cal.ics",
+}
+
+
+class MockCalendars:
+    def __init__(self):
+        self.requests = []
+        self.slow_secs = 1
+
+    async def handler(self, request: httpx.Request):
+        self.requests.append(request)
+        if request.url.host.startswith("slow"):
+            await asyncio.sleep(self.slow_secs)
+        if request.url.host.startswith("huge"):
+            return httpx.Response(200, content=b"X" * 2048)
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, text="BEGIN:VCALENDAR", headers={"ETag": '"v1"'})
+
+
+@pytest.fixture
+def calendars(tmp_path, monkeypatch):
+    mock = MockCalendars()
+    monkeypatch.setattr(common, "_HTTP_CACHE", HTTPCache(tmp_path / "cache"))
+    monkeypatch.setattr("theburgbot.constants.ICAL_FETCH_TIMEOUT_SECS", 0.2)
+    monkeypatch.setattr("theburgbot.constants.ICAL_MAX_BYTES", 1024)
+    monkeypatch.setattr("theburgbot.constants.ICAL_CACHE_TTL_HOURS", 0)
+    set_http_client(httpx.AsyncClient(transport=httpx.MockTransport(mock.handler)))
+    yield mock
+    set_http_client(None)
+
+
+@pytest.mark.asyncio
+async def test_fetch_calendars(tmp_path, calendars):
+    kv = TheBurgBotKeyedJSONStore(db_path=tmp_path / "db.sqlite3", namespace="events")
+    await kv.initialize()
+
+    started = asyncio.get_running_loop().time()
+    fetched = await fetch_calendars(CALENDARS, kv)
+    # the slow one can't hold up the others for longer than its deadline
+    assert asyncio.get_running_loop().time() - started < 0.5
+    assert fetched == {"Fast": "BEGIN:VCALENDAR"}
+    status = await kv.get("ical/status")
+    assert status["Fast"]["status"] == "fetched"
+    assert status["Fast"]["bytes"] == len("BEGIN:VCALENDAR")
+    assert status["Slow"]["status"] == "failed"
+    assert status["Huge"]["status"] == "too large"
+
+    calendars.slow_secs = 0
+    fetched = await fetch_calendars(CALENDARS, kv)
+    assert sorted(fetched.keys()) == ["Fast", "Slow"]
+    status = await kv.get("ical/status")
+    assert status["Fast"]["status"] == "not modified"
+    assert status["Slow"]["status"] == "fetched"
+
+    # served from before when the upstream can't be reached in time
+    calendars.slow_secs = 1
+    fetched = await fetch_calendars({"Slow": CALENDARS["Slow"]}, kv)
+    assert fetched == {"Slow": "BEGIN:VCALENDAR"}
+    assert (await kv.get("ical/status"))["Slow"]["status"] == "stale"
+
+
+def calendar_ics(*summaries: str) -> str:
+    events = [
+        "BEGIN:VEVENT\r\n"
+        f"UID:{i}\r\n"
+        f"SUMMARY:{summary}\r\n"
+        "DTSTART;VALUE=DATE:20261020\r\n"
+        "DTEND;VALUE=DATE:20261021\r\n"
+        "END:VEVENT\r\n"
+        for (i, summary) in enumerate(summaries)
+    ]
+    return f"BEGIN:VCALENDAR\r\nVERSION:2.0\r\n{''.join(events)}END:VCALENDAR\r\n"
+
+
+@pytest.mark.asyncio
+async def test_parse_calendar_reused_until_changed():
+    ics = calendar_ics("MTG Prerelease", "Pokemon League", "MTG Draft")
+    try:
+        parsed = await parse_calendar("Shop", ics, ["MTG"])
+        assert [str(ev["SUMMARY"]) for ev in parsed] == ["MTG Prerelease", "MTG Draft"]
+        assert await parse_calendar("Shop", ics, ["MTG"]) is parsed
+
+        reparsed = await parse_calendar("Shop", ics, ["Pokemon"])
+        assert [str(ev["SUMMARY"]) for ev in reparsed] == ["Pokemon League"]
+        # callers with different filter strings don't evict each other
+        assert await parse_calendar("Shop", ics, ["MTG"]) is parsed
+        assert await parse_calendar("Shop", ics, ["Pokemon"]) is reparsed
+        prune_parsed(["Other"])
+        assert await parse_calendar("Shop", ics, ["MTG"]) is not parsed
+        changed = await parse_calendar("Shop", calendar_ics("Pokemon Cup"), ["Pokemon"])
+        assert [str(ev["SUMMARY"]) for ev in changed] == ["Pokemon Cup"]
+    finally:
+        shutdown_parse_pool()
+
+
+def test_summary_matcher():
+    filter_strings = ("MTG", "Magic:", "Dominaria", "Dominaria United", "Bo", "")
+    summaries = ["MTG Draft", "Board Game Night", "Magic: Commander", "Dominari", ""]
+    for strings in [filter_strings, filter_strings[:-1], ("Dominaria United",)]:
+        matcher = summary_matcher(strings)
+        assert [bool(matcher.search(s)) for s in summaries] == [
+            any([f_str in s for f_str in strings]) for s in summaries
+        ]
+    assert summary_matcher(()) is None
+    assert summary_matcher(("a.b",)).search("axb") is None
+
+
+@pytest.mark.asyncio
+async def test_mtg_current_events_filter_strings_dont_grow(monkeypatch):
+    async def sets(url, **kwargs):
+        return {"data": [{"name": "Dominaria"}, {"name": "Dominaria"}]}
+
+    used = []
+
+    async def events(**kwargs):
+        used.append(kwargs["summary_filter_strings"])
+        return {}
+
+    monkeypatch.setattr("theburgbot.ical.http_get_cached_json", sets)
+    monkeypatch.setattr("theburgbot.ical.get_current_events_from_ICS_urls", events)
+    filter_strings = ["Prerelease"]
+    for _ in range(2):
+        await mtg_current_events({}, filter_strings=filter_strings)
+    assert filter_strings == ["Prerelease"]
+    assert used == [["Prerelease", "Dominaria"], ["Prerelease", "Dominaria"]]
+
+
+@pytest.mark.asyncio
+async def test_callers_with_different_filters_dont_share_occurrences(monkeypatch):
+    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+    ics = (
+        calendar_ics("MTG Prerelease", "Pokemon League")
+        .replace("20261020", tomorrow.strftime("%Y%m%d"))
+        .replace("20261021", (tomorrow + datetime.timedelta(days=1)).strftime("%Y%m%d"))
+    )
+
+    async def fetched(urls, status_store):
+        await asyncio.sleep(0)
+        return {name: ics for name in urls.keys()}
+
+    monkeypatch.setattr("theburgbot.ical.fetch_calendars", fetched)
+    try:
+        (mtg, pokemon) = await asyncio.gather(
+            get_current_events_from_ICS_urls(
+                {"Shop": "https://shop.example.com/cal.ics"},
+                post_hours_before=72,
+                summary_filter_strings=["MTG"],
+            ),
+            get_current_events_from_ICS_urls(
+                {
+                    "Shop": "https://shop.example.com/cal.ics",
+                    "Other": "https://other.example.com/cal.ics",
+                },
+                post_hours_before=72,
+                summary_filter_strings=["Pokemon"],
+            ),
+        )
+    finally:
+        shutdown_parse_pool()
+    assert [str(ev["SUMMARY"]) for ev in mtg["Shop"]["onetime"]] == ["MTG Prerelease"]
+    assert [str(ev["SUMMARY"]) for ev in pokemon["Shop"]["onetime"]] == [
+        "Pokemon League"
+    ]
+    assert occurrence_index(["MTG"]).calendars() == ["Shop"]
+    assert occurrence_index(["Pokemon"]).calendars() == ["Shop", "Other"]
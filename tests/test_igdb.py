@@ -0,0 +1,193 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+import pytest_asyncio
+
+from theburgbot import constants
+from theburgbot.cmd_handlers import igdb
+from theburgbot.common import TTLCache, set_http_client
+from theburgbot.db import TheBurgBotDB
+
+GAMES = [
+    {"id": 1, "name": "Doom", "slug": "doom", "summary": "Demons."},
+    {"id": 2, "name": "Doom", "slug": "doom--1", "summary": "More demons."},
+    {"id": 3, "name": "Doom", "slug": "doom--2", "summary": "Even more."},
+]
+SEARCH_RESULTS = [
+    {"id": 4, "name": "Doom Eternal"},
+    {"id": 1, "name": "Doom"},
+]
+ARTWORKS = [
+    {"id": 10, "game": 1, "image_id": "a"},
+    {"id": 11, "game": 1, "image_id": "b"},
+    {"id": 12, "game": 3, "image_id": "c"},
+]
+
+
+class MockIGDB:
+    def __init__(self):
+        self.requests = []
+        self.valid_token = "token"
+        self.issued = 0
+        self.oauth_fails = False
+
+    async def handler(self, request: httpx.Request):
+        self.requests.append(request)
+        if request.url.host == "id.twitch.tv":
+            await asyncio.sleep(0.01)
+            if self.oauth_fails:
+                return httpx.Response(500)
+            self.issued += 1
+            self.valid_token = f"token-{self.issued}"
+            return httpx.Response(
+                200,
+                json={
+                    "access_token": self.valid_token,
+                    "expires_in": 5000000,
+                    "token_type": "bearer",
+                },
+            )
+        if request.headers["Authorization"] != f"Bearer {self.valid_token}":
+            return httpx.Response(401)
+        if request.content.startswith(b"search"):
+            return httpx.Response(200, json=SEARCH_RESULTS)
+        if request.url.path.endswith("/games"):
+            return httpx.Response(200, json=GAMES)
+        return httpx.Response(200, json=ARTWORKS)
+
+    @property
+    def oauth_requests(self):
+        return [r for r in self.requests if r.url.host == "id.twitch.tv"]
+
+
+@pytest_asyncio.fixture
+async def upstream(monkeypatch, tmp_path):
+    monkeypatch.setenv("TWITCH_APP_ID", "app-id")
+    monkeypatch.setenv("TWITCH_TOKEN_CACHE_FILE", str(tmp_path / ".twitch_token"))
+    mock = MockIGDB()
+    set_http_client(httpx.AsyncClient(transport=httpx.MockTransport(mock.handler)))
+    db_path = str(tmp_path / "db.sqlite3")
+    await TheBurgBotDB(db_path).initialize()
+    await igdb.igdb_init_token_manager(db_path, audit_logger=None)
+    igdb.TOKEN_MANAGER.token = igdb.Token("token", 5000000, "bearer")
+    igdb.GAME_CACHE.clear()
+    igdb.ARTWORK_CACHE.clear()
+    igdb.SEARCH_CACHE.clear()
+    igdb.TITLE_INDEX.rebuild([])
+    yield mock
+    set_http_client(None)
+
+
+@pytest.mark.asyncio
+async def test_igdb_lookup_batches_art_and_caches(upstream):
+    embeds = await igdb.igdb_lookup(
+        query="  Doom ", exact_match=False, audit_logger=None
+    )
+    assert [emb.description for emb in embeds] == [g["summary"] for g in GAMES]
+    assert embeds[0].image.url.endswith("/a.jpg")
+    assert embeds[1].image.url is None
+    assert embeds[2].image.url.endswith("/c.jpg")
+
+    assert len(upstream.requests) == 2
+    (games_req, art_req) = upstream.requests
+    assert b'where name = "Doom";' in games_req.content
+    assert b"fields *" not in games_req.content
+    assert b"where game = (1,2,3);" in art_req.content
+
+    await igdb.igdb_lookup(query="Doom", exact_match=True, audit_logger=None)
+    assert len(upstream.requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_igdb_token_single_flight_refresh_on_401(upstream):
+    upstream.valid_token = "revoked-early"
+    results = await asyncio.gather(
+        *[igdb.igdb_authed_request(path="/games", data="") for _ in range(5)]
+    )
+    assert [res.status_code for res in results] == [200] * 5
+    assert len(upstream.oauth_requests) == 1
+
+    # the refreshed token is what another process sharing the DB will pick up
+    other = igdb.IGDBTokenManager(igdb.TOKEN_MANAGER.kv_store.db_path)
+    await other.load()
+    assert other.token.access_token == "token-1"
+
+
+@pytest.mark.asyncio
+async def test_igdb_token_refresh_backoff(upstream):
+    upstream.valid_token = "revoked-early"
+    upstream.oauth_fails = True
+    for _ in range(3):
+        with pytest.raises(igdb.IGDBTokenError):
+            await igdb.igdb_authed_request(path="/games", data="")
+    # the failure starts a backoff, during which Twitch isn't asked again
+    assert len(upstream.oauth_requests) == constants.RETRY_ATTEMPTS
+    assert igdb.TOKEN_MANAGER.failures == 1
+
+    upstream.oauth_fails = False
+    igdb.TOKEN_MANAGER.retry_at = 0
+    res = await igdb.igdb_authed_request(path="/games", data="")
+    assert res.status_code == 200
+    assert igdb.TOKEN_MANAGER.failures == 0
+
+
+@pytest.mark.asyncio
+async def test_igdb_token_migrated_from_file(upstream, tmp_path):
+    token_file = tmp_path / ".twitch_token"
+    token_file.write_text(
+        json.dumps(
+            {
+                "access_token": "from-file",
+                "expires_in": 5000000,
+                "token_type": "bearer",
+                "refreshed_at": None,
+            }
+        )
+    )
+    manager = igdb.IGDBTokenManager(str(tmp_path / "db.sqlite3"))
+    await manager.load(str(token_file))
+    assert manager.token.access_token == "from-file"
+    assert not token_file.exists()
+    assert (await manager.kv_store.get("token"))["access_token"] == "from-file"
+
+
+@pytest.mark.asyncio
+async def test_igdb_title_suggestions(upstream, monkeypatch):
+    monkeypatch.setattr("theburgbot.constants.IGDB_SEARCH_DEBOUNCE_SECS", 0.05)
+    # too short to search for
+    assert await igdb.igdb_search_titles(1, "do") == []
+
+    # only the last of a burst of keystrokes searches
+    results = await asyncio.gather(
+        igdb.igdb_search_titles(1, "doo"),
+        igdb.igdb_search_titles(1, "doom e"),
+        igdb.igdb_search_titles(2, "doom e"),
+    )
+    assert results == [[], ["Doom Eternal", "Doom"], ["Doom Eternal", "Doom"]]
+    searches = [r for r in upstream.requests if r.content.startswith(b"search")]
+    assert len(searches) == 1
+    assert searches[0].content.startswith(b'search "doom e";')
+
+    # titles seen in results are now answered locally
+    assert await igdb.igdb_search_titles(1, "DOOM") == ["Doom", "Doom Eternal"]
+    assert await igdb.igdb_search_titles(1, "eter") == ["Doom Eternal"]
+    assert len(upstream.requests) == 1
+
+
+def test_ttl_cache(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("theburgbot.common.time.monotonic", lambda: now[0])
+    cache = TTLCache(ttl_secs=10, max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    # "b" was the least recently used
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+    now[0] += 11
+    assert cache.get("a", "expired") == "expired"
+    assert len(cache) == 1
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from theburgbot import memory
+from theburgbot.cmd_handlers import admin
+from theburgbot.db import TheBurgBotKeyedJSONStore
+
+
+@pytest.mark.asyncio
+async def test_stop_watcher_mid_sample(tmp_path, monkeypatch):
+    db_path = tmp_path / "db.sqlite3"
+    await TheBurgBotKeyedJSONStore(db_path=db_path, namespace="memory").initialize()
+    sampling = asyncio.Event()
+
+    async def slow_sample(db_path, baseline):
+        sampling.set()
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(memory, "_record_watch_sample", slow_sample)
+    try:
+        await memory.start_watcher(db_path, 0.0001)
+        watcher = memory._WATCHER
+        await asyncio.wait_for(sampling.wait(), 1)
+        await memory.stop_watcher(db_path)
+        await asyncio.sleep(0.01)
+        assert watcher.done()
+        assert not memory.watcher_running()
+    finally:
+        memory.stop_tracing()
+
+
+@pytest.mark.asyncio
+async def test_memory_command_usage(tmp_path):
+    for args in [[], ["soon"], ["0"], ["-1"], ["nan"], ["inf"]]:
+        assert (
+            await admin._memory_watch(args, tmp_path / "db.sqlite3", None)
+        ).startswith("Usage:")
+    for args in [["many"], ["0"], ["2.5"]]:
+        assert (
+            await admin._memory_start(args, tmp_path / "db.sqlite3", None)
+        ).startswith("Usage:")
+    assert not memory.is_tracing()
+
+
+@pytest.mark.asyncio
+async def test_memory_stop_stops_watcher(tmp_path):
+    db_path = tmp_path / "db.sqlite3"
+    await TheBurgBotKeyedJSONStore(db_path=db_path, namespace="memory").initialize()
+    try:
+        await memory.start_watcher(db_path, 0.0002)
+        await asyncio.sleep(0.05)
+        assert len(await memory.watch_history(db_path))
+        assert (await admin._memory_stop([], db_path, None)).endswith(
+            "Memory watch stopped."
+        )
+        assert not memory.watcher_running()
+        assert not memory.is_tracing()
+        await memory.resume_watcher(db_path)
+        assert not memory.watcher_running()
+    finally:
+        await memory.stop_watcher(db_path)
+        memory.stop_tracing()
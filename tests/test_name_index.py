@@ -0,0 +1,72 @@
+from theburgbot.name_index import (FuzzyIndex, PrefixIndex, levenshtein,
+                                   normalize_text)
+
+NAMES = [
+    "Lightning Bolt",
+    "Lightning Helix",
+    "Chain Lightning",
+    "Urza's Saga",
+    "Jötun Grunt",
+    "Fire // Ice",
+]
+
+
+def test_normalize_text():
+    assert normalize_text("Urza’s  SAGA") == normalize_text("urzas saga")
+    assert normalize_text("Jötun Grunt") == "jotun grunt"
+    assert normalize_text("Fire // Ice") == "fire ice"
+
+
+def test_complete_ranking_and_limit():
+    index = PrefixIndex(NAMES)
+    # names starting with the query come before names with a word that does
+    assert index.complete("LIGHT") == [
+        "Lightning Bolt",
+        "Lightning Helix",
+        "Chain Lightning",
+    ]
+    assert index.complete("lightning", limit=2) == ["Lightning Bolt", "Lightning Helix"]
+    assert index.complete("bolt") == ["Lightning Bolt"]
+    assert index.complete("urzas") == ["Urza's Saga"]
+    assert index.complete("jot") == ["Jötun Grunt"]
+    assert index.complete("ice") == ["Fire // Ice"]
+    assert index.complete("") == []
+    assert index.complete("  ") == []
+    assert index.complete("zzz") == []
+
+
+def test_add_matches_rebuild():
+    grown = PrefixIndex(NAMES[:2])
+    version = grown.version
+    assert grown.add(NAMES + NAMES[:1]) == len(NAMES) - 2
+    assert grown.version == version + 1
+    assert grown.add(NAMES) == 0
+    assert grown.version == version + 1
+
+    built = PrefixIndex(NAMES)
+    assert len(grown) == len(built) == len(NAMES)
+    assert "Chain Lightning" in grown
+    for query in ["l", "lightning", "saga", "fire", "g"]:
+        assert grown.complete(query) == built.complete(query)
+
+
+def test_levenshtein():
+    assert levenshtein("bolt", "bolt") == 0
+    assert levenshtein("bolt", "blot") == 2
+    assert levenshtein("kitten", "sitting") == 3
+    assert levenshtein("kitten", "sitting", max_dist=1) > 1
+    assert levenshtein("a", "abcdef", max_dist=2) > 2
+
+
+def test_fuzzy_match():
+    index = FuzzyIndex(NAMES + ["Fire", "Ice"])
+    assert index.match("lightning bolt") == ("Lightning Bolt", 0)
+    assert index.match("urzas saga") == ("Urza's Saga", 0)
+    assert index.match("Lightnig Bolt") == ("Lightning Bolt", 1)
+    assert index.match("lightning hleix") == ("Lightning Helix", 2)
+    assert index.match("chian lightning")[0] == "Chain Lightning"
+    assert index.match("jotun grnt") == ("Jötun Grunt", 1)
+    assert index.match("ice") == ("Ice", 0)
+    assert index.match("Black Lotus") is None
+    assert index.match("bolt") is None
+    assert index.match("") is None
@@ -0,0 +1,91 @@
+import asyncio
+import types
+
+import pytest
+
+from theburgbot.cmd_handlers import new_invite
+from theburgbot.cmd_handlers.new_invite import InflightInvites
+from theburgbot.db import TheBurgBotDB
+
+
+@pytest.mark.asyncio
+async def test_expires_and_bounded():
+    inflight = InflightInvites(ttl_secs=0.05, max_entries=2)
+    await inflight.set("a", {"n": 1})
+    await inflight.set("b", {"n": 2})
+    await inflight.set("c", {"n": 3})
+    assert len(inflight) == 2
+    assert await inflight.get("a") is None
+    assert await inflight.get("b") == {"n": 2}
+    assert await inflight.pop("b") == {"n": 2}
+    assert await inflight.pop("b") is None
+
+    await asyncio.sleep(0.06)
+    assert await inflight.get("c") is None
+
+
+@pytest.mark.asyncio
+async def test_write_through_and_restore(tmp_path):
+    db_path = tmp_path / "db.sqlite3"
+    await TheBurgBotDB(db_path).initialize()
+    inflight = InflightInvites(ttl_secs=60, max_entries=1, db_path=db_path)
+    await inflight.set("a", {"n": 1})
+    await inflight.set("b", {"n": 2})
+    # evicted from memory, but not from the DB
+    assert await inflight.get("a") == {"n": 1}
+
+    restarted = InflightInvites(ttl_secs=60, db_path=db_path)
+    restored = dict(await restarted.restore())
+    assert sorted(restored.keys()) == ["a", "b"]
+    assert 59 < restored["a"] <= 60
+    assert await restarted.pop("a") == {"n": 1}
+    assert await InflightInvites(db_path=db_path).get("a") is None
+
+    short = InflightInvites(ttl_secs=0.01, db_path=db_path)
+    await short.set("c", {"n": 3})
+    await asyncio.sleep(0.02)
+    assert [restored[0] for restored in await short.restore()] == ["b"]
+
+
+class FakeResponse:
+    def __init__(self):
+        self.edits = []
+
+    async def edit_message(self, **kwargs):
+        self.edits.append(kwargs)
+
+
+class FakeInteraction:
+    def __init__(self):
+        self.user = types.SimpleNamespace(display_name="Burger", id=1234)
+        self.response = FakeResponse()
+
+
+@pytest.mark.asyncio
+async def test_accept_keeps_state_until_stored(monkeypatch):
+    inflight = InflightInvites(ttl_secs=60)
+    monkeypatch.setattr(new_invite, "INFLIGHT_INVITES", inflight)
+    state = {"db_path": "db", "invite_for": "Friend", "try_phrase_json": '["a b"]'}
+    await inflight.set("id", state)
+    view = new_invite.create_buttons_view("id")
+
+    async def failing_accept(interaction, inflight):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(new_invite, "accept_invite", failing_accept)
+    with pytest.raises(RuntimeError):
+        await view.accept_invite_button.callback(FakeInteraction())
+    # still there to be accepted again
+    assert await inflight.get("id") == state
+    assert not view.is_finished()
+    assert new_invite.ACCEPTING_INVITES == set()
+
+    async def accept(interaction, inflight):
+        return "key"
+
+    monkeypatch.setattr(new_invite, "accept_invite", accept)
+    interaction = FakeInteraction()
+    await view.accept_invite_button.callback(interaction)
+    assert await inflight.get("id") is None
+    assert view.is_finished()
+    assert interaction.response.edits[-1]["view"] is None
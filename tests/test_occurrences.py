@@ -0,0 +1,194 @@
+import datetime
+import time
+
+import icalendar
+import pytest
+import pytz
+
+from theburgbot.occurrences import OccurrenceIndex
+
+PACIFIC = pytz.timezone("America/Los_Angeles")
+NOW = datetime.datetime(2026, 10, 19, 12, tzinfo=datetime.timezone.utc)
+
+
+def calendar_events(*vevents: str):
+    ics = "\r\n".join(
+        [
+            "BEGIN:VCALENDAR",
+            "VERSION:2.0",
+            "PRODID:-//test//EN",
+            *vevents,
+            "END:VCALENDAR",
+        ]
+    )
+    return [
+        ev
+        for ev in icalendar.Calendar.from_ical(ics).walk()
+        if isinstance(ev, icalendar.Event)
+    ]
+
+
+def vevent(uid: str, summary: str, *props: str) -> str:
+    return "\r\n".join(
+        ["BEGIN:VEVENT", f"UID:{uid}", f"SUMMARY:{summary}", *props, "END:VEVENT"]
+    )
+
+
+# Fridays at 18:00 Pacific, across the end of DST on Nov 1st
+WEEKLY = vevent(
+    "fnm@shop",
+    "MTG Friday Night Magic",
+    "DTSTART;TZID=America/Los_Angeles:20260904T180000",
+    "DTEND;TZID=America/Los_Angeles:20260904T220000",
+    "RRULE:FREQ=WEEKLY;BYDAY=FR;UNTIL=20261231T000000Z",
+    "EXDATE;TZID=America/Los_Angeles:20261030T180000",
+    "RDATE;TZID=America/Los_Angeles:20261029T180000",
+)
+
+
+def starts(occurrences):
+    return [occ.start.astimezone(PACIFIC).replace(tzinfo=None) for occ in occurrences]
+
+
+def test_weekly_rrule_exdate_rdate():
+    index = OccurrenceIndex(horizon=datetime.timedelta(days=30))
+    assert index.update_calendar("Shop", calendar_events(WEEKLY), NOW) == 1
+    occurrences = index.overlapping(NOW, NOW + datetime.timedelta(days=21))
+    assert starts(occurrences) == [
+        datetime.datetime(2026, 10, 23, 18),
+        datetime.datetime(2026, 10, 29, 18),
+        datetime.datetime(2026, 11, 6, 18),
+    ]
+    assert all([occ.recurring for occ in occurrences])
+    # still 18:00 local time once DST has ended
+    assert occurrences[-1].start == datetime.datetime(
+        2026, 11, 7, 2, tzinfo=datetime.timezone.utc
+    )
+    assert occurrences[-1].event["DTEND"].dt == PACIFIC.localize(
+        datetime.datetime(2026, 11, 6, 22)
+    )
+    assert str(occurrences[-1].event["SUMMARY"]) == "MTG Friday Night Magic"
+    # the old recurring check would've called it current; nothing's on within 2 days
+    assert index.upcoming(NOW, datetime.timedelta(hours=48)) == []
+    assert len(index.upcoming(NOW, datetime.timedelta(hours=4 * 24 + 14))) == 1
+
+
+@pytest.fixture
+def utc_local_time(monkeypatch):
+    # all-day events are in local time
+    monkeypatch.setenv("TZ", "UTC")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_all_day_until_date_and_overrides(utc_local_time):
+    index = OccurrenceIndex(horizon=datetime.timedelta(days=30))
+    events = calendar_events(
+        vevent(
+            "league@shop",
+            "Pokemon League",
+            "DTSTART;VALUE=DATE:20261015",
+            "DTEND;VALUE=DATE:20261016",
+            "RRULE:FREQ=DAILY;UNTIL=20261022",
+        ),
+        vevent(
+            "league@shop",
+            "Pokemon League (moved)",
+            "RECURRENCE-ID;VALUE=DATE:20261021",
+            "DTSTART;VALUE=DATE:20261025",
+            "DTEND;VALUE=DATE:20261026",
+        ),
+        vevent(
+            "prerelease@shop",
+            "MTG Prerelease",
+            "DTSTART:20261018T170000Z",
+            "DTEND:20261020T010000Z",
+        ),
+    )
+    index.update_calendar("Shop", events, NOW)
+    occurrences = index.overlapping(NOW, NOW + datetime.timedelta(days=30))
+    assert [
+        (str(occ.event["SUMMARY"]), occ.event["DTSTART"].dt) for occ in occurrences
+    ] == [
+        # started the day before, but is still running
+        ("MTG Prerelease", datetime.datetime(2026, 10, 18, 17, tzinfo=pytz.utc)),
+        ("Pokemon League", datetime.date(2026, 10, 19)),
+        ("Pokemon League", datetime.date(2026, 10, 20)),
+        ("Pokemon League", datetime.date(2026, 10, 22)),
+        ("Pokemon League (moved)", datetime.date(2026, 10, 25)),
+    ]
+    assert [occ.recurring for occ in occurrences] == [False, True, True, True, True]
+
+
+def test_incremental_updates():
+    index = OccurrenceIndex(horizon=datetime.timedelta(days=30))
+    one_off = vevent(
+        "draft@shop", "MTG Draft", "DTSTART:20261020T010000Z", "DTEND:20261020T040000Z"
+    )
+    assert index.update_calendar("Shop", calendar_events(WEEKLY, one_off), NOW) == 2
+    total = len(index)
+    assert index.update_calendar("Shop", calendar_events(WEEKLY, one_off), NOW) == 0
+    assert index.update_calendar("Shop", [], NOW, version="v1") == 0
+    assert len(index) == 0
+    # the same version isn't looked at again
+    assert (
+        index.update_calendar("Shop", calendar_events(WEEKLY), NOW, version="v1") == 0
+    )
+    assert len(index) == 0
+
+    moved = one_off.replace("20261020T010000Z", "20261021T010000Z").replace(
+        "20261020T040000Z", "20261021T040000Z"
+    )
+    assert index.update_calendar("Shop", calendar_events(WEEKLY, moved), NOW) == 2
+    assert len(index) == total
+    assert [occ.start for occ in index.upcoming(NOW, datetime.timedelta(hours=48))] == [
+        datetime.datetime(2026, 10, 21, 1, tzinfo=datetime.timezone.utc)
+    ]
+
+    index.update_calendar("Other", calendar_events(one_off), NOW)
+    index.remove_calendar("Shop")
+    assert index.calendars() == ["Other"]
+    assert [occ.calendar for occ in index.overlapping(NOW, NOW)] == []
+    assert len(index.upcoming(NOW, datetime.timedelta(hours=48))) == 1
+
+    # once half the horizon has passed, everything is expanded further ahead
+    later = NOW + datetime.timedelta(days=16)
+    index.update_calendar("Other", calendar_events(one_off), later)
+    assert index.expanded_until == later + index.horizon
+    assert len(index) == 0
+
+
+def test_overlapping_with_a_long_event():
+    index = OccurrenceIndex(horizon=datetime.timedelta(days=30))
+    events = calendar_events(
+        vevent(
+            "season@shop",
+            "League Season",
+            "DTSTART:20261001T000000Z",
+            "DTEND:20261201T000000Z",
+        ),
+        *[
+            vevent(
+                f"draft{day}@shop",
+                f"Draft {day}",
+                f"DTSTART:202610{day:02}T180000Z",
+                f"DTEND:202610{day:02}T220000Z",
+            )
+            for day in range(1, 32)
+        ],
+    )
+    index.update_calendar("Shop", events, NOW)
+    everything = index.overlapping(
+        NOW - datetime.timedelta(days=60), NOW + index.horizon
+    )
+    for hours in range(0, 24 * 14, 5):
+        start = NOW + datetime.timedelta(hours=hours)
+        end = start + datetime.timedelta(hours=hours % 7)
+        assert index.overlapping(start, end) == [
+            occ for occ in everything if occ.end > start and occ.start <= end
+        ]
+    assert [
+        str(occ.event["SUMMARY"]) for occ in index.upcoming(NOW, datetime.timedelta())
+    ] == ["League Season"]
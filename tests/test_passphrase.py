@@ -0,0 +1,65 @@
+import json
+import math
+import os
+from pathlib import Path
+
+import pytest
+
+from theburgbot.db import TheBurgBotDB
+from theburgbot.passphrase import PassphraseGenerator
+
+TEST_DB_PATH = Path(__file__).resolve().parent / "__test_passphrase__.sqlite3"
+WORDS = ["apple", "berry", "cherry", "grape", "lemon", "mango"]
+
+
+@pytest.fixture(autouse=True)
+def auto_remove_on_both_ends():
+    try:
+        os.remove(TEST_DB_PATH)
+    except FileNotFoundError:
+        pass
+    yield
+    try:
+        os.remove(TEST_DB_PATH)
+    except FileNotFoundError:
+        pass
+
+
+def test_generate():
+    gen = PassphraseGenerator(WORDS + ["apple"])
+    assert len(gen) == len(WORDS)
+    for num_words in range(1, len(WORDS) + 1):
+        phrase = gen.generate(num_words)
+        assert len(phrase) == num_words
+        assert len(set(phrase)) == num_words
+        assert set(phrase) <= set(WORDS)
+    with pytest.raises(ValueError):
+        gen.generate(len(WORDS) + 1)
+
+    assert gen.entropy_bits(1) == pytest.approx(math.log2(6))
+    assert gen.entropy_bits(3) == pytest.approx(math.log2(6 * 5 * 4))
+
+
+def test_never_reissues():
+    gen = PassphraseGenerator(WORDS[:3])
+    # only 3! orderings of all three words are possible
+    seen = set()
+    for _ in range(6):
+        phrase_json = json.dumps(gen.generate(3))
+        assert phrase_json not in seen
+        seen.add(phrase_json)
+        gen.mark_issued(phrase_json)
+    assert len(seen) == 6
+
+
+@pytest.mark.asyncio
+async def test_load_issued():
+    db = TheBurgBotDB(TEST_DB_PATH)
+    await db.initialize()
+    for phrase in [["apple", "berry"], ["berry", "apple"]]:
+        await db.add_new_invite(json.dumps(phrase), "name", "-1", "friend")
+
+    gen = PassphraseGenerator(WORDS[:2])
+    await gen.load_issued(TEST_DB_PATH)
+    assert gen.is_issued(json.dumps(["apple", "berry"]))
+    assert gen.generate(1) in [["apple"], ["berry"]]
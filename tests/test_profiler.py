@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from theburgbot.profiler import profile_event_loop
+
+
+def _busy_work(n: int) -> int:
+    return sum([i * i for i in range(n)])
+
+
+@pytest.mark.asyncio
+async def test_profile_event_loop():
+    async def busy():
+        for _ in range(20):
+            _busy_work(10_000)
+            await asyncio.sleep(0.005)
+
+    worker = asyncio.create_task(busy())
+    profiling = asyncio.create_task(
+        profile_event_loop(0.2, limit=10, sample_interval=0.002)
+    )
+    await asyncio.sleep(0.01)
+    # only one profile at a time
+    assert await profile_event_loop(0.01) is None
+    result = await profiling
+    await worker
+
+    assert result.seconds == 0.2
+    assert result.num_calls > 0
+    assert result.num_samples > 0
+    assert "_busy_work" in result.by_cumulative
+    assert "_busy_work" in result.by_self
+    # "frame;frame;... count" lines, as flame graph tools expect
+    assert all(
+        [line.rsplit(" ", 1)[1].isdigit() for line in result.collapsed.splitlines()]
+    )
+
+    # and another can run once it's done
+    assert await profile_event_loop(0.01) is not None
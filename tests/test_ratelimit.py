@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+import pytest
+
+from theburgbot.ratelimit import RequestCoalescer, TokenBucket
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_rate():
+    bucket = TokenBucket(rate=50, burst=5)
+    start = time.monotonic()
+    await asyncio.gather(*[bucket.acquire() for _ in range(15)])
+    elapsed = time.monotonic() - start
+    # the burst is free, the remaining 10 are spaced at 50/s
+    assert 0.18 <= elapsed < 0.5
+    stats = bucket.stats()
+    assert stats["acquired"] == 15
+    assert stats["max_queue_depth"] >= 10
+    assert stats["queue_depth"] == 0
+    assert stats["max_wait"] >= 0.18
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_fifo():
+    bucket = TokenBucket(rate=100, burst=1)
+    order = []
+
+    async def _acquirer(i):
+        await bucket.acquire()
+        order.append(i)
+
+    await asyncio.gather(*[_acquirer(i) for i in range(10)])
+    assert order == list(range(10))
+
+
+@pytest.mark.asyncio
+async def test_request_coalescer():
+    coalescer = RequestCoalescer()
+    calls = []
+
+    async def _request(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return f"result:{key}"
+
+    results = await asyncio.gather(
+        *[coalescer.run("a", lambda: _request("a")) for _ in range(5)],
+        coalescer.run("b", lambda: _request("b")),
+    )
+    assert results == ["result:a"] * 5 + ["result:b"]
+    assert calls == ["a", "b"]
+    assert coalescer.stats() == {"inflight": 0, "coalesced": 4}
+
+    # once complete, the same key makes a new request
+    await coalescer.run("a", lambda: _request("a"))
+    assert calls == ["a", "b", "a"]
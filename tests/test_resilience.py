@@ -0,0 +1,109 @@
+import asyncio
+
+import httpx
+import pytest
+
+from theburgbot import constants
+from theburgbot.resilience import (CircuitOpenError, UpstreamUnavailable,
+                                   breaker_for, resilient_call)
+
+HOST = "upstream.example.com"
+
+
+class Flaky:
+    def __init__(self, results):
+        self.results = list(results)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        result = self.results.pop(0) if len(self.results) > 1 else self.results[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@pytest.mark.asyncio
+async def test_retries_then_succeeds():
+    flaky = Flaky([httpx.ConnectError("down"), httpx.Response(503), "ok"])
+    assert await resilient_call(HOST, flaky) == "ok"
+    assert flaky.calls == 3
+    assert breaker_for(HOST).state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_gives_up_without_retrying_other_errors():
+    flaky = Flaky([httpx.ConnectError("down")])
+    with pytest.raises(UpstreamUnavailable):
+        await resilient_call(HOST, flaky)
+    assert flaky.calls == constants.RETRY_ATTEMPTS
+
+    # a retryable response is handed back once out of attempts
+    res = await resilient_call("other.example.com", Flaky([httpx.Response(502)]))
+    assert res.status_code == 502
+
+    not_retryable = Flaky([ValueError("bad request")])
+    with pytest.raises(ValueError):
+        await resilient_call("another.example.com", not_retryable)
+    assert not_retryable.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_deadline():
+    async def slow():
+        await asyncio.sleep(1)
+
+    with pytest.raises(UpstreamUnavailable):
+        await resilient_call(HOST, slow, deadline_secs=0.05)
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker(monkeypatch):
+    monkeypatch.setattr("theburgbot.constants.BREAKER_FAILURE_THRESHOLD", 2)
+    monkeypatch.setattr("theburgbot.constants.BREAKER_RESET_SECS", 0.05)
+    down = Flaky([httpx.ConnectError("down")])
+    with pytest.raises(UpstreamUnavailable):
+        await resilient_call(HOST, down, attempts=2)
+    breaker = breaker_for(HOST)
+    assert breaker.state == "open"
+
+    with pytest.raises(CircuitOpenError):
+        await resilient_call(HOST, down)
+    assert down.calls == 2
+    assert breaker.rejected == 1
+
+    await asyncio.sleep(0.06)
+    assert breaker.state == "half-open"
+    # a failed trial re-opens it straight away
+    with pytest.raises(UpstreamUnavailable):
+        await resilient_call(HOST, down, attempts=1)
+    assert breaker.state == "open"
+
+    await asyncio.sleep(0.06)
+    assert await resilient_call(HOST, Flaky(["ok"])) == "ok"
+    assert breaker.state == "closed"
+    assert breaker.times_opened == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_trial(monkeypatch):
+    monkeypatch.setattr("theburgbot.constants.BREAKER_FAILURE_THRESHOLD", 1)
+    monkeypatch.setattr("theburgbot.constants.BREAKER_RESET_SECS", 0.05)
+    host = "cancelled.example.com"
+    with pytest.raises(UpstreamUnavailable):
+        await resilient_call(host, Flaky([httpx.ConnectError("down")]), attempts=1)
+    await asyncio.sleep(0.06)
+    breaker = breaker_for(host)
+    assert breaker.state == "half-open"
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    trial = asyncio.create_task(resilient_call(host, slow))
+    await asyncio.sleep(0.01)
+    trial.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await trial
+    # the next call gets to be the trial, rather than the host failing fast forever
+    assert await resilient_call(host, Flaky(["ok"])) == "ok"
+    assert breaker.state == "closed"
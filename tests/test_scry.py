@@ -0,0 +1,122 @@
+import json
+import types
+from collections import defaultdict, deque
+
+import httpx
+import pytest
+
+from theburgbot import scry_index
+from theburgbot.cmd_handlers import scry
+from theburgbot.common import set_http_client
+
+AUTHOR = types.SimpleNamespace(
+    display_name="Tester",
+    display_avatar=types.SimpleNamespace(url="https://example.com/avatar.png"),
+)
+
+
+class MockScryfall:
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.requested = []
+
+    async def handler(self, request: httpx.Request):
+        assert request.url.path == "/cards/collection"
+        names = [ident["name"] for ident in json.loads(request.content)["identifiers"]]
+        self.requested.append(names)
+        if self.status_code != 200:
+            return httpx.Response(self.status_code, json={"object": "error"})
+        return httpx.Response(
+            200, json={"data": [{"name": name} for name in names], "not_found": []}
+        )
+
+
+@pytest.fixture
+def scryfall(monkeypatch):
+    mock = MockScryfall()
+    monkeypatch.setattr(scry_index, "CARD_INDEX", None)
+    monkeypatch.setattr(scry_index, "CARD_FUZZY", scry_index.FuzzyIndex())
+    monkeypatch.setattr(scry, "_CHANNEL_LOOKUPS", defaultdict(deque))
+    set_http_client(httpx.AsyncClient(transport=httpx.MockTransport(mock.handler)))
+    yield mock
+    set_http_client(None)
+
+
+async def _no_audit(event, obj):
+    pass
+
+
+@pytest.mark.asyncio
+async def test_inline_lookup_upstream_error(scryfall):
+    scryfall.status_code = 400
+    embeds = await scry.inline_scry_lookup(
+        AUTHOR, 1, ["Lightning Bolt"], audit_logger=_no_audit
+    )
+    assert embeds == []
+    assert scryfall.requested == [["Lightning Bolt"]]
+
+
+class AuditLog:
+    def __init__(self):
+        self.events = {}
+
+    async def __call__(self, event, obj):
+        self.events[event] = obj
+
+
+@pytest.mark.asyncio
+async def test_inline_lookup_dedupes_and_batches(scryfall, monkeypatch):
+    monkeypatch.setattr(scry, "SCRYFALL_COLLECTION_MAX", 2)
+    audit_log = AuditLog()
+    embeds = await scry.inline_scry_lookup(
+        AUTHOR,
+        1,
+        ["Lightning Bolt", "lightning  BOLT", "Counterspell", "", "Dark Ritual"],
+        audit_logger=audit_log,
+    )
+    assert [e.title for e in embeds] == [
+        "Lightning Bolt",
+        "Counterspell",
+        "Dark Ritual",
+    ]
+    # one request per SCRYFALL_COLLECTION_MAX names, each name only once
+    assert scryfall.requested == [["Lightning Bolt", "Counterspell"], ["Dark Ritual"]]
+    assert "CAPPED" not in audit_log.events
+
+
+@pytest.mark.asyncio
+async def test_inline_lookup_fuzzy(scryfall, monkeypatch):
+    monkeypatch.setattr(
+        scry_index,
+        "CARD_FUZZY",
+        scry_index.FuzzyIndex(["Lightning Bolt", "Counterspell"]),
+    )
+    audit_log = AuditLog()
+    embeds = await scry.inline_scry_lookup(
+        AUTHOR, 1, ["Lightnig Bolt", "Lightning Bolt"], audit_logger=audit_log
+    )
+    assert [e.title for e in embeds] == ["Lightning Bolt"]
+    assert scryfall.requested == [["Lightning Bolt"]]
+    assert audit_log.events["FUZZY_MATCH"] == {
+        "matches": {"Lightnig Bolt": "Lightning Bolt"}
+    }
+
+
+@pytest.mark.asyncio
+async def test_inline_lookup_caps(scryfall, monkeypatch):
+    monkeypatch.setattr("theburgbot.constants.INLINE_SCRY_MAX_PER_MESSAGE", 2)
+    monkeypatch.setattr("theburgbot.constants.INLINE_SCRY_MAX_PER_CHANNEL_MINUTE", 3)
+    audit_log = AuditLog()
+    names = ["Lightning Bolt", "Counterspell", "Dark Ritual"]
+    embeds = await scry.inline_scry_lookup(AUTHOR, 1, names, audit_logger=audit_log)
+    assert [e.title for e in embeds] == names[:2]
+    assert audit_log.events["CAPPED"]["looked_up"] == names[:2]
+
+    # only one more lookup is left in this channel's minute...
+    embeds = await scry.inline_scry_lookup(AUTHOR, 1, names[1:], audit_logger=audit_log)
+    assert [e.title for e in embeds] == ["Counterspell"]
+    assert await scry.inline_scry_lookup(AUTHOR, 1, names, audit_logger=audit_log) == []
+    # ...but other channels have their own
+    embeds = await scry.inline_scry_lookup(AUTHOR, 2, names, audit_logger=audit_log)
+    assert len(embeds) == 2
+    assert len(scryfall.requested) == 3
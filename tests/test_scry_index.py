@@ -0,0 +1,104 @@
+import json
+import types
+from pathlib import Path
+
+import pytest
+
+from theburgbot import scry_index
+from theburgbot.scry_index import (ScryCardIndex, iter_bulk_cards,
+                                   normalize_name)
+
+FIXTURE_PATH = (
+    Path(__file__).resolve().parent / "fixtures" / "scryfall_oracle_cards.json"
+)
+
+
+def test_iter_bulk_cards_any_formatting(tmp_path):
+    expected = [card["name"] for card in iter_bulk_cards(FIXTURE_PATH)]
+    assert len(expected) == 5
+
+    pretty_path = tmp_path / "pretty.json"
+    with open(FIXTURE_PATH, "r") as src, open(pretty_path, "w") as dst:
+        json.dump(json.load(src), dst, indent=4)
+    # a tiny chunk size forces objects to be split across reads
+    assert [
+        card["name"] for card in iter_bulk_cards(pretty_path, chunk_size=7)
+    ] == expected
+
+
+def test_build_and_lookup(tmp_path):
+    index = ScryCardIndex.build(FIXTURE_PATH, tmp_path, {"updated_at": "test"})
+    assert len(index) == 5
+
+    bolt = index.get("Lightning Bolt")
+    assert bolt["name"] == "Lightning Bolt"
+    assert bolt["image_uris"] == {
+        "png": "https://cards.scryfall.io/png/front/e/3/e3285e6b.png"
+    }
+    assert bolt["prices"] == {"usd": "1.73", "usd_foil": "4.20"}
+    assert list(bolt["related_uris"].keys()) == ["gatherer"]
+    assert "oracle_text" not in bolt
+
+    assert index.get("  lightning   BOLT ")["name"] == "Lightning Bolt"
+    assert index.get("Lightning") is None
+
+    delver = index.get("Delver of Secrets")
+    assert delver["name"] == "Delver of Secrets // Insectile Aberration"
+    assert [face["name"] for face in delver["card_faces"]] == [
+        "Delver of Secrets",
+        "Insectile Aberration",
+    ]
+    assert index.get("Fire")["name"] == "Fire // Ice"
+    # a card named exactly after another card's face takes precedence
+    assert index.get("Ice")["name"] == "Ice"
+
+
+def test_load_and_rebuild(tmp_path):
+    assert ScryCardIndex.load(tmp_path) is None
+    ScryCardIndex.build(FIXTURE_PATH, tmp_path, {"updated_at": "first"})
+    loaded = ScryCardIndex.load(tmp_path)
+    assert loaded.source == {"updated_at": "first"}
+    assert loaded.get("Black Lotus")["name"] == "Black Lotus"
+    assert normalize_name("Black Lotus") in loaded.entries
+
+    rebuilt = ScryCardIndex.build(FIXTURE_PATH, tmp_path, {"updated_at": "second"})
+    assert len(list(tmp_path.glob("cards-*.jsonl"))) == 1
+    assert ScryCardIndex.load(tmp_path).source == {"updated_at": "second"}
+    assert rebuilt.get("Black Lotus")["name"] == "Black Lotus"
+
+
+@pytest.mark.asyncio
+async def test_swapped_index_is_closed(tmp_path, monkeypatch):
+    monkeypatch.setenv("THEBURGBOT_SCRY_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(scry_index, "CARD_INDEX", None)
+    ScryCardIndex.build(FIXTURE_PATH, tmp_path, {"updated_at": "first"})
+    first = await scry_index.load_card_index()
+    second = await scry_index.load_card_index()
+    assert scry_index.CARD_INDEX is second
+    assert first._data_f.closed
+    assert second.get("Black Lotus")["name"] == "Black Lotus"
+
+    class FakeCache:
+        async def get(self, url, **kwargs):
+            return types.SimpleNamespace(path=FIXTURE_PATH)
+
+        async def evict(self, url, **kwargs):
+            pass
+
+    async def bulk_list(url, **kwargs):
+        return {
+            "data": [
+                {
+                    "type": "oracle_cards",
+                    "updated_at": "second",
+                    "download_uri": "https://example.com/cards.json",
+                }
+            ]
+        }
+
+    monkeypatch.setattr(scry_index, "http_get_cached_json", bulk_list)
+    monkeypatch.setattr(scry_index, "http_cache", FakeCache)
+    refreshed = await scry_index.refresh_card_index()
+    assert refreshed is not second
+    assert second._data_f.closed
+    refreshed.close()
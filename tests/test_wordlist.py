@@ -0,0 +1,48 @@
+from theburgbot.passphrase import PassphraseGenerator
+from theburgbot.wordlist import WordList, filter_words, write_wordlist
+
+CORPUS = [
+    "apple",
+    "Boston",
+    "berry",
+    "fig",
+    "apple",
+    "cherries",
+    "grape",
+    "darn",
+    "über",
+]
+BADWORDS = ["grape", ""]
+
+
+def test_filter_words():
+    assert filter_words(CORPUS, BADWORDS, 4, 7) == ["apple", "berry", "darn", "über"]
+
+
+def test_write_and_load(tmp_path):
+    path = tmp_path / "words.bin"
+    assert write_wordlist(path, CORPUS, BADWORDS, 4, 7) == 4
+    words = WordList.load(path, 4, 7)
+    assert len(words) == 4
+    assert list(words) == ["apple", "berry", "darn", "über"]
+    assert words[-1] == "über"
+    assert words.info()["word_lengths"] == (4, 7)
+    assert len(PassphraseGenerator(words).generate(4)) == 4
+
+    # built for other word lengths, so must be rebuilt for these
+    assert WordList.load(path, 5, 7) is None
+    assert WordList.load(tmp_path / "missing.bin", 4, 7) is None
+
+
+def test_load_rejects_corrupt(tmp_path):
+    path = tmp_path / "words.bin"
+    write_wordlist(path, CORPUS, BADWORDS, 4, 7)
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xFF
+    path.write_bytes(bytes(data))
+    assert WordList.load(path, 4, 7) is None
+
+    path.write_bytes(b"")
+    assert WordList.load(path, 4, 7) is None
+    path.write_bytes(b"TBBWORDS")
+    assert WordList.load(path, 4, 7) is None
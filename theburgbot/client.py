@@ -10,16 +10,21 @@ from dataclasses import dataclass
 import discord
 from discord.ext import commands
 
-from theburgbot import constants
-from theburgbot.cmd_handlers.igdb import igdb_refresh_token
-from theburgbot.cmd_handlers.scry import scry_lookup
-from theburgbot.common import strip_html
+from theburgbot import constants, memory
+from theburgbot.cmd_handlers.igdb import (igdb_init_token_manager,
+                                          igdb_title_index_refresher)
+from theburgbot.cmd_handlers.new_invite import restore_invite_views
+from theburgbot.cmd_handlers.scry import inline_scry_lookup
+from theburgbot.common import (close_http_client, create_http_client,
+                               set_http_client, strip_html)
 from theburgbot.config import discord_ids, reaction_roles
 from theburgbot.db import (TheBurgBotDB, audit_log_start_end_async,
                            command_create_internal_logger)
 from theburgbot.httpapi import TheBurgBotHTTP
-from theburgbot.ical import iCalSyncer
+from theburgbot.ical import iCalSyncer, shutdown_parse_pool
 from theburgbot.invite_thread import invite_thread_run
+from theburgbot.scry_index import card_index_refresher
+from theburgbot.startup import STARTUP
 
 LOGGER = logging.getLogger("discord")
 
@@ -48,12 +53,22 @@ class TheBurgBotClient(commands.Bot):
             filter_strings=["Prerelease"], db_path=self.db_path
         )
 
+    async def setup_hook(self):
+        self.http_client = create_http_client()
+        set_http_client(self.http_client)
+
+    async def close(self):
+        await close_http_client()
+        shutdown_parse_pool()
+        await super().close()
+
     async def on_ready(self):
         if self.initialized:
             LOGGER.info("TheBurgBot is ready again")
             return
 
-        await TheBurgBotDB(self.db_path).initialize()
+        with STARTUP.phase("DB init"):
+            await TheBurgBotDB(self.db_path).initialize()
 
         if self.sync_commands and self.tree is not None:
             LOGGER.info("Syncing commands...")
@@ -79,22 +94,25 @@ class TheBurgBotClient(commands.Bot):
 
         self.loop = asyncio.get_running_loop()
         self.invite_req_thread.start()
-        self.http_server = TheBurgBotHTTP(
-            redeem_req=redeem_req_handler,
-            parent=self,
-            redeem_success_cb=redeem_success_cb,
-        )
-        await igdb_refresh_token(
-            audit_logger=lambda ev_extra, extra_dict: TheBurgBotDB(
-                self.db_path
-            ).audit_log_event_json(
-                {
-                    "timestamp": str(datetime.datetime.now()),
-                    **extra_dict,
-                },
-                event=f"IGDB_TOKEN_REFRESH__{ev_extra}",
-            ),
-        )
+        with STARTUP.phase("HTTP server"):
+            self.http_server = TheBurgBotHTTP(
+                redeem_req=redeem_req_handler,
+                parent=self,
+                redeem_success_cb=redeem_success_cb,
+            )
+        with STARTUP.phase("token refresh"):
+            await igdb_init_token_manager(
+                self.db_path,
+                audit_logger=lambda ev_extra, extra_dict: TheBurgBotDB(
+                    self.db_path
+                ).audit_log_event_json(
+                    {
+                        "timestamp": str(datetime.datetime.now()),
+                        **extra_dict,
+                    },
+                    event=f"IGDB_TOKEN_REFRESH__{ev_extra}",
+                ),
+            )
 
         async def ical_bot_synced_callback(current_events):
             tz = datetime.timezone(offset=datetime.timedelta(hours=-8))
@@ -137,11 +155,32 @@ class TheBurgBotClient(commands.Bot):
                     )
                     print(f"digest={digest}")
 
+        await restore_invite_views(self)
+        await memory.resume_watcher(self.db_path)
+        self.card_index_task = asyncio.create_task(card_index_refresher())
+        self.card_index_task.set_name("card_index_refresher")
+        self.igdb_titles_task = asyncio.create_task(
+            igdb_title_index_refresher(self.db_path)
+        )
+        self.igdb_titles_task.set_name("igdb_title_index_refresher")
+        self.statics_warm_task = asyncio.create_task(self.warm_http_statics())
+        self.statics_warm_task.set_name("warm_http_statics")
+
+        if STARTUP.enabled:
+            print(STARTUP.finish())
+
         await self.ical_syncer.start_sync(ical_bot_synced_callback)
 
         self.initialized = True
         LOGGER.info("✅ TheBurgBot is ready")
 
+    async def warm_http_statics(self):
+        try:
+            rendered = await TheBurgBotDB(self.db_path).render_stale_http_statics()
+            LOGGER.info(f"Rendered {rendered} stale static pages")
+        except:
+            LOGGER.error("Rendering stale static pages failed", exc_info=True)
+
     async def on_message(self, message: discord.Message):
         @audit_log_start_end_async("CLIENT_ON_MESSAGE", db_path=self.db_path)
         async def _on_message__inner():
@@ -149,32 +188,34 @@ class TheBurgBotClient(commands.Bot):
                 # don't log our own messages
                 return
             db = TheBurgBotDB(self.db_path)
-            embeds = []
-            for card_name in re.findall(constants.INLINE_SCRY_PATTERN, message.content):
-                (scry_embeds, _was_more) = await scry_lookup(
+            card_names = re.findall(constants.INLINE_SCRY_PATTERN, message.content)
+
+            async def _inline_scry():
+                if not len(card_names):
+                    return
+                embeds = await inline_scry_lookup(
                     message.author,
-                    card_name,
-                    exact_match=True,
+                    message.channel.id,
+                    card_names,
                     audit_logger=await command_create_internal_logger(
                         self.db_path,
                         "INLINE_SCRY_LOOKUP",
-                        {"query": card_name, "author": message.author.id},
+                        {"queries": card_names, "author": message.author.id},
                     ),
                 )
-                if scry_embeds:
-                    if len(scry_embeds) > 1:
-                        LOGGER.warning(f"More than one scry result for inline lookup!")
-                    embeds.extend(scry_embeds)
-            if len(embeds) > 0:
-                await message.channel.send(embeds=embeds)
-
-            await db.log_message(
-                channel_id=message.channel.id,
-                channel_name=message.channel.name,
-                author_id=message.author.id,
-                author_name=message.author.display_name,
-                message_id=message.id,
-                content=message.content,
+                if len(embeds) > 0:
+                    await message.channel.send(embeds=embeds)
+
+            await asyncio.gather(
+                _inline_scry(),
+                db.log_message(
+                    channel_id=message.channel.id,
+                    channel_name=message.channel.name,
+                    author_id=message.author.id,
+                    author_name=message.author.display_name,
+                    message_id=message.id,
+                    content=message.content,
+                ),
             )
 
         return await _on_message__inner()
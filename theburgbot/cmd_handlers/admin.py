@@ -1,4 +1,5 @@
 import json
+import math
 from dataclasses import asdict
 from pathlib import Path
 from typing import Any, Dict, List, Optional
@@ -7,10 +8,15 @@ from urllib.parse import urlparse
 import discord
 from discord import app_commands
 
-from theburgbot.common import CommandHandler, dprint
+from theburgbot import constants, memory
+from theburgbot.common import CommandHandler
 from theburgbot.config import discord_ids
 from theburgbot.db import TheBurgBotDB, TheBurgBotKeyedJSONStore
+from theburgbot.gpt_scheduler import GPT_SCHEDULER
 from theburgbot.ical import iCalSyncer
+from theburgbot.profiler import profile_event_loop, publish_profile_report
+from theburgbot.ratelimit import host_stats
+from theburgbot.resilience import breaker_stats
 
 IGNORE_DISCORD_IDS = ["ROLE_REACTION_MESSAGE_ID", "GUILD_ID"]
 
@@ -134,8 +140,28 @@ async def _events_addUrl(
     return await _events_listUrls(args, kv_store, ical_syncer)
 
 
+async def _events_status(
+    args: List[str], kv_store: TheBurgBotKeyedJSONStore, ical_syncer: iCalSyncer
+):
+    statuses = await kv_store.get("ical/status", default_producer=dict)
+    if not len(statuses):
+        return "No calendars have been synced yet."
+
+    def _fmt(status: Dict[str, Any]) -> str:
+        fmtd = f"**{status['status']}** in {status['secs']}s"
+        if status.get("bytes") is not None:
+            fmtd += f", {status['bytes']} bytes"
+        if status.get("fetched_at"):
+            fmtd += f", fetched <t:{int(status['fetched_at'])}:R>"
+        return fmtd
+
+    return "\n".join(
+        [f"* {name}: {_fmt(status)}" for (name, status) in statuses.items()]
+    )
+
+
 _EVENT_CMD_PREFIX = "_events_"
-_EVENT_CMD_ALLOWS = ["listUrls", "addUrl"]
+_EVENT_CMD_ALLOWS = ["listUrls", "addUrl", "status"]
 
 
 async def events_embed(
@@ -160,13 +186,205 @@ async def events_embed(
     return e
 
 
+async def upstreams_embed(
+    interaction: discord.Interaction,
+    db_path: str,
+    ical_syncer: iCalSyncer,
+    command_dict: Dict[str, Any],
+) -> discord.Embed:
+    e = discord.Embed(title="Upstreams")
+    for host, stats in host_stats().items():
+        e.add_field(
+            name=host,
+            value=f"rate: {stats['rate']}/s (burst {stats['burst']})\n"
+            f"queued: {stats['queue_depth']} (max {stats['max_queue_depth']})\n"
+            f"requests: {stats['acquired']}, coalesced: {stats['coalesced']}\n"
+            f"wait avg/p95/max: {stats['avg_wait']:.3f}s / {stats['p95_wait']:.3f}s / {stats['max_wait']:.3f}s",
+            inline=False,
+        )
+    for host, stats in breaker_stats().items():
+        e.add_field(
+            name=f"{host} circuit",
+            value=f"**{stats['state']}**, consecutive failures: {stats['failures']}\n"
+            f"opened {stats['times_opened']} times, {stats['rejected']} calls failed fast",
+            inline=True,
+        )
+    gpt = GPT_SCHEDULER.stats()
+    e.add_field(
+        name="OpenAI (/gpt)",
+        value=f"running: {gpt['running']}/{GPT_SCHEDULER.max_concurrent}\n"
+        f"queued: {gpt['queued']} (from {gpt['users_queued']} users)\n"
+        f"est. tokens in last minute: {gpt['tokens_last_minute']}/{GPT_SCHEDULER.tokens_per_minute}\n"
+        f"completed: {gpt['completed']}, avg wait: {gpt['avg_wait']:.3f}s",
+        inline=False,
+    )
+    return e
+
+
+async def static_pages_embed(
+    interaction: discord.Interaction,
+    db_path: str,
+    ical_syncer: iCalSyncer,
+    command_dict: Dict[str, Any],
+) -> discord.Embed:
+    e = discord.Embed(title="Static Pages")
+    rendered = await TheBurgBotDB(db_path).render_stale_http_statics()
+    e.add_field(name="Re-rendered", value=rendered)
+    return e
+
+
+async def _memory_start(
+    args: List[str], db_path: str, interaction: discord.Interaction
+):
+    try:
+        frames = int(args[0]) if len(args) else constants.MEMORY_TRACE_FRAMES
+    except ValueError:
+        frames = 0
+    if frames < 1:
+        return "Usage: `start [frames]`, where frames is a whole number of at least 1."
+    if not memory.start_tracing(frames):
+        return "Already tracing."
+    return (
+        f"Tracing with {frames} frames per allocation: this adds overhead until `stop`!"
+    )
+
+
+async def _memory_baseline(
+    args: List[str], db_path: str, interaction: discord.Interaction
+):
+    baseline = memory.take_baseline()
+    return (
+        f"Baseline taken at {baseline.taken.isoformat()} "
+        f"(RSS {memory.fmt_bytes(memory.rss_bytes())})"
+    )
+
+
+async def _memory_diff(args: List[str], db_path: str, interaction: discord.Interaction):
+    diff = memory.diff_against_baseline()
+    if diff is None:
+        return "No baseline! Use `baseline` first."
+    url_id = await memory.publish_memory_report(db_path, interaction.user.id, diff)
+    return "\n".join(
+        [
+            f"RSS: {memory.fmt_bytes(diff.rss_bytes)}, traced: {memory.fmt_bytes(diff.traced_bytes)}",
+            *[f"* {site}" for site in diff.top_sites[:5]],
+            f"{constants.SITE_URL.lower()}/{constants.USER_STATIC_HTTP_PATH}/{url_id}",
+        ]
+    )
+
+
+async def _memory_stop(args: List[str], db_path: str, interaction: discord.Interaction):
+    # the watcher's samples need tracing, so it's stopped too
+    watching = memory.watcher_running()
+    await memory.stop_watcher(db_path)
+    memory.stop_tracing()
+    return "Tracing stopped and baseline discarded." + (
+        " Memory watch stopped." if watching else ""
+    )
+
+
+async def _memory_watch(
+    args: List[str], db_path: str, interaction: discord.Interaction
+):
+    try:
+        every_minutes = float(args[0]) if len(args) else 0.0
+    except ValueError:
+        every_minutes = 0.0
+    if not (every_minutes > 0 and math.isfinite(every_minutes)):
+        return "Usage: `watch <minutes>`, where minutes is the sample period (more than 0)."
+    await memory.start_watcher(db_path, every_minutes)
+    return f"Sampling RSS and top growth sites every {every_minutes} minutes."
+
+
+async def _memory_unwatch(
+    args: List[str], db_path: str, interaction: discord.Interaction
+):
+    await memory.stop_watcher(db_path)
+    return "Memory watch stopped."
+
+
+async def _memory_history(
+    args: List[str], db_path: str, interaction: discord.Interaction
+):
+    history = await memory.watch_history(db_path)
+    if not len(history):
+        return "No samples recorded."
+    return "\n".join(
+        [f"{s['timestamp']}: {memory.fmt_bytes(s['rss'])}" for s in history[-10:]]
+    )
+
+
+_MEMORY_CMD_PREFIX = "_memory_"
+_MEMORY_CMD_ALLOWS = [
+    "start",
+    "baseline",
+    "diff",
+    "stop",
+    "watch",
+    "unwatch",
+    "history",
+]
+
+
+async def memory_embed(
+    interaction: discord.Interaction,
+    db_path: str,
+    ical_syncer: iCalSyncer,
+    command_dict: Dict[str, Any],
+):
+    [command, *args] = command_dict["memory"].split(" ")
+
+    e = discord.Embed(title="Memory")
+    e.add_field(name="Command", value=command)
+    cmd_output = f"Unknown command! Use one of: {', '.join(_MEMORY_CMD_ALLOWS)}"
+    if command in _MEMORY_CMD_ALLOWS:
+        glbls = globals()
+        cmd_func_name = f"{_MEMORY_CMD_PREFIX}{command}"
+        if cmd_func_name in glbls:
+            cmd_output = await glbls[cmd_func_name](args, db_path, interaction)
+    e.add_field(name="Tracing", value="Yes" if memory.is_tracing() else "No")
+    e.add_field(name="Watching", value="Yes" if memory.watcher_running() else "No")
+    e.add_field(name="Output", value=cmd_output[:1024], inline=False)
+
+    return e
+
+
+async def profile_embed(
+    interaction: discord.Interaction,
+    db_path: str,
+    ical_syncer: iCalSyncer,
+    command_dict: Dict[str, Any],
+) -> discord.Embed:
+    seconds = command_dict["profile"]
+    e = discord.Embed(title="Profile")
+    result = await profile_event_loop(seconds)
+    if result is None:
+        e.description = "A profile is already running, try again once it completes."
+        return e
+
+    url_id = await publish_profile_report(db_path, interaction.user.id, result)
+    e.url = f"{constants.SITE_URL.lower()}/{constants.USER_STATIC_HTTP_PATH}/{url_id}"
+    e.add_field(name="Duration", value=f"{seconds}s")
+    e.add_field(name="Calls", value=result.num_calls)
+    e.add_field(name="Stack samples", value=result.num_samples)
+    e.add_field(name="Report", value=e.url, inline=False)
+    return e
+
+
 EMBED_CREATORS = {
     "command_usage": command_usage_embed,
     "discord_ids": discord_id_embed,
     "list_invites": invites_embed,
     "events": events_embed,
+    "profile": profile_embed,
+    "memory": memory_embed,
+    "upstreams": upstreams_embed,
+    "render_pages": static_pages_embed,
 }
 
+# these take longer than the interaction response window allows, so must be deferred
+DEFERRED_EMBED_CREATORS = ["profile", "memory", "render_pages"]
+
 
 async def admin_cmd_handler(
     interaction: discord.Interaction,
@@ -188,6 +406,14 @@ async def admin_cmd_handler(
             "You didn't choose any embeds!", ephemeral=True
         )
 
+    async def _send(*args, **kwargs):
+        if interaction.response.is_done():
+            return await interaction.followup.send(*args, **kwargs)
+        return await interaction.response.send_message(*args, **kwargs)
+
+    if any([kwargs.get(param_name) for param_name in DEFERRED_EMBED_CREATORS]):
+        await interaction.response.defer(thinking=True, ephemeral=True)
+
     # TODO: handle public_reply!
     embeds = []
     for param_name, embed_creator in EMBED_CREATORS.items():
@@ -199,11 +425,9 @@ async def admin_cmd_handler(
             )
 
     if not len(embeds):
-        return await interaction.response.send_message(
-            "No embeds created! :shrug:", ephemeral=True
-        )
+        return await _send("No embeds created! :shrug:", ephemeral=True)
 
-    await interaction.response.send_message(embeds=embeds, ephemeral=True)
+    await _send(embeds=embeds, ephemeral=True)
 
 
 class TheBurgBotUserCommand(CommandHandler):
@@ -223,7 +447,11 @@ class TheBurgBotUserCommand(CommandHandler):
             command_usage="Include the command usage statistics embed. Can be sent publicly.",
             discord_ids="Include the relevant DiscordIDs embed. Can **not** be sent publicly.",
             list_invites="List all invites and their metadata.",
-            events="Events."
+            events="Events: listUrls, addUrl <url> <name>, status.",
+            profile="Profile the bot for this many seconds and publish the report.",
+            memory="Memory tracing: start, baseline, diff, stop, watch <minutes>, unwatch, history.",
+            upstreams="Outbound API rate limiting and request stats.",
+            render_pages="Render every static page that's stale for its template.",
             # public_reply="Send the reply to the channel (defaults to False)",
         )
         @audit_log_decorator("COMMAND_ADMIN", db_path=client.db_path)
@@ -233,6 +461,12 @@ class TheBurgBotUserCommand(CommandHandler):
             discord_ids: bool = False,
             list_invites: bool = False,
             events: Optional[str] = None,
+            profile: Optional[
+                app_commands.Range[int, 1, constants.PROFILE_MAX_SECONDS]
+            ] = None,
+            memory: Optional[str] = None,
+            upstreams: bool = False,
+            render_pages: bool = False,
             # public_reply: bool = False,
         ):
             await command_use_logger(interaction)
@@ -245,6 +479,10 @@ class TheBurgBotUserCommand(CommandHandler):
                     "discord_ids": discord_ids,
                     "list_invites": list_invites,
                     "events": events,
+                    "profile": profile,
+                    "memory": memory,
+                    "upstreams": upstreams,
+                    "render_pages": render_pages,
                     # "public_reply": public_reply,
                 },
             )
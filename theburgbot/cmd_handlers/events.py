@@ -64,15 +64,14 @@ class TheBurgBotUserCommand(CommandHandler):
                             + (f" (page {page_no})" if paginate else "")
                         )
                         for event in events_view[:CHUNK_SIZE]:
-                            st_end = ""
-                            if ev_type != "recurring":
-                                st_end = (
-                                    "Starts: "
-                                    + str(event["DTSTART"].dt)
-                                    + "\nEnds: "
-                                    + str(event["DTEND"].dt)
-                                    + "\n\n"
-                                )
+                            # occurrences of recurring events have their own start & end too
+                            st_end = (
+                                "Starts: "
+                                + str(event["DTSTART"].dt)
+                                + "\nEnds: "
+                                + str(event["DTEND"].dt)
+                                + "\n\n"
+                            )
                             emb.add_field(
                                 name="📅 " + str(event["SUMMARY"]),
                                 value=st_end + strip_html(str(event["DESCRIPTION"])),
@@ -1,45 +1,256 @@
 import asyncio
 import datetime
+import hashlib
+import json
 import logging
+import time
+from typing import AsyncIterator, Dict, Optional, Tuple
 
 import discord
-import mistune
-import openai
 from discord import app_commands
 
 from theburgbot import constants
-from theburgbot.common import CommandHandler
+from theburgbot.common import CommandHandler, lazy_import
 from theburgbot.config import discord_ids
 from theburgbot.db import TheBurgBotDB
+from theburgbot.gpt_scheduler import (GPT_SCHEDULER, GPTQueueFull,
+                                      estimate_tokens)
+from theburgbot.resilience import UpstreamUnavailable, resilient_call
 
 LOGGER = logging.getLogger("discord")
 
+mistune = lazy_import("mistune")
+openai = lazy_import("openai")
+
+
+OPENAI_HOST = "api.openai.com"
+
+
+def _is_retryable_openai_error(error: Exception) -> bool:
+    if isinstance(error, openai.error.APIError):
+        return (error.http_status or 500) >= 500
+    return isinstance(
+        error,
+        (
+            openai.error.ServiceUnavailableError,
+            openai.error.RateLimitError,
+            openai.error.APIConnectionError,
+            openai.error.Timeout,
+            openai.error.TryAgain,
+            asyncio.TimeoutError,
+        ),
+    )
+
+
+async def _create_completion(query: str, *, audit_logger, model, **kwargs):
+    async def on_retry(attempt, error, delay):
+        LOGGER.warn(f"GPT unavailable, retrying in {delay:.1f}s", exc_info=error)
+        await audit_logger(
+            "SERVICE_UNAVAILABLE", {"attempt": attempt, "error": repr(error)}
+        )
+
+    try:
+        return await resilient_call(
+            OPENAI_HOST,
+            lambda: openai.ChatCompletion.acreate(
+                model=model,
+                messages=[{"role": "user", "content": query}],
+                timeout=180,
+                **kwargs,
+            ),
+            attempts=constants.GPT_RETRY_ATTEMPTS,
+            is_retryable=_is_retryable_openai_error,
+            on_retry=on_retry,
+        )
+    except UpstreamUnavailable as e:
+        LOGGER.warn(f"GPT unavailable: {e}")
+        await audit_logger("UNAVAILABLE", {"error": str(e)})
+        return None
+
 
 async def query_openai(
     query: str,
     *,
     audit_logger,
     model,
-    retries: int = 5,
 ):
-    comp = None
     await audit_logger("CHAT_COMPLETETION_CREATE", {"model": model, "prompt": query})
-    while not comp and retries > 0:
-        try:
-            comp = await openai.ChatCompletion.acreate(
-                model=model, messages=[{"role": "user", "content": query}], timeout=180
-            )
-        except openai.error.ServiceUnavailableError:
-            retries -= 1
-            LOGGER.warn(f"GPT unavailable, retrying ({retries} left)", exc_info=True)
-            await audit_logger("SERVICE_UNAVAILABLE", {"retries": retries})
-            asyncio.sleep(5 - retries)
+    comp = await _create_completion(query, audit_logger=audit_logger, model=model)
     if comp:
         if audit_logger:
             await audit_logger("ALL_RESPONSES", {"responses": comp})
         return comp.choices[0].message.content
     else:
-        return "OpenAI service is unavailable"
+        return constants.GPT_UNAVAILABLE_RESPONSE
+
+
+async def stream_openai(
+    query: str,
+    *,
+    audit_logger,
+    model,
+) -> AsyncIterator[str]:
+    await audit_logger(
+        "CHAT_COMPLETETION_CREATE", {"model": model, "prompt": query, "stream": True}
+    )
+    chunks = await _create_completion(
+        query, audit_logger=audit_logger, model=model, stream=True
+    )
+    if not chunks:
+        yield constants.GPT_UNAVAILABLE_RESPONSE
+        return
+
+    finish_reason = None
+    async for chunk in chunks:
+        choice = chunk.choices[0]
+        content = choice.delta.get("content")
+        if content:
+            yield content
+        finish_reason = choice.get("finish_reason") or finish_reason
+    await audit_logger("STREAM_FINISHED", {"finish_reason": finish_reason})
+
+
+def _static_obj(real_prompt: str, response: str, model: str):
+    return {
+        "prompt": real_prompt,
+        "response": mistune.html(response),
+        "model": {
+            "displayName": "OpenAI completions API",
+            "sourceURL": "https://platform.openai.com/docs/api-reference/completions",
+            "name": model,
+        },
+        "captureTimestamp": datetime.datetime.now().isoformat(),
+    }
+
+
+def _reply_content(query_quoted: str, response: str, msg_postfix: str) -> str:
+    content = f"# Prompt:\n{query_quoted}\n# Response:\n{response}\n\n{msg_postfix}"
+    if len(content) <= constants.DISCORD_MAX_MESSAGE_LEN:
+        return content
+    overflow_note = "\n_... the rest is at the URL below!_"
+    room = (
+        constants.DISCORD_MAX_MESSAGE_LEN
+        - (len(content) - len(response))
+        - len(overflow_note)
+    )
+    if room <= 0:
+        return f"# Response:\n_... is too large to be shown here!_\nSee below for a URL to view it.\n\n\n{msg_postfix}"
+    return f"# Prompt:\n{query_quoted}\n# Response:\n{response[:room]}{overflow_note}\n\n{msg_postfix}"
+
+
+async def _stream_reply(
+    interaction: discord.Interaction,
+    db: TheBurgBotDB,
+    url_id: str,
+    query_quoted: str,
+    msg_postfix: str,
+    real_prompt: str,
+    model: str,
+    public_reply: bool,
+    *,
+    audit_logger,
+) -> str:
+    """
+    Streams the response into the followup message, editing it no more often than
+    GPT_STREAM_EDIT_INTERVAL_SECS (Discord rate-limits message edits); whatever
+    doesn't fit in a message is only on the user-static page, which gets the whole
+    response once the stream ends. If the stream fails, the message says it was cut
+    short before the error is re-raised.
+    """
+    message = await interaction.followup.send(
+        _reply_content(query_quoted, "_..._", msg_postfix),
+        ephemeral=not public_reply,
+        wait=True,
+    )
+    response = ""
+    shown = None
+    last_edit = time.monotonic()
+    try:
+        async for content in stream_openai(
+            real_prompt, model=model, audit_logger=audit_logger
+        ):
+            response += content
+            if time.monotonic() - last_edit < constants.GPT_STREAM_EDIT_INTERVAL_SECS:
+                continue
+            in_progress = _reply_content(query_quoted, f"{response} _..._", msg_postfix)
+            if in_progress != shown:
+                await message.edit(content=in_progress)
+                shown = in_progress
+            last_edit = time.monotonic()
+    except Exception:
+        # so that what was streamed isn't taken for the whole response
+        cut_short = "_... the response was cut short by an error!_"
+        try:
+            await message.edit(
+                content=_reply_content(
+                    query_quoted, response, f"{cut_short}\n\n{msg_postfix}"
+                )
+            )
+        except discord.HTTPException:
+            LOGGER.warn("Couldn't mark the streamed reply as incomplete", exc_info=True)
+        raise
+    finally:
+        await db.update_http_static(url_id, _static_obj(real_prompt, response, model))
+    await message.edit(content=_reply_content(query_quoted, response, msg_postfix))
+    return response
+
+
+class _QueuePosition:
+    """
+    Shows a deferred interaction's place in the GPT queue in place of its
+    "thinking..." message, and removes it once the request starts.
+    """
+
+    def __init__(self, interaction: discord.Interaction):
+        self.interaction = interaction
+        self.shown = False
+        self.started = False
+
+    async def show(self, position: int):
+        if self.started:
+            return
+        self.shown = True
+        ahead = (
+            "yours is next"
+            if position == 0
+            else f"{position} request{'s' if position > 1 else ''} ahead of yours"
+        )
+        await self.interaction.edit_original_response(
+            content=f"_Waiting for a turn with ChatGPT: {ahead}..._"
+        )
+
+    async def start(self):
+        self.started = True
+        if self.shown:
+            await self.interaction.delete_original_response()
+
+
+def _msg_postfix(url_id: str) -> str:
+    return f"_This response is available forever at:_ {constants.SITE_URL.lower()}/{constants.USER_STATIC_HTTP_PATH}/{url_id}\n\n"
+
+
+def gpt_cache_key(model: str, query: str, shorten_response: bool) -> str:
+    normalized = " ".join(query.casefold().split())
+    return hashlib.sha256(
+        json.dumps([model, normalized, bool(shorten_response)]).encode("utf-8")
+    ).hexdigest()
+
+
+# cache key -> (response, url_id) of the identical request currently being made, or
+# None if it fails
+_INFLIGHT: Dict[str, asyncio.Future] = {}
+
+
+async def _cached_response(
+    db: TheBurgBotDB, cache_key: str
+) -> Optional[Tuple[str, str]]:
+    cached = await db.get_gpt_cached(cache_key, constants.GPT_CACHE_TTL_HOURS * 60 * 60)
+    if cached is not None:
+        return tuple(cached)
+    if cache_key in _INFLIGHT:
+        # None if that request failed, in which case we make our own
+        return await asyncio.shield(_INFLIGHT[cache_key])
+    return None
 
 
 async def gpt_cmd_handler(
@@ -51,6 +262,8 @@ async def gpt_cmd_handler(
     public_reply: bool = False,
     shorten_response: bool = True,
     model: str = None,
+    stream_response: bool = True,
+    use_cache: bool = True,
 ):
     if not model:
         model = "gpt-3.5-turbo"
@@ -63,45 +276,101 @@ async def gpt_cmd_handler(
         "public": public_reply,
         "model": model,
         "real_prompt": real_prompt,
+        "stream": stream_response,
+        "use_cache": use_cache,
     }
     await interaction.response.defer(thinking=bool, ephemeral=not public_reply)
-    response = await query_openai(
-        real_prompt,
-        model=model,
-        audit_logger=await command_create_internal_logger("COMMAND_GPT", audit_obj),
-    )
-    audit_obj["response"] = response
+    audit_logger = await command_create_internal_logger("COMMAND_GPT", audit_obj)
     query_quoted = "\n".join([f"> {l}" for l in query.split("\n")])
-
-    url_id = await TheBurgBotDB(db_path).add_http_static(
-        interaction.user.id,
-        "gpt",
-        "gpt_response",
-        {
-            "prompt": real_prompt,
-            "response": mistune.html(response),
-            "model": {
-                "displayName": "OpenAI completions API",
-                "sourceURL": "https://platform.openai.com/docs/api-reference/completions",
-                "name": model,
-            },
-            "captureTimestamp": datetime.datetime.now().isoformat(),
-        },
-        query,
-    )
-
-    msg_postfix = f"_This response is available forever at:_ {constants.SITE_URL.lower()}/{constants.USER_STATIC_HTTP_PATH}/{url_id}\n\n"
-    f"\n### Parameters:\n* Model: **{model}**\n* Response shortened? **{'Yes' if shorten_response else 'No'}**"
+    db = TheBurgBotDB(db_path)
+    cache_key = gpt_cache_key(model, query, shorten_response)
+    queue_position = _QueuePosition(interaction)
+    url_id = None
 
     try:
+        cached = await _cached_response(db, cache_key) if use_cache else None
+        if cached is not None:
+            (response, url_id) = cached
+            audit_obj["cached"] = True
+            await interaction.followup.send(
+                _reply_content(
+                    query_quoted,
+                    response,
+                    f"{_msg_postfix(url_id)}_This is a saved response to the same prompt: set `use_cache` to False for a new one._",
+                ),
+                ephemeral=not public_reply,
+            )
+            audit_obj["response"] = response
+            return
+
+        inflight = asyncio.get_running_loop().create_future()
+        # only one in-flight request per key is shared; a concurrent opt-out just runs alongside
+        owns_inflight = _INFLIGHT.setdefault(cache_key, inflight) is inflight
+        try:
+            async with GPT_SCHEDULER.slot(
+                interaction.user.id,
+                estimate_tokens(real_prompt, shorten_response),
+                on_position=queue_position.show,
+            ):
+                await queue_position.start()
+                if stream_response:
+                    # the page is written up-front so its URL can be shown while streaming
+                    url_id = await db.add_http_static(
+                        interaction.user.id,
+                        "gpt",
+                        "gpt_response",
+                        _static_obj(real_prompt, "", model),
+                        query,
+                    )
+                    response = await _stream_reply(
+                        interaction,
+                        db,
+                        url_id,
+                        query_quoted,
+                        _msg_postfix(url_id),
+                        real_prompt,
+                        model,
+                        public_reply,
+                        audit_logger=audit_logger,
+                    )
+                else:
+                    response = await query_openai(
+                        real_prompt,
+                        model=model,
+                        audit_logger=audit_logger,
+                    )
+                    url_id = await db.add_http_static(
+                        interaction.user.id,
+                        "gpt",
+                        "gpt_response",
+                        _static_obj(real_prompt, response, model),
+                        query,
+                    )
+                    await interaction.followup.send(
+                        _reply_content(query_quoted, response, _msg_postfix(url_id)),
+                        ephemeral=not public_reply,
+                    )
+        except BaseException:
+            # anyone waiting on this request will make their own instead
+            inflight.set_result(None)
+            raise
+        else:
+            if response == constants.GPT_UNAVAILABLE_RESPONSE:
+                inflight.set_result(None)
+            else:
+                inflight.set_result((response, url_id))
+                await db.set_gpt_cached(
+                    cache_key, model, query, shorten_response, response, url_id
+                )
+        finally:
+            if owns_inflight:
+                del _INFLIGHT[cache_key]
+        audit_obj["response"] = response
+    except GPTQueueFull:
+        audit_obj["queue_full"] = True
         await interaction.followup.send(
-            f"# Prompt:\n{query_quoted}\n# Response:\n{response}\n\n{msg_postfix}",
-            ephemeral=not public_reply,
-        )
-    except discord.errors.HTTPException:
-        await interaction.followup.send(
-            f"# Prompt:\n{query_quoted}\n# Response:\n_... is too large to be shown here!_\nSee below for a URL to view it.\n\n\n{msg_postfix}",
-            ephemeral=not public_reply,
+            f"You already have {constants.GPT_MAX_QUEUED_PER_USER} requests waiting for ChatGPT: please try again once they're done!",
+            ephemeral=True,
         )
     finally:
         await command_audit_logger(
@@ -129,6 +398,8 @@ class TheBurgBotUserCommand(CommandHandler):
             public_reply="Send the reply to the channel (defaults to False)",
             shorten_response="Append instruction to the prompt to keep the response short",
             model="The model to use (only available to Admins)",
+            stream_response="Show the response as it's written (defaults to True)",
+            use_cache="Reuse a saved response to the same prompt if there is one (defaults to True)",
         )
         @audit_log_decorator("COMMAND_GPT", db_path=client.db_path)
         async def gpt(
@@ -137,6 +408,8 @@ class TheBurgBotUserCommand(CommandHandler):
             public_reply: bool = False,
             shorten_response: bool = True,
             model: str = None,
+            stream_response: bool = True,
+            use_cache: bool = True,
         ):
             await command_use_logger(interaction)
             if model is not None:
@@ -157,6 +430,8 @@ class TheBurgBotUserCommand(CommandHandler):
                 public_reply,
                 shorten_response,
                 model,
+                stream_response,
+                use_cache,
             )
 
         return "gpt"
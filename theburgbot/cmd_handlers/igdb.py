@@ -3,18 +3,48 @@ import datetime
 import json
 import logging
 import os
+import time
 from dataclasses import asdict, dataclass
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 import discord
 import httpx
 from discord import app_commands
 
-from theburgbot.common import CommandHandler
+from theburgbot import constants
+from theburgbot.common import (CommandHandler, TTLCache, http_client,
+                               run_blocking)
+from theburgbot.db import TheBurgBotKeyedJSONStore
+from theburgbot.name_index import PrefixIndex, normalize_text
+from theburgbot.ratelimit import RequestCoalescer
+from theburgbot.resilience import resilient_call
 
 LOGGER = logging.getLogger("discord")
 IGDB_URL = "https://api.igdb.com/v4"
+IGDB_HOST = httpx.URL(IGDB_URL).host
 TWITCH_OAUTH_URL = "https://id.twitch.tv/oauth2/token"
+IGDB_MAX_LIMIT = 500
+
+# only what igdb_lookup & embed_from_game_entry use
+GAME_FIELDS = "id,name,slug,summary,rating,rating_count,first_release_date,url"
+ARTWORK_FIELDS = "game,image_id"
+
+GAME_CACHE = TTLCache(
+    constants.IGDB_CACHE_TTL_SECS, constants.IGDB_GAME_CACHE_MAX_ENTRIES
+)
+# keyed by game ID
+ARTWORK_CACHE = TTLCache(
+    constants.IGDB_CACHE_TTL_SECS, constants.IGDB_ARTWORK_CACHE_MAX_ENTRIES
+)
+# keyed by normalized partial title
+SEARCH_CACHE = TTLCache(
+    constants.IGDB_CACHE_TTL_SECS, constants.IGDB_SEARCH_CACHE_MAX_ENTRIES
+)
+
+# every title we've seen in an IGDB result, for autocomplete
+TITLE_INDEX = PrefixIndex()
+_LATEST_SEARCH: Dict[int, str] = {}
+_SEARCH_COALESCER = RequestCoalescer()
 
 
 @dataclass
@@ -37,65 +67,171 @@ class Token:
         return self.refreshed_at + self.expires_in
 
 
-TOKEN: Optional[Token] = None
+class IGDBTokenError(Exception):
+    pass
+
+
+class IGDBTokenManager:
+    """
+    Owns the Twitch app token used for IGDB: it's kept in the KV store (so
+    processes sharing a DB share a token) and refreshed when it's near expiry or
+    IGDB rejects it. Concurrent refreshes are collapsed into one, and failed
+    refreshes back off exponentially rather than hammering Twitch.
+    """
+
+    TOKEN_KEY = "token"
+
+    def __init__(self, db_path: str, *, audit_logger=None):
+        self.kv_store = TheBurgBotKeyedJSONStore(db_path=db_path, namespace="igdb")
+        self.audit_logger = audit_logger
+        self.token: Optional[Token] = None
+        self.failures = 0
+        self.retry_at = 0.0
+        self._refreshing: Optional[asyncio.Future] = None
+
+    async def _audit(self, event: str, extra: Dict[str, Any]):
+        if self.audit_logger:
+            await self.audit_logger(event, extra)
 
+    @staticmethod
+    def _audit_fields(token: Token) -> Dict[str, Any]:
+        return {"expires_in": token.expires_in, "refreshed_at": token.refreshed_at}
 
-async def igdb_refresh_token(*, audit_logger):
-    global TOKEN
-    cache_file = os.getenv("TWITCH_TOKEN_CACHE_FILE", ".twitch_token")
-    if os.path.exists(cache_file):
-        with open(cache_file, "r") as cf:
-            TOKEN = Token(**json.load(cf))
+    async def load(self, legacy_cache_file: Optional[str] = None):
+        stored = await self.kv_store.get(self.TOKEN_KEY)
+        if stored is not None:
+            self.token = Token(**stored)
             LOGGER.info("Loaded Twitch token")
-            await audit_logger(
-                "LOADED_FROM_CACHE",
-                asdict(TOKEN),
+            await self._audit("LOADED", self._audit_fields(self.token))
+        elif legacy_cache_file and os.path.exists(legacy_cache_file):
+            with open(legacy_cache_file, "r") as cf:
+                self.token = Token(**json.load(cf))
+            await self.kv_store.set(self.TOKEN_KEY, asdict(self.token))
+            os.replace(legacy_cache_file, f"{legacy_cache_file}.migrated")
+            LOGGER.info(f"Migrated Twitch token from {legacy_cache_file}")
+            await self._audit("MIGRATED", self._audit_fields(self.token))
+
+    def _needs_refresh(self, token: Optional[Token]) -> bool:
+        return token is None or (
+            token.expires_in != -1
+            and token.expires_at - constants.IGDB_TOKEN_EXPIRY_MARGIN_SECS
+            < datetime.datetime.now().timestamp()
+        )
+
+    async def get_token(self) -> Token:
+        if not self._needs_refresh(self.token):
+            return self.token
+        try:
+            return await self.refresh(self.token)
+        except IGDBTokenError:
+            # a token that's only near expiry is still worth trying
+            if (
+                self.token is not None
+                and self.token.expires_at > datetime.datetime.now().timestamp()
+            ):
+                return self.token
+            raise
+
+    async def refresh(self, rejected: Optional[Token]) -> Token:
+        """
+        Replaces `rejected` (the token a caller found to be bad, if any) unless
+        that's already been done, here or by another process sharing the store.
+        """
+        if self.token is not None and self.token is not rejected:
+            return self.token
+        stored = await self.kv_store.get(self.TOKEN_KEY)
+        if stored is not None:
+            stored = Token(**stored)
+            if not self._needs_refresh(stored) and (
+                rejected is None or stored.access_token != rejected.access_token
+            ):
+                self.token = stored
+                return self.token
+
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self._refresh())
+            self._refreshing.add_done_callback(
+                lambda _f: setattr(self, "_refreshing", None)
             )
+        return await asyncio.shield(self._refreshing)
 
-    async def _refresher():
-        global TOKEN
-        while True:
-            if TOKEN and TOKEN.expires_in != -1:
-                now = datetime.datetime.now().timestamp()
-                refresh_at = max(TOKEN.expires_at - (60 * 60), now)
-                refresh_in = refresh_at - now
-                LOGGER.info(
-                    f"Twitch token refresh scheduled for {datetime.datetime.fromtimestamp(refresh_at)} "
-                    f"(expires {datetime.datetime.fromtimestamp(TOKEN.expires_at)}) [{refresh_in}]"
-                )
-                await asyncio.sleep(refresh_in)
-            cid = os.getenv("TWITCH_APP_ID")
-            csk = os.getenv("TWITCH_APP_SECRET")
-            url = f"{TWITCH_OAUTH_URL}?client_id={cid}&client_secret={csk}&grant_type=client_credentials"
-
-            async with httpx.AsyncClient() as client:
-                res = await client.post(url)
-                token_obj = res.json()
-                TOKEN = Token(**token_obj)
-                with open(cache_file, "w") as cfw:
-                    json.dump(asdict(TOKEN), cfw)
-                LOGGER.critical("Refreshed Twitch token")
-                await audit_logger(
-                    "REFRESHED",
-                    asdict(TOKEN),
-                )
+    async def _refresh(self) -> Token:
+        now = time.monotonic()
+        if now < self.retry_at:
+            raise IGDBTokenError(
+                f"Twitch token refresh backing off for {self.retry_at - now:.0f}s"
+            )
+        try:
+            res = await resilient_call(
+                httpx.URL(TWITCH_OAUTH_URL).host,
+                lambda: http_client().post(
+                    TWITCH_OAUTH_URL,
+                    params={
+                        "client_id": os.getenv("TWITCH_APP_ID"),
+                        "client_secret": os.getenv("TWITCH_APP_SECRET"),
+                        "grant_type": "client_credentials",
+                    },
+                ),
+            )
+            res.raise_for_status()
+            token = Token(**res.json())
+        except Exception as e:
+            self.failures += 1
+            backoff = min(
+                constants.IGDB_TOKEN_REFRESH_BACKOFF_SECS * 2 ** (self.failures - 1),
+                constants.IGDB_TOKEN_REFRESH_BACKOFF_MAX_SECS,
+            )
+            self.retry_at = time.monotonic() + backoff
+            LOGGER.error(
+                f"Twitch token refresh failed, retrying in {backoff}s", exc_info=True
+            )
+            await self._audit(
+                "FAILED",
+                {"failures": self.failures, "backoff": backoff, "error": str(e)},
+            )
+            raise IGDBTokenError("Twitch token refresh failed") from e
+
+        self.failures = 0
+        self.retry_at = 0.0
+        self.token = token
+        await self.kv_store.set(self.TOKEN_KEY, asdict(token))
+        LOGGER.critical("Refreshed Twitch token")
+        await self._audit("REFRESHED", self._audit_fields(token))
+        return token
 
-    asyncio.ensure_future(_refresher())
+
+TOKEN_MANAGER: Optional[IGDBTokenManager] = None
+
+
+async def igdb_init_token_manager(db_path: str, *, audit_logger) -> IGDBTokenManager:
+    global TOKEN_MANAGER
+    TOKEN_MANAGER = IGDBTokenManager(db_path, audit_logger=audit_logger)
+    await TOKEN_MANAGER.load(os.getenv("TWITCH_TOKEN_CACHE_FILE", ".twitch_token"))
+    return TOKEN_MANAGER
 
 
 async def igdb_authed_request(*, path, data):
     url = f"{IGDB_URL}{path}"
-    headers = {
-        "Client-ID": os.getenv("TWITCH_APP_ID"),
-        "Authorization": f"Bearer {TOKEN.access_token}",
-    }
-    async with httpx.AsyncClient() as client:
-        return await client.post(
-            url,
-            data=data,
-            headers=headers,
+
+    async def _post(token: Token):
+        return await resilient_call(
+            IGDB_HOST,
+            lambda: http_client().post(
+                url,
+                content=data,
+                headers={
+                    "Client-ID": os.getenv("TWITCH_APP_ID"),
+                    "Authorization": f"Bearer {token.access_token}",
+                },
+            ),
         )
 
+    token = await TOKEN_MANAGER.get_token()
+    res = await _post(token)
+    if res.status_code == 401:
+        res = await _post(await TOKEN_MANAGER.refresh(token))
+    return res
+
 
 IMAGE_URLER_PRE = "https://images.igdb.com/igdb/image/upload/t_"
 
@@ -126,21 +262,154 @@ def embed_from_game_entry(entry) -> discord.Embed:
     return emb
 
 
-async def igdb_fetch_art(game_obj):
-    art_res = await igdb_authed_request(
-        path="/artworks", data=f'fields *; where game = {game_obj["id"]};'
+async def igdb_fetch_art(game_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    art = {}
+    to_fetch = []
+    for game_id in game_ids:
+        cached = ARTWORK_CACHE.get(game_id)
+        if cached is None:
+            to_fetch.append(game_id)
+        else:
+            art[game_id] = cached
+
+    if len(to_fetch):
+        id_list = ",".join([str(game_id) for game_id in to_fetch])
+        art_res = await igdb_authed_request(
+            path="/artworks",
+            data=f"fields {ARTWORK_FIELDS}; where game = ({id_list}); sort id asc; limit {IGDB_MAX_LIMIT};",
+        )
+        if art_res.status_code == 200:
+            fetched = {game_id: [] for game_id in to_fetch}
+            for art_obj in art_res.json():
+                fetched.setdefault(art_obj["game"], []).append(art_obj)
+            for game_id, art_list in fetched.items():
+                ARTWORK_CACHE.set(game_id, art_list)
+            art.update(fetched)
+    return art
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split())
+
+
+def _escape(query: str) -> str:
+    return query.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def remember_titles(games: List[Dict[str, Any]]):
+    if len(TITLE_INDEX) < constants.IGDB_TITLE_INDEX_MAX:
+        TITLE_INDEX.add([game["name"] for game in games if "name" in game])
+
+
+async def igdb_fetch_games(query: str) -> Optional[List[Dict[str, Any]]]:
+    games = GAME_CACHE.get(query)
+    if games is not None:
+        return games
+    res = await igdb_authed_request(
+        path="/games",
+        data=f'fields {GAME_FIELDS}; where name = "{_escape(query)}";',
     )
-    if art_res.status_code == 200:
-        return art_res.json()
-    return []
+    if res.status_code != 200:
+        print("FAIL:")
+        print(res.text)
+        return None
+    games = res.json()
+    GAME_CACHE.set(query, games)
+    remember_titles(games)
+    return games
+
+
+async def igdb_search_titles(user_id: int, current: str) -> List[str]:
+    """
+    Title suggestions for a partial query: from the local title index when it has
+    any, otherwise from an IGDB search, made only once the user has stopped
+    typing and cached so the same partial query isn't searched twice.
+    """
+    local = TITLE_INDEX.complete(current, constants.AUTOCOMPLETE_MAX_CHOICES)
+    key = normalize_text(current)
+    if len(local) or len(key) < constants.IGDB_SEARCH_MIN_CHARS:
+        return local
+    cached = SEARCH_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    _LATEST_SEARCH[user_id] = key
+    await asyncio.sleep(constants.IGDB_SEARCH_DEBOUNCE_SECS)
+    if _LATEST_SEARCH.get(user_id) != key:
+        # superseded by a later keystroke, which will do the searching
+        return []
+    del _LATEST_SEARCH[user_id]
+
+    return await _SEARCH_COALESCER.run(key, lambda: _igdb_search(key, current))
+
+
+async def _igdb_search(key: str, current: str) -> List[str]:
+    res = await igdb_authed_request(
+        path="/games",
+        data=f'search "{_escape(current.strip())}"; fields name; limit {constants.AUTOCOMPLETE_MAX_CHOICES};',
+    )
+    if res.status_code != 200:
+        return []
+    games = res.json()
+    remember_titles(games)
+    titles = list(dict.fromkeys([game["name"] for game in games if "name" in game]))
+    SEARCH_CACHE.set(key, titles)
+    return titles
+
+
+async def igdb_fetch_popular_titles() -> int:
+    added = 0
+    for page in range(constants.IGDB_POPULAR_TITLES_PAGES):
+        res = await igdb_authed_request(
+            path="/games",
+            data=(
+                "fields name; where total_rating_count > 0; sort total_rating_count desc; "
+                f"limit {IGDB_MAX_LIMIT}; offset {page * IGDB_MAX_LIMIT};"
+            ),
+        )
+        res.raise_for_status()
+        games = res.json()
+        before = len(TITLE_INDEX)
+        remember_titles(games)
+        added += len(TITLE_INDEX) - before
+        if len(games) < IGDB_MAX_LIMIT:
+            break
+    return added
+
+
+async def igdb_title_index_refresher(db_path: str):
+    global TITLE_INDEX
+    kv_store = TheBurgBotKeyedJSONStore(db_path=db_path, namespace="igdb")
+    # built in one sorted pass, off the loop: there can be up to IGDB_TITLE_INDEX_MAX
+    loaded = await run_blocking(
+        PrefixIndex, await kv_store.get("titles", default_producer=list)
+    )
+    saved_version = loaded.version
+    # keeping any titles remembered while it was loading
+    loaded.add(TITLE_INDEX.names())
+    TITLE_INDEX = loaded
+    LOGGER.info(f"Loaded {len(TITLE_INDEX)} IGDB titles")
+    while True:
+        try:
+            fetched_at = await kv_store.get("titles/popular_fetched_at") or 0
+            now = datetime.datetime.now().timestamp()
+            if now - fetched_at > constants.IGDB_POPULAR_TITLES_REFRESH_HOURS * 60 * 60:
+                added = await igdb_fetch_popular_titles()
+                await kv_store.set("titles/popular_fetched_at", now)
+                LOGGER.info(f"Added {added} popular IGDB titles")
+            if TITLE_INDEX.version != saved_version:
+                await kv_store.set("titles", TITLE_INDEX.names())
+                saved_version = TITLE_INDEX.version
+        except:
+            LOGGER.error("IGDB title index refresh failed", exc_info=True)
+        await asyncio.sleep(constants.IGDB_TITLE_INDEX_SAVE_MINUTES * 60)
 
 
 async def igdb_lookup(*, query, exact_match, audit_logger) -> List[discord.Embed]:
     try:
-        data = f'fields *; where name = "{query}";'
-        res = await igdb_authed_request(path="/games", data=data)
-        if res.status_code == 200:
-            res_ids = res.json()
+        query = normalize_query(query)
+        res_ids = await igdb_fetch_games(query)
+        if res_ids is not None:
             if audit_logger:
                 await audit_logger(
                     "FULL_RESULTS_START", {"query": query, "full_results": res_ids}
@@ -152,8 +421,9 @@ async def igdb_lookup(*, query, exact_match, audit_logger) -> List[discord.Embed
                     res_ids = [
                         item for item in res_ids if len(item["slug"]) == smallest_slug
                     ]
+            art = await igdb_fetch_art([item["id"] for item in res_ids])
             res_ids = [
-                {**item, "_artworks_fetched": await igdb_fetch_art(item)}
+                {**item, "_artworks_fetched": art.get(item["id"], [])}
                 for item in res_ids
             ]
             if audit_logger:
@@ -166,9 +436,6 @@ async def igdb_lookup(*, query, exact_match, audit_logger) -> List[discord.Embed
                     },
                 )
             return [embed_from_game_entry(entry) for entry in res_ids]
-        else:
-            print("FAIL:")
-            print(res.text)
     except:
         LOGGER.error("igdb_lookup", exc_info=True)
     finally:
@@ -244,4 +511,19 @@ class TheBurgBotUserCommand(CommandHandler):
                 exact_match,
             )
 
+        @igdb.autocomplete("query")
+        async def igdb_query_autocomplete(
+            interaction: discord.Interaction, current: str
+        ) -> List[app_commands.Choice[str]]:
+            try:
+                titles = await igdb_search_titles(interaction.user.id, current)
+            except:
+                LOGGER.error("igdb_query_autocomplete", exc_info=True)
+                return []
+            return [
+                app_commands.Choice(name=title, value=title)
+                for title in titles
+                if len(title) <= constants.AUTOCOMPLETE_MAX_CHOICE_LEN
+            ]
+
         return "igdb"
@@ -1,23 +1,115 @@
+import asyncio
 import json
-import random
-from typing import List
+import logging
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import discord
 import nanoid
 from discord import app_commands
 
-from theburgbot import constants
-from theburgbot.common import CommandHandler
+from theburgbot import constants, passphrase
+from theburgbot.common import CommandHandler, TTLCache
 from theburgbot.db import TheBurgBotDB
 
-# todo: store in DB so that bot crash doesn't wipe these out?
-INFLIGHT_INTERACTIONS = {}
+LOGGER = logging.getLogger("discord")
 
 
-def create_buttons_view(interaction_id: str):
+class InflightInvites:
+    """
+    State of each /invite whose buttons are still live, expiring with its
+    buttons and bounded in memory. With a `db_path`, it's also written through
+    to the DB, which is what lets the buttons keep working across restarts.
+    """
+
+    def __init__(
+        self,
+        ttl_secs: float = constants.INVITE_VIEW_TIMEOUT_SECS,
+        max_entries: int = constants.INVITE_INFLIGHT_MAX_ENTRIES,
+        db_path: Optional[str] = None,
+    ):
+        self.ttl_secs = ttl_secs
+        self.db_path = db_path
+        self._cache = TTLCache(ttl_secs, max_entries)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    async def set(self, interaction_id: str, state: Dict[str, Any]):
+        self._cache.set(interaction_id, state)
+        if self.db_path:
+            await TheBurgBotDB(self.db_path).set_invite_inflight(
+                interaction_id, state, time.time() + self.ttl_secs
+            )
+
+    async def get(self, interaction_id: str) -> Optional[Dict[str, Any]]:
+        state = self._cache.get(interaction_id)
+        if state is None and self.db_path:
+            # evicted to stay under the memory bound, or from before a restart
+            found = await TheBurgBotDB(self.db_path).get_invite_inflight(
+                interaction_id, time.time()
+            )
+            if found is not None:
+                (state, expires_at) = found
+                self._cache.set(interaction_id, state, expires_at - time.time())
+        return state
+
+    async def pop(self, interaction_id: str) -> Optional[Dict[str, Any]]:
+        state = self._cache.pop(interaction_id)
+        if self.db_path:
+            db = TheBurgBotDB(self.db_path)
+            if state is None:
+                found = await db.get_invite_inflight(interaction_id, time.time())
+                state = found[0] if found else None
+            await db.delete_invite_inflight(interaction_id)
+        return state
+
+    async def restore(self) -> List[Tuple[str, float]]:
+        """
+        Reloads every unexpired entry from the DB, returning their IDs and how
+        many seconds each has left.
+        """
+        if not self.db_path:
+            return []
+        now = time.time()
+        restored = []
+        for interaction_id, state, expires_at in await TheBurgBotDB(
+            self.db_path
+        ).get_invite_inflights(now):
+            self._cache.set(interaction_id, state, expires_at - now)
+            restored.append((interaction_id, expires_at - now))
+        return restored
+
+
+INFLIGHT_INVITES = InflightInvites()
+# interaction IDs whose invite is being stored
+ACCEPTING_INVITES: Set[str] = set()
+
+
+async def _expired(interaction: discord.Interaction, view: discord.ui.View):
+    view.stop()
+    await interaction.response.edit_message(
+        content="This invite has expired: use `/invite` to start again.",
+        embeds=[],
+        view=None,
+    )
+
+
+def create_buttons_view(
+    interaction_id: str, expires_in: float = constants.INVITE_VIEW_TIMEOUT_SECS
+):
     class ButtonsView(discord.ui.View):
-        def __init__(self, *, timeout=180):
-            super().__init__(timeout=timeout)
+        # no timeout so that it can be re-registered after a restart: it's stopped
+        # when its state expires instead
+        def __init__(self):
+            super().__init__(timeout=None)
+            self._expiry = asyncio.get_running_loop().call_later(expires_in, self.stop)
+
+        def _extend(self):
+            self._expiry.cancel()
+            self._expiry = asyncio.get_running_loop().call_later(
+                INFLIGHT_INVITES.ttl_secs, self.stop
+            )
 
         @discord.ui.button(
             label="Try another...",
@@ -29,9 +121,14 @@ def create_buttons_view(interaction_id: str):
             interaction: discord.Interaction,
             button: discord.ui.Button,
         ):
-            inflight_ref = INFLIGHT_INTERACTIONS[button.custom_id.split(":")[-1]]
-            (embed, code) = await create_new_invite(**inflight_ref)
-            inflight_ref["try_phrase_json"] = code
+            inflight = await INFLIGHT_INVITES.get(interaction_id)
+            if inflight is None:
+                return await _expired(interaction, self)
+            (embed, code) = await create_new_invite(**inflight)
+            await INFLIGHT_INVITES.set(
+                interaction_id, {**inflight, "try_phrase_json": code}
+            )
+            self._extend()
             await interaction.response.edit_message(embeds=[embed])
 
         @discord.ui.button(
@@ -44,9 +141,21 @@ def create_buttons_view(interaction_id: str):
             interaction: discord.Interaction,
             button: discord.ui.Button,
         ):
-            interaction_id = button.custom_id.split(":")[-1]
-            invite_key = await accept_invite(interaction, interaction_id)
-            inflight = INFLIGHT_INTERACTIONS[interaction_id]
+            if interaction_id in ACCEPTING_INVITES:
+                # a double-click: the first one is already storing the invite
+                return await interaction.response.defer()
+            inflight = await INFLIGHT_INVITES.get(interaction_id)
+            if inflight is None:
+                return await _expired(interaction, self)
+            ACCEPTING_INVITES.add(interaction_id)
+            try:
+                invite_key = await accept_invite(interaction, inflight)
+            finally:
+                ACCEPTING_INVITES.discard(interaction_id)
+            # only now that it's stored, so that the buttons work again if it wasn't
+            await INFLIGHT_INVITES.pop(interaction_id)
+            self._expiry.cancel()
+            self.stop()
             accepted_embed = create_embed(
                 inflight["invite_for"], inflight["try_phrase_json"]
             )
@@ -57,27 +166,21 @@ def create_buttons_view(interaction_id: str):
                 embeds=[accepted_embed],
                 view=None,
             )
-            del INFLIGHT_INTERACTIONS[interaction_id]
 
     return ButtonsView()
 
 
-async def generate_new_passphrase(
-    db_path: str,
-    filtered_words: List[str],
-    num_words: int,
-):
-    def _generate_one_passphrase() -> str:
-        pick_words = list(filtered_words)
-        random.shuffle(pick_words)
-        return pick_words[0:num_words]
+async def restore_invite_views(client: "TheBurgBotClient"):
+    INFLIGHT_INVITES.db_path = client.db_path
+    restored = await INFLIGHT_INVITES.restore()
+    for interaction_id, expires_in in restored:
+        client.add_view(create_buttons_view(interaction_id, expires_in))
+    LOGGER.info(f"Restored {len(restored)} in-flight invites")
+
 
-    while True:
-        try_phrase_list = _generate_one_passphrase()
-        try_phrase_json = json.dumps(try_phrase_list)
-        db = TheBurgBotDB(db_path)
-        if not await db.passphrase_exists(try_phrase_json):
-            return try_phrase_json
+async def generate_new_passphrase(db_path: str, num_words: int) -> str:
+    await passphrase.PASSPHRASES.load_issued(db_path)
+    return json.dumps(passphrase.PASSPHRASES.generate(num_words))
 
 
 def create_embed(invite_for: str, try_phrase_json: str, **kwargs):
@@ -89,27 +192,35 @@ def create_embed(invite_for: str, try_phrase_json: str, **kwargs):
     return invite_emb
 
 
-async def accept_invite(interaction: discord.Interaction, interaction_id: str):
-    db = TheBurgBotDB(INFLIGHT_INTERACTIONS[interaction_id]["db_path"])
-    try_phrase_json = INFLIGHT_INTERACTIONS[interaction_id]["try_phrase_json"]
-    invite_for = INFLIGHT_INTERACTIONS[interaction_id]["invite_for"]
-    return await db.add_new_invite(
+def entropy_footer(num_words: int) -> str:
+    bits = passphrase.PASSPHRASES.entropy_bits(num_words)
+    return f"{num_words} words from {len(passphrase.PASSPHRASES)}: ~{bits:.0f} bits of entropy"
+
+
+async def accept_invite(interaction: discord.Interaction, inflight: Dict[str, Any]):
+    db = TheBurgBotDB(inflight["db_path"])
+    try_phrase_json = inflight["try_phrase_json"]
+    invite_for = inflight["invite_for"]
+    invite_key = await db.add_new_invite(
         try_phrase_json,
         interaction.user.display_name,
         interaction.user.id,
         invite_for,
     )
+    passphrase.PASSPHRASES.mark_issued(try_phrase_json)
+    return invite_key
 
 
 async def create_new_invite(
     db_path: str,
-    filtered_words: List[str],
     invite_for: str,
     num_words: int = constants.NUM_WORDS,
     **kwargs,
 ) -> discord.Embed:
-    try_phrase_json = await generate_new_passphrase(db_path, filtered_words, num_words)
-    return (create_embed(invite_for, try_phrase_json), try_phrase_json)
+    try_phrase_json = await generate_new_passphrase(db_path, num_words)
+    embed = create_embed(invite_for, try_phrase_json)
+    embed.set_footer(text=entropy_footer(num_words))
+    return (embed, try_phrase_json)
 
 
 async def invite_cmd_handler(
@@ -117,25 +228,27 @@ async def invite_cmd_handler(
     interaction: discord.Interaction,
     invite_for: str,
     db_path,
-    filtered_words,
+    num_words: int = constants.NUM_WORDS,
 ):
-    global INFLIGHT_INTERACTIONS
     interaction_id = nanoid.generate()
     (embed, code) = await create_new_invite(
         db_path,
-        filtered_words,
         invite_for,
+        num_words,
     )
     # discord.Interaction convieniently has an .extras dictionary that users can put arbitrary data into!
     # *except* it's a _new instance_ (with .extras cleared!) passed into the button handler functions.
     # what f-ing good is that, then!? this is the *exact* use case it should be useful for! :facepalm:
     # I think discord.py may have been a mistake...
-    INFLIGHT_INTERACTIONS[interaction_id] = {
-        "try_phrase_json": code,
-        "invite_for": invite_for,
-        "db_path": db_path,
-        "filtered_words": filtered_words,
-    }
+    await INFLIGHT_INVITES.set(
+        interaction_id,
+        {
+            "try_phrase_json": code,
+            "invite_for": invite_for,
+            "db_path": db_path,
+            "num_words": num_words,
+        },
+    )
     await interaction.response.send_message(
         embed=embed,
         view=create_buttons_view(interaction_id),
@@ -146,6 +259,7 @@ async def invite_cmd_handler(
             "for": invite_for,
             "user_id": interaction.user.id,
             "passphrase": code,
+            "num_words": num_words,
         },
         event="COMMAND_INVITE",
     )
@@ -161,23 +275,32 @@ class TheBurgBotUserCommand(CommandHandler):
         command_audit_logger,
         filtered_words,
     ):
+        passphrase.init_passphrase_generator(filtered_words)
+
         @client.tree.command(
             name="invite",
             description="Create a one-time-use invite code. "
             "The response will be shown only to you.",
         )
         @app_commands.describe(
-            invite_for="Who this invite is for (Discord user or real name)"
+            invite_for="Who this invite is for (Discord user or real name)",
+            num_words=f"How many words in the passphrase (defaults to {constants.NUM_WORDS})",
         )
         @audit_log_decorator("COMMAND_INVITE", db_path=client.db_path)
-        async def create_invite(interaction: discord.Interaction, invite_for: str):
+        async def create_invite(
+            interaction: discord.Interaction,
+            invite_for: str,
+            num_words: app_commands.Range[
+                int, constants.MIN_NUM_WORDS, constants.MAX_NUM_WORDS
+            ] = constants.NUM_WORDS,
+        ):
             await command_use_logger(interaction)
             return await invite_cmd_handler(
                 command_audit_logger,
                 interaction,
                 invite_for,
                 client.db_path,
-                filtered_words,
+                num_words,
             )
 
         return "invite"
@@ -1,17 +1,83 @@
 import datetime
+import json
 import logging
+import time
 import urllib.parse
-from typing import List
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Tuple
 
 import discord
 import httpx
 from discord import app_commands
 
-from theburgbot.common import CommandHandler
+from theburgbot import constants, scry_index
+from theburgbot.common import CommandHandler, http_client
+from theburgbot.ratelimit import HOST_COALESCERS
+from theburgbot.resilience import UpstreamUnavailable, resilient_call
+from theburgbot.scry_index import normalize_name
+
+LOGGER = logging.getLogger("discord")
 
 SCRYFALL_URL = "https://api.scryfall.com"
+SCRYFALL_COLLECTION_MAX = 75
+MAX_EMBEDS_PER_MESSAGE = 10
 
-LOGGER = logging.getLogger("discord")
+_CHANNEL_LOOKUPS: Dict[int, Deque[float]] = defaultdict(deque)
+SCRYFALL_HOST = urllib.parse.urlparse(SCRYFALL_URL).hostname
+_COALESCER = HOST_COALESCERS[SCRYFALL_HOST]
+
+
+async def scryfall_request(method: str, path: str, **kwargs) -> httpx.Response:
+    # rate limiting happens in the shared client's transport for this host
+    key = (method, path, json.dumps(kwargs.get("json"), sort_keys=True))
+    return await _COALESCER.run(
+        key,
+        lambda: resilient_call(
+            SCRYFALL_HOST,
+            lambda: http_client().request(method, f"{SCRYFALL_URL}{path}", **kwargs),
+        ),
+    )
+
+
+def embed_from_card(requestor: discord.Member, item) -> discord.Embed:
+    emb = discord.Embed(title=item["name"])
+    if "scryfall_uri" in item:
+        emb.url = item["scryfall_uri"]
+    emb.set_author(name=requestor.display_name, icon_url=requestor.display_avatar.url)
+    emb.timestamp = datetime.datetime.now()
+
+    if "image_uris" in item and "png" in item["image_uris"]:
+        emb.set_image(url=item["image_uris"]["png"])
+
+    if "prices" in item:
+        for name, price in [
+            (i[0].replace("_", " "), i[1])
+            for i in item["prices"].items()
+            if i[0].startswith("usd") and i[1]
+        ]:
+            emb.add_field(name=f"Price, {name.upper()}", value=price, inline=True)
+
+    if "related_uris" in item and "gatherer" in item["related_uris"]:
+        emb.add_field(
+            name="Gatherer",
+            value=f'[{item["name"]}]({item["related_uris"]["gatherer"]})',
+        )
+    return emb
+
+
+def embeds_from_cards(
+    requestor: discord.Member, cards: List[Dict[str, Any]], max_embeds: int
+) -> Tuple[List[discord.Embed], bool]:
+    ret_list = []
+    for item in cards:
+        if len(ret_list) == max_embeds:
+            return (ret_list, True)
+        if "card_faces" in item:
+            for face in item["card_faces"]:
+                ret_list.append(embed_from_card(requestor, face))
+        else:
+            ret_list.append(embed_from_card(requestor, item))
+    return (ret_list, False)
 
 
 async def scry_lookup(
@@ -21,58 +87,141 @@ async def scry_lookup(
     max_embeds: int = 10,
     *,
     audit_logger,
-) -> List[discord.Embed]:
-    async with httpx.AsyncClient() as client:
-        res = await client.get(
-            f"{SCRYFALL_URL}/cards/search?dir=desc&q={urllib.parse.quote(lookup)}"
+) -> Tuple[List[discord.Embed], bool]:
+    if exact_match:
+        resolved = scry_index.resolve_card_name(lookup)
+        if resolved is not None and resolved != lookup:
+            await audit_logger("FUZZY_MATCH", {"query": lookup, "match": resolved})
+            lookup = resolved
+
+    card_index = scry_index.CARD_INDEX
+    if exact_match and card_index is not None:
+        # the local index holds every card, so a miss here would be a miss via the API too
+        card = card_index.get(lookup)
+        await audit_logger(
+            "LOCAL_INDEX_LOOKUP", {"hit": card is not None, "source": card_index.source}
+        )
+        return embeds_from_cards(requestor, [card] if card else [], max_embeds)
+
+    try:
+        res = await scryfall_request(
+            "GET", f"/cards/search?dir=desc&q={urllib.parse.quote(lookup)}"
         )
+    except UpstreamUnavailable as e:
+        await audit_logger("UPSTREAM_UNAVAILABLE", {"error": str(e)})
+        return ([], False)
+    if res.status_code != 200:
+        return ([], False)
+    res_json = res.json()
+    res_list = res_json["data"]
+    await audit_logger("FULL_RESULTS", {"results": res_list})
+    if exact_match:
+        res_list = [li for li in res_list if li["name"] == lookup]
+    return embeds_from_cards(requestor, res_list, max_embeds)
+
+
+async def scry_collection_lookup(
+    names: List[str], *, audit_logger
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Resolves exact card names, keyed by their normalized form in the result: from the
+    local index when it's loaded, otherwise with as few /cards/collection requests
+    as possible.
+    """
+    found = {}
+    card_index = scry_index.CARD_INDEX
+    if card_index is not None:
+        for name in names:
+            card = card_index.get(name)
+            if card:
+                found[normalize_name(name)] = card
+        await audit_logger(
+            "LOCAL_INDEX_LOOKUP", {"requested": names, "found": len(found)}
+        )
+        return found
+
+    for chunk_start in range(0, len(names), SCRYFALL_COLLECTION_MAX):
+        chunk = names[chunk_start : chunk_start + SCRYFALL_COLLECTION_MAX]
+        try:
+            res = await scryfall_request(
+                "POST",
+                "/cards/collection",
+                json={"identifiers": [{"name": name} for name in chunk]},
+            )
+        except UpstreamUnavailable as e:
+            await audit_logger("UPSTREAM_UNAVAILABLE", {"error": str(e)})
+            break
         if res.status_code != 200:
-            return ([], False)
+            LOGGER.warning(f"Scryfall collection lookup failed: {res.status_code}")
+            continue
         res_json = res.json()
-        res_list = res_json["data"]
-        await audit_logger("FULL_RESULTS", {"results": res_list})
-        if exact_match:
-            res_list = [li for li in res_list if li["name"] == lookup]
-        ret_list = []
-
-        def _emb_from_item_obj(item):
-            emb = discord.Embed(title=item["name"])
-            if "scryfall_uri" in item:
-                emb.url = item["scryfall_uri"]
-            emb.set_author(
-                name=requestor.display_name, icon_url=requestor.display_avatar.url
-            )
-            emb.timestamp = datetime.datetime.now()
-
-            if "image_uris" in item and "png" in item["image_uris"]:
-                emb.set_image(url=item["image_uris"]["png"])
-
-            if "prices" in item:
-                for name, price in [
-                    (i[0].replace("_", " "), i[1])
-                    for i in item["prices"].items()
-                    if i[0].startswith("usd") and i[1]
-                ]:
-                    emb.add_field(
-                        name=f"Price, {name.upper()}", value=price, inline=True
-                    )
-
-            if "related_uris" in item and "gatherer" in item["related_uris"]:
-                emb.add_field(
-                    name="Gatherer",
-                    value=f'[{item["name"]}]({item["related_uris"]["gatherer"]})',
-                )
-            return emb
+        await audit_logger(
+            "COLLECTION_RESULTS",
+            {"requested": chunk, "not_found": res_json.get("not_found", [])},
+        )
+        wanted = set([normalize_name(name) for name in chunk])
+        for card in res_json["data"]:
+            for name in [
+                card["name"],
+                *[face["name"] for face in card.get("card_faces", [])],
+            ]:
+                if normalize_name(name) in wanted:
+                    found.setdefault(normalize_name(name), card)
+    return found
+
 
-        for item in res_list:
-            if len(ret_list) == max_embeds:
-                return (ret_list, True)
-            if "card_faces" in item:
-                for face in item["card_faces"]:
-                    ret_list.append(_emb_from_item_obj(face))
-            else:
-                ret_list.append(_emb_from_item_obj(item))
-        return (ret_list, False)
+def _take_channel_budget(channel_id: int, wanted: int) -> int:
+    now = time.monotonic()
+    window = _CHANNEL_LOOKUPS[channel_id]
+    while len(window) and window[0] < now - 60:
+        window.popleft()
+    granted = max(
+        0, min(wanted, constants.INLINE_SCRY_MAX_PER_CHANNEL_MINUTE - len(window))
+    )
+    window.extend([now] * granted)
+    return granted
+
+
+async def inline_scry_lookup(
+    author: discord.Member, channel_id: int, card_names: List[str], *, audit_logger
+) -> List[discord.Embed]:
+    unique_names = []
+    seen = set()
+    for name in card_names:
+        normalized = normalize_name(name)
+        if len(normalized) and normalized not in seen:
+            seen.add(normalized)
+            unique_names.append(name)
+    lookup_names = unique_names[: constants.INLINE_SCRY_MAX_PER_MESSAGE]
+    lookup_names = lookup_names[: _take_channel_budget(channel_id, len(lookup_names))]
+    if len(lookup_names) < len(unique_names):
+        await audit_logger(
+            "CAPPED", {"requested": unique_names, "looked_up": lookup_names}
+        )
+    if not len(lookup_names):
+        return []
+
+    resolved = [scry_index.resolve_card_name(name) or name for name in lookup_names]
+    fuzzy_matches = {
+        name: match
+        for (name, match) in zip(lookup_names, resolved)
+        if normalize_name(name) != normalize_name(match)
+    }
+    if len(fuzzy_matches):
+        await audit_logger("FUZZY_MATCH", {"matches": fuzzy_matches})
+
+    cards = await scry_collection_lookup(
+        list(dict.fromkeys(resolved)), audit_logger=audit_logger
+    )
+    embeds = []
+    for name in dict.fromkeys(resolved):
+        card = cards.get(normalize_name(name))
+        if card:
+            (card_embeds, _was_more) = embeds_from_cards(
+                author, [card], MAX_EMBEDS_PER_MESSAGE - len(embeds)
+            )
+            embeds.extend(card_embeds)
+    return embeds
 
 
 async def scry_cmd_handler(
@@ -149,4 +298,16 @@ class TheBurgBotUserCommand(CommandHandler):
                 exact_match,
             )
 
+        @scryfall.autocomplete("query")
+        async def scryfall_query_autocomplete(
+            interaction: discord.Interaction, current: str
+        ) -> List[app_commands.Choice[str]]:
+            return [
+                app_commands.Choice(name=name, value=name)
+                for name in scry_index.CARD_NAMES.complete(
+                    current, constants.AUTOCOMPLETE_MAX_CHOICES
+                )
+                if len(name) <= constants.AUTOCOMPLETE_MAX_CHOICE_LEN
+            ]
+
         return "scry"
@@ -1,14 +1,29 @@
+import asyncio
 import datetime
+import functools
 import hashlib
+import importlib.util
 import json
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from functools import reduce
 from html.parser import HTMLParser
 from pathlib import Path
-from typing import Any, Protocol, Union
+from typing import Any, Dict, Hashable, Optional, Protocol, Tuple, Union
 
 import httpx
 import rich
 
+from theburgbot import constants
+from theburgbot.ratelimit import HOST_BUCKETS, RateLimitedTransport
+from theburgbot.resilience import resilient_call
+
+LOGGER = logging.getLogger("discord")
+
 
 class CommandHandler(Protocol):
     def register_command(
@@ -66,52 +81,344 @@ def strip_html(htmlish: str) -> str:
     return str(stripper)
 
 
+def lazy_import(name: str):
+    """
+    The module, imported on first attribute access rather than now: for slow
+    to import dependencies that many processes (or commands) never use.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
 def dprint(print_str, *args, **kwargs):
     return rich.print(
         f"[{datetime.datetime.now().isoformat()}] {print_str}", *args, **kwargs
     )
 
 
-async def http_get_cached(
-    url: str, *, ttl_hours: int = 24, reader=None, writer=None, ext: str = ""
-):
-    if not writer:
-        writer = lambda f_handle, res: f_handle.write(res.text)
-    if not reader:
-        reader = lambda f_handle: f_handle.read()
+_HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+
+
+def create_http_client(*, http2: Optional[bool] = None) -> httpx.AsyncClient:
+    if http2 is None:
+        http2 = os.getenv("THEBURGBOT_HTTP2", "0") == "1"
+    if http2 and importlib.util.find_spec("h2") is None:
+        LOGGER.warning("HTTP/2 requested but the 'h2' package is not installed")
+        http2 = False
+
+    # each busy upstream gets its own pool so one can't starve the others of connections
+    mounts = {}
+    for host, max_conns in constants.HTTP_PER_HOST_MAX_CONNECTIONS.items():
+        transport = httpx.AsyncHTTPTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=max_conns,
+                max_keepalive_connections=max_conns,
+                keepalive_expiry=constants.HTTP_KEEPALIVE_EXPIRY_SECS,
+            ),
+        )
+        if host in HOST_BUCKETS:
+            transport = RateLimitedTransport(transport, HOST_BUCKETS[host])
+        mounts[f"all://{host}"] = transport
+    return httpx.AsyncClient(
+        http2=http2,
+        mounts=mounts,
+        limits=httpx.Limits(
+            max_connections=constants.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=constants.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=constants.HTTP_KEEPALIVE_EXPIRY_SECS,
+        ),
+        timeout=httpx.Timeout(
+            constants.HTTP_TIMEOUT_SECS, connect=constants.HTTP_CONNECT_TIMEOUT_SECS
+        ),
+        headers={"User-Agent": constants.HTTP_USER_AGENT},
+    )
+
+
+def set_http_client(client: Optional[httpx.AsyncClient]):
+    global _HTTP_CLIENT
+    _HTTP_CLIENT = client
+
+
+def http_client() -> httpx.AsyncClient:
+    # TheBurgBotClient owns the shared client; this fallback is for standalone use (e.g. ical.main)
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None or _HTTP_CLIENT.is_closed:
+        _HTTP_CLIENT = create_http_client()
+    return _HTTP_CLIENT
+
+
+async def close_http_client():
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is not None:
+        await _HTTP_CLIENT.aclose()
+        _HTTP_CLIENT = None
+
+
+async def run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+class TTLCache:
+    """
+    In-memory cache whose entries expire `ttl_secs` after being set; when full,
+    the least recently used entry is evicted.
+    """
+
+    def __init__(self, ttl_secs: float, max_entries: int):
+        self.ttl_secs = ttl_secs
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl_secs: Optional[float] = None):
+        if ttl_secs is None:
+            ttl_secs = self.ttl_secs
+        self._entries[key] = (time.monotonic() + ttl_secs, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+
+    def clear(self):
+        self._entries.clear()
+
+
+@dataclass
+class CachedResponse:
+    url: str
+    path: Path
+    meta: Dict[str, Any]
+    stale: bool = False
 
-    url_224 = hashlib.sha224(url.encode("utf-8")).hexdigest()
-    cache_path = Path(__file__).resolve().parent / f".cache.{url_224}{ext}"
+    async def read_bytes(self) -> bytes:
+        return await run_blocking(self.path.read_bytes)
 
-    async def _refresh():
-        dprint(f"Refreshing {url} ({url_224})")
-        async with httpx.AsyncClient() as client:
-            res = await client.get(url)
+    async def read_text(self) -> str:
+        return (await self.read_bytes()).decode(self.meta.get("encoding") or "utf-8")
+
+
+class ResponseTooLarge(Exception):
+    pass
+
+
+class HTTPCache:
+    """
+    On-disk HTTP GET cache: fresh entries are served from disk, stale ones are
+    served while being revalidated (conditionally, via ETag/Last-Modified) in the
+    background, and concurrent refreshes of the same URL share a single request.
+    If a refresh fails, whatever is on disk is served instead.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path]):
+        self.cache_dir = Path(cache_dir)
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def _paths(self, url: str, ext: str) -> Tuple[Path, Path]:
+        url_224 = hashlib.sha224(url.encode("utf-8")).hexdigest()
+        return (
+            self.cache_dir / f"{url_224}{ext}",
+            self.cache_dir / f"{url_224}{ext}.meta.json",
+        )
+
+    @staticmethod
+    def _read_meta(meta_path: Path) -> Optional[Dict[str, Any]]:
+        try:
+            with open(meta_path, "r") as meta_f:
+                return json.load(meta_f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_meta(meta_path: Path, meta: Dict[str, Any]):
+        tmp_path = meta_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as meta_f:
+            json.dump(meta, meta_f)
+        os.replace(tmp_path, meta_path)
+
+    async def _fetch(
+        self,
+        url: str,
+        body_path: Path,
+        meta_path: Path,
+        max_bytes: Optional[int] = None,
+    ):
+        meta = await run_blocking(self._read_meta, meta_path)
+        headers = {}
+        if meta and body_path.exists():
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        dprint(f"Refreshing {url} ({body_path.name})")
+        await run_blocking(
+            functools.partial(self.cache_dir.mkdir, parents=True, exist_ok=True)
+        )
+        async with http_client().stream("GET", url, headers=headers) as res:
+            if res.status_code == 304:
+                meta["fetched_at"] = datetime.datetime.now().timestamp()
+                meta["status_code"] = 304
+                await run_blocking(self._write_meta, meta_path, meta)
+                return
             if res.status_code != 200:
-                raise Exception(f"http_get_cached {url} ({url_224})")
-            with open(cache_path, "w+") as f:
-                writer(f, res)
+                raise httpx.HTTPStatusError(
+                    f"http_get_cached {url} ({body_path.name}): {res.status_code}",
+                    request=res.request,
+                    response=res,
+                )
+            content_length = res.headers.get("Content-Length")
+            if max_bytes and content_length and int(content_length) > max_bytes:
+                raise ResponseTooLarge(f"{url} is {content_length} bytes")
 
-    if Path.exists(cache_path):
-        mod_dt = datetime.datetime.fromtimestamp(cache_path.stat().st_mtime)
-        now_ts = datetime.datetime.now().timestamp()
+            tmp_path = body_path.with_suffix(f"{body_path.suffix}.tmp")
+            tmp_f = await run_blocking(open, tmp_path, "wb")
+            num_bytes = 0
+            try:
+                async for chunk in res.aiter_bytes(constants.HTTP_CACHE_CHUNK_SIZE):
+                    num_bytes += len(chunk)
+                    if max_bytes and num_bytes > max_bytes:
+                        raise ResponseTooLarge(f"{url} is over {max_bytes} bytes")
+                    await run_blocking(tmp_f.write, chunk)
+            except:
+                await run_blocking(tmp_f.close)
+                await run_blocking(functools.partial(tmp_path.unlink, missing_ok=True))
+                raise
+            await run_blocking(tmp_f.close)
+            await run_blocking(os.replace, tmp_path, body_path)
+            await run_blocking(
+                self._write_meta,
+                meta_path,
+                {
+                    "url": url,
+                    "etag": res.headers.get("ETag"),
+                    "last_modified": res.headers.get("Last-Modified"),
+                    "encoding": res.encoding,
+                    "bytes": num_bytes,
+                    "fetched_at": datetime.datetime.now().timestamp(),
+                    "status_code": 200,
+                },
+            )
 
-        if mod_dt.timestamp() + (ttl_hours * 60 * 60) < now_ts:
-            await _refresh()
-    else:
-        await _refresh()
+    def _refresh(
+        self,
+        url: str,
+        body_path: Path,
+        meta_path: Path,
+        max_bytes: Optional[int] = None,
+        deadline_secs: float = constants.HTTP_CACHE_FETCH_DEADLINE_SECS,
+    ) -> asyncio.Task:
+        if url not in self._inflight:
+            task = asyncio.create_task(
+                resilient_call(
+                    httpx.URL(url).host,
+                    lambda: self._fetch(url, body_path, meta_path, max_bytes),
+                    deadline_secs=deadline_secs,
+                )
+            )
+            task.set_name(f"http_cache_refresh:{body_path.name}")
+            task.add_done_callback(lambda _t: self._inflight.pop(url, None))
+            task.add_done_callback(self._log_refresh_failure)
+            self._inflight[url] = task
+        return self._inflight[url]
 
-    with open(cache_path, "r") as r:
-        return reader(r)
+    @staticmethod
+    def _log_refresh_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            LOGGER.warning(
+                f"Refresh failed: {task.get_name()}",
+                exc_info=task.exception(),
+            )
 
+    async def evict(self, url: str, *, ext: str = ""):
+        for path in self._paths(url, ext):
+            await run_blocking(functools.partial(path.unlink, missing_ok=True))
 
-async def http_get_cached_json(url):
-    return await http_get_cached(
-        url,
-        ext=".json",
-        reader=lambda f_handle: json.load(f_handle),
-        writer=lambda f_handle, res: json.dump(res.json(), f_handle),
-    )
+    async def get(
+        self,
+        url: str,
+        *,
+        ttl_hours: float = 24,
+        stale_hours: float = constants.HTTP_CACHE_STALE_HOURS,
+        ext: str = "",
+        max_bytes: Optional[int] = None,
+        deadline_secs: float = constants.HTTP_CACHE_FETCH_DEADLINE_SECS,
+    ) -> CachedResponse:
+        """
+        Responses over `max_bytes` are rejected (ResponseTooLarge) and a fetch
+        (including any retries) taking longer than `deadline_secs` is abandoned;
+        either way, a previously cached copy is served instead if there is one.
+        """
+        (body_path, meta_path) = self._paths(url, ext)
+        refresh_args = (url, body_path, meta_path, max_bytes, deadline_secs)
+        meta = await run_blocking(self._read_meta, meta_path)
+        if meta and body_path.exists():
+            age_hours = (
+                datetime.datetime.now().timestamp() - meta["fetched_at"]
+            ) / 3600
+            if age_hours < ttl_hours:
+                return CachedResponse(url, body_path, meta)
+            if age_hours < ttl_hours + stale_hours:
+                self._refresh(*refresh_args)
+                return CachedResponse(url, body_path, meta, stale=True)
+
+        try:
+            # shielded so that a cancelled caller doesn't cancel the refresh for everyone else
+            await asyncio.shield(self._refresh(*refresh_args))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            if not body_path.exists():
+                raise
+            LOGGER.warning(f"Serving stale cache of {url}", exc_info=True)
+            return CachedResponse(url, body_path, meta or {}, stale=True)
+        return CachedResponse(
+            url, body_path, await run_blocking(self._read_meta, meta_path)
+        )
+
+
+_HTTP_CACHE: Optional[HTTPCache] = None
+
+
+def http_cache() -> HTTPCache:
+    global _HTTP_CACHE
+    if _HTTP_CACHE is None:
+        _HTTP_CACHE = HTTPCache(os.getenv("THEBURGBOT_CACHE_DIR", "data/cache"))
+    return _HTTP_CACHE
+
+
+async def http_get_cached(url: str, **kwargs) -> str:
+    return await (await http_cache().get(url, **kwargs)).read_text()
+
+
+async def http_get_cached_json(url: str, **kwargs):
+    return json.loads(await http_get_cached(url, ext=".json", **kwargs))
 
 
 def dt_to_date(dt_or_date: Union[datetime.date, datetime.datetime]) -> datetime.date:
@@ -3,6 +3,11 @@ DEFAULT_PORT = 3861
 MIN_WORD_LENGTH = 5
 MAX_WORD_LENGTH = 7
 NUM_WORDS = 4
+MIN_NUM_WORDS = 3
+MAX_NUM_WORDS = 8
+# how long the /invite buttons keep working after last being used
+INVITE_VIEW_TIMEOUT_SECS = 180
+INVITE_INFLIGHT_MAX_ENTRIES = 1000
 
 LDNOOBW_URL = "https://raw.githubusercontent.com/LDNOOBW/List-of-Dirty-Naughty-Obscene-and-Otherwise-Bad-Words/master/en"
 
@@ -14,10 +19,105 @@ SITE_URL = "https://TheBurg.xyz"
 USER_STATIC_HTTP_PATH = "user-static"
 
 GPT_SHORTEN_PROMPT_POSTFIX = "\n\nBe succinct in your response."
+# Discord allows 5 edits per 5 seconds per message
+GPT_STREAM_EDIT_INTERVAL_SECS = 1.5
+GPT_CACHE_TTL_HOURS = 24 * 7
+GPT_UNAVAILABLE_RESPONSE = "OpenAI service is unavailable"
+GPT_RETRY_ATTEMPTS = 5
+GPT_MAX_CONCURRENT = 4
+GPT_MAX_QUEUED_PER_USER = 3
+GPT_TOKENS_PER_MINUTE = 60000
+# rough, but only needs to be good enough to keep us under the rate limit
+GPT_PROMPT_CHARS_PER_TOKEN = 4
+GPT_RESPONSE_TOKENS_ESTIMATE = 800
+GPT_SHORT_RESPONSE_TOKENS_ESTIMATE = 250
+
+DISCORD_MAX_MESSAGE_LEN = 2000
 
 INTERNAL_VERSION_TABLE_NAME = "__tbb_int__version"
 
-DB_CUR_EXPECTED_VER = "0006"
-DB_EXPECT_TOTAL_VERS = 7
+DB_CUR_EXPECTED_VER = "0009"
+DB_EXPECT_TOTAL_VERS = 10
 
 INLINE_SCRY_PATTERN = r"\[\[(.*?)\]\]"
+INLINE_SCRY_MAX_PER_MESSAGE = 10
+INLINE_SCRY_MAX_PER_CHANNEL_MINUTE = 30
+
+PROFILE_MAX_SECONDS = 120
+PROFILE_TOP_FUNCTIONS = 40
+PROFILE_SAMPLE_INTERVAL_SECS = 0.005
+
+MEMORY_TRACE_FRAMES = 10
+MEMORY_TOP_SITES = 25
+MEMORY_WATCH_TOP_SITES = 5
+MEMORY_WATCH_HISTORY_LEN = 288
+
+HTTP_USER_AGENT = "TheBurgBot/1.0"
+HTTP_TIMEOUT_SECS = 20.0
+HTTP_CONNECT_TIMEOUT_SECS = 5.0
+HTTP_MAX_CONNECTIONS = 50
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+HTTP_KEEPALIVE_EXPIRY_SECS = 60.0
+HTTP_PER_HOST_MAX_CONNECTIONS = {
+    "api.scryfall.com": 8,
+    "api.igdb.com": 4,
+    "id.twitch.tv": 2,
+}
+
+HTTP_CACHE_STALE_HOURS = 24 * 7
+HTTP_CACHE_CHUNK_SIZE = 1024 * 1024
+
+SCRY_INDEX_REFRESH_HOURS = 12
+
+AUTOCOMPLETE_MAX_CHOICES = 25
+AUTOCOMPLETE_MAX_CHOICE_LEN = 100
+
+FUZZY_MAX_QUERY_LEN = 64
+FUZZY_MAX_CANDIDATES = 32
+FUZZY_MIN_SIMILARITY = 0.4
+FUZZY_MAX_EDIT_RATIO = 0.25
+
+# refreshed this long before the token's stated expiry
+IGDB_TOKEN_EXPIRY_MARGIN_SECS = 60 * 60
+IGDB_TOKEN_REFRESH_BACKOFF_SECS = 5
+IGDB_TOKEN_REFRESH_BACKOFF_MAX_SECS = 10 * 60
+
+IGDB_CACHE_TTL_SECS = 6 * 60 * 60
+IGDB_GAME_CACHE_MAX_ENTRIES = 512
+IGDB_ARTWORK_CACHE_MAX_ENTRIES = 2048
+IGDB_SEARCH_CACHE_MAX_ENTRIES = 1024
+IGDB_SEARCH_MIN_CHARS = 3
+IGDB_SEARCH_DEBOUNCE_SECS = 0.35
+IGDB_TITLE_INDEX_MAX = 100000
+IGDB_TITLE_INDEX_SAVE_MINUTES = 10
+IGDB_POPULAR_TITLES_PAGES = 4
+IGDB_POPULAR_TITLES_REFRESH_HOURS = 24
+
+# (requests per second, burst) shared by everything in the process talking to the host
+HTTP_HOST_RATE_LIMITS = {
+    "api.scryfall.com": (8.0, 4),
+}
+RATE_LIMIT_RECENT_WAITS = 256
+
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY_SECS = 0.5
+RETRY_MAX_DELAY_SECS = 10.0
+# for all attempts of a call, including backoff
+CALL_DEADLINE_SECS = 30.0
+HOST_CALL_DEADLINE_SECS = {
+    "api.openai.com": 240.0,
+}
+HTTP_CACHE_FETCH_DEADLINE_SECS = 15 * 60.0
+
+ICAL_FETCH_CONCURRENCY = 4
+ICAL_FETCH_TIMEOUT_SECS = 30.0
+ICAL_MAX_BYTES = 16 * 1024 * 1024
+# revalidated (conditionally) at most this often; every sync is normally much further apart
+ICAL_CACHE_TTL_HOURS = 0.5
+ICAL_PARSE_WORKERS = 2
+# how many callers' different filter strings have parsed events and occurrences kept
+ICAL_FILTER_SETS_KEPT = 4
+# recurring events are expanded this far ahead, and again once half of it has passed
+ICAL_OCCURRENCE_HORIZON_DAYS = 30
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECS = 30.0
@@ -7,7 +7,7 @@ import os
 import shutil
 import sys
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import aiosqlite
 import chevron
@@ -15,9 +15,14 @@ import discord
 import nanoid
 
 from theburgbot import constants
+from theburgbot.common import run_blocking
 
 LOGGER = logging.getLogger("discord")
 
+TEMPLATES_PATH = Path(__file__).resolve().parent / ".." / "templates"
+# template name -> (file mtime, version, contents)
+_TEMPLATES: Dict[str, Tuple[int, str, str]] = {}
+
 
 def reduce_by_empty_newline(a: List[List[Any]], x) -> List[List[Any]]:
     a[-1].append(x)
@@ -26,6 +31,22 @@ def reduce_by_empty_newline(a: List[List[Any]], x) -> List[List[Any]]:
     return a
 
 
+def load_template(template: str) -> Tuple[str, str]:
+    """
+    A template's version (a hash of its contents) and its contents, re-read
+    only when the file changes.
+    """
+    tmpl_path = TEMPLATES_PATH / f"{template}.html"
+    mtime = os.stat(tmpl_path).st_mtime_ns
+    cached = _TEMPLATES.get(template)
+    if cached is None or cached[0] != mtime:
+        with open(tmpl_path) as tmpl_f:
+            contents = tmpl_f.read()
+        version = hashlib.sha256(contents.encode("utf-8")).hexdigest()[:16]
+        cached = _TEMPLATES[template] = (mtime, version, contents)
+    return cached[1:]
+
+
 # https://stackoverflow.com/questions/42043226/using-a-coroutine-as-decorator
 def audit_log_start_end_async(event_name_prefix, db_path):
     _db = TheBurgBotDB(db_path)
@@ -192,16 +213,34 @@ class TheBurgBotDB:
             return await cursor.fetchall()
 
     async def get_http_static_rendered(self, url_id):
+        """
+        Pages are rendered on first read and whenever their template has changed
+        since, with the result stored for the next read.
+        """
         async with aiosqlite.connect(self.db_path) as db:
             cursor = await db.execute(
-                "select rendered from http_static where pub_id = ?", (url_id,)
+                "select rendered, rendered_version, template, src_obj_json from http_static where pub_id = ?",
+                (url_id,),
             )
-            await db.commit()
             rows = await cursor.fetchall()
             if len(rows) > 1:
                 LOGGER.warning(f"HTTP static ID collision?! {url_id}")
-                print(rows)
-            return None if len(rows) == 0 else rows[0][0]
+            if len(rows) == 0:
+                return None
+
+            (rendered, rendered_version, template, src_obj_json) = rows[0]
+            (version, contents) = await run_blocking(load_template, template)
+            if rendered_version == version:
+                return rendered
+            rendered = await run_blocking(
+                chevron.render, contents, json.loads(src_obj_json)
+            )
+            await db.execute(
+                "update http_static set rendered = ?, rendered_version = ? where pub_id = ?",
+                (rendered, version, url_id),
+            )
+            await db.commit()
+            return rendered
 
     async def get_users_http_statics(self, user_id):
         async with aiosqlite.connect(self.db_path) as db:
@@ -221,28 +260,97 @@ class TheBurgBotDB:
         title,
     ) -> str:
         now = datetime.datetime.now()
-        tmpl_path = (
-            Path(__file__).resolve().parent / ".." / "templates" / f"{template}.html"
-        )
-        with open(tmpl_path) as tmpl_f:
-            async with aiosqlite.connect(self.db_path) as db:
-                new_id = nanoid.generate()
-                await db.execute(
-                    "insert into http_static values (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                    (
-                        now,
-                        None,
-                        new_id,
-                        from_user_id,
-                        from_command,
-                        chevron.render(tmpl_f, src_obj),
-                        template,
-                        json.dumps(src_obj),
-                        title,
-                    ),
+        async with aiosqlite.connect(self.db_path) as db:
+            new_id = nanoid.generate()
+            # rendered when first read: see get_http_static_rendered
+            await db.execute(
+                "insert into http_static values (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL)",
+                (
+                    now,
+                    None,
+                    new_id,
+                    from_user_id,
+                    from_command,
+                    "",
+                    template,
+                    json.dumps(src_obj),
+                    title,
+                ),
+            )
+            await db.commit()
+            return new_id
+
+    async def update_http_static(self, url_id, src_obj) -> bool:
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "update http_static set updated = ?, rendered_version = NULL, src_obj_json = ? where pub_id = ?",
+                (datetime.datetime.now(), json.dumps(src_obj), url_id),
+            )
+            await db.commit()
+            return db.total_changes == 1
+
+    async def render_stale_http_statics(self) -> int:
+        """
+        Renders every page not yet rendered with its template's current version,
+        so that none of them has to be rendered on read. Returns how many were.
+        """
+        count = 0
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute("select distinct template from http_static")
+            for (template,) in await cursor.fetchall():
+                (version, contents) = await run_blocking(load_template, template)
+                cursor = await db.execute(
+                    "select pub_id, src_obj_json from http_static where template = ? "
+                    "and (rendered_version is null or rendered_version != ?)",
+                    (template, version),
                 )
+                for url_id, src_obj_json in await cursor.fetchall():
+                    rendered = await run_blocking(
+                        chevron.render, contents, json.loads(src_obj_json)
+                    )
+                    await db.execute(
+                        "update http_static set rendered = ?, rendered_version = ? where pub_id = ?",
+                        (rendered, version, url_id),
+                    )
+                    count += 1
                 await db.commit()
-                return new_id
+        return count
+
+    async def get_gpt_cached(self, cache_key: str, max_age_secs: float):
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "select response, url_id from gpt_cache where cache_key = ? and created > ?",
+                (
+                    cache_key,
+                    datetime.datetime.now() - datetime.timedelta(seconds=max_age_secs),
+                ),
+            )
+            rows = await cursor.fetchall()
+            return None if len(rows) == 0 else rows[0]
+
+    async def set_gpt_cached(
+        self,
+        cache_key: str,
+        model: str,
+        prompt: str,
+        shortened: bool,
+        response: str,
+        url_id: Optional[str],
+    ):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "insert or replace into gpt_cache values (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    datetime.datetime.now(),
+                    cache_key,
+                    model,
+                    prompt,
+                    shortened,
+                    response,
+                    url_id,
+                ),
+            )
+            await db.commit()
 
     async def cmd_use_log(self, command: str, user_id: int, display_name: str):
         async with aiosqlite.connect(self.db_path) as db:
@@ -317,6 +425,11 @@ class TheBurgBotDB:
         async with aiosqlite.connect(self.db_path) as db:
             return (await self._passphrase_exists(db, passphrase))[0]
 
+    async def get_invite_passphrases(self) -> List[str]:
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute("select passphrase from invites")
+            return [row[0] for row in await cursor.fetchall()]
+
     async def add_new_invite(
         self, passphrase: str, requestor_name: str, requestor_id: str, invite_for: str
     ):
@@ -366,6 +479,54 @@ class TheBurgBotDB:
             await db.commit()
             return await cursor.fetchall()
 
+    async def set_invite_inflight(
+        self, interaction_id: str, state: Dict[str, Any], expires_at: float
+    ):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "insert or replace into invite_inflight values (?, ?, ?)",
+                (interaction_id, expires_at, json.dumps(state)),
+            )
+            await db.commit()
+
+    async def get_invite_inflight(
+        self, interaction_id: str, now: float
+    ) -> Optional[Tuple[Dict[str, Any], float]]:
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "select state_json, expires_at from invite_inflight where interaction_id = ? and expires_at > ?",
+                (interaction_id, now),
+            )
+            rows = await cursor.fetchall()
+            return None if len(rows) == 0 else (json.loads(rows[0][0]), rows[0][1])
+
+    async def delete_invite_inflight(self, interaction_id: str):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "delete from invite_inflight where interaction_id = ?",
+                (interaction_id,),
+            )
+            await db.commit()
+
+    async def get_invite_inflights(
+        self, now: float
+    ) -> List[Tuple[str, Dict[str, Any], float]]:
+        """
+        Every unexpired in-flight invite, clearing out the expired ones.
+        """
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "delete from invite_inflight where expires_at <= ?", (now,)
+            )
+            await db.commit()
+            cursor = await db.execute(
+                "select interaction_id, state_json, expires_at from invite_inflight"
+            )
+            return [
+                (interaction_id, json.loads(state_json), expires_at)
+                for (interaction_id, state_json, expires_at) in await cursor.fetchall()
+            ]
+
     async def get_event_snowflake_if_exists(
         self, event: Dict[str, Any]
     ) -> Optional[str]:
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import (Any, Awaitable, Callable, Deque, Dict, Hashable, List,
+                    Optional, Tuple)
+
+from theburgbot import constants
+
+LOGGER = logging.getLogger("discord")
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class GPTQueueFull(Exception):
+    pass
+
+
+def estimate_tokens(prompt: str, shorten_response: bool) -> int:
+    response_estimate = (
+        constants.GPT_SHORT_RESPONSE_TOKENS_ESTIMATE
+        if shorten_response
+        else constants.GPT_RESPONSE_TOKENS_ESTIMATE
+    )
+    return len(prompt) // constants.GPT_PROMPT_CHARS_PER_TOKEN + response_estimate
+
+
+@dataclass
+class _Ticket:
+    user_id: Hashable
+    tokens: int
+    on_position: Optional[PositionCallback]
+    granted: asyncio.Future
+    position: Optional[int] = None
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+class GPTScheduler:
+    """
+    Bounded, fair admission for completions: at most `max_concurrent` run at once,
+    and the (estimated) tokens started in any minute stay under `tokens_per_minute`.
+    Each user has their own queue and the next turn goes to whichever waiting user
+    was served least recently, so one user queueing many requests only delays
+    their own.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        tokens_per_minute: int,
+        max_queued_per_user: int,
+    ):
+        self.max_concurrent = max_concurrent
+        self.tokens_per_minute = tokens_per_minute
+        self.max_queued_per_user = max_queued_per_user
+        self.running = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self._queues: Dict[Hashable, Deque[_Ticket]] = {}
+        # user -> turn number of their last grant, while they have requests queued or running
+        self._last_turn: Dict[Hashable, int] = {}
+        self._running_by_user: Dict[Hashable, int] = {}
+        self._turns = 0
+        self._window: Deque[Tuple[float, int]] = deque()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+    def _window_tokens(self, now: float) -> int:
+        while len(self._window) and self._window[0][0] <= now - 60:
+            self._window.popleft()
+        return sum([tokens for (_, tokens) in self._window])
+
+    def _users_in_turn_order(self) -> List[Hashable]:
+        return sorted(self._queues.keys(), key=lambda u: self._last_turn.get(u, -1))
+
+    def _in_turn_order(self) -> List[_Ticket]:
+        queues = [list(self._queues[u]) for u in self._users_in_turn_order()]
+        ordered = []
+        for turn in range(max([len(q) for q in queues], default=0)):
+            ordered.extend([q[turn] for q in queues if turn < len(q)])
+        return ordered
+
+    def queued(self) -> int:
+        return sum([len(q) for q in self._queues.values()])
+
+    def _dispatch(self):
+        self._wakeup = None
+        now = time.monotonic()
+        while self.running < self.max_concurrent and len(self._queues):
+            user_id = self._users_in_turn_order()[0]
+            queue = self._queues[user_id]
+            ticket = queue[0]
+            in_window = self._window_tokens(now)
+            # a request bigger than the whole budget still runs, just on its own
+            if in_window and in_window + ticket.tokens > self.tokens_per_minute:
+                self._wakeup = asyncio.get_running_loop().call_later(
+                    self._window[0][0] + 60 - now, self._dispatch
+                )
+                break
+            queue.popleft()
+            self._turns += 1
+            self._last_turn[user_id] = self._turns
+            if not len(queue):
+                del self._queues[user_id]
+            self._running_by_user[user_id] = self._running_by_user.get(user_id, 0) + 1
+            self.running += 1
+            self._window.append((now, ticket.tokens))
+            self.total_wait += now - ticket.queued_at
+            ticket.granted.set_result(None)
+        self._notify_positions()
+
+    def _notify_positions(self):
+        for position, ticket in enumerate(self._in_turn_order()):
+            if ticket.position != position:
+                ticket.position = position
+                if ticket.on_position is not None:
+                    asyncio.ensure_future(self._call_on_position(ticket, position))
+
+    @staticmethod
+    async def _call_on_position(ticket: _Ticket, position: int):
+        try:
+            await ticket.on_position(position)
+        except:
+            LOGGER.error("GPT queue position callback failed", exc_info=True)
+
+    def _forget_if_idle(self, user_id: Hashable):
+        if user_id not in self._queues and not self._running_by_user.get(user_id):
+            self._running_by_user.pop(user_id, None)
+            self._last_turn.pop(user_id, None)
+
+    def _release(self, user_id: Hashable):
+        self.running -= 1
+        self._running_by_user[user_id] -= 1
+        self._forget_if_idle(user_id)
+        if self._wakeup is None:
+            self._dispatch()
+
+    def _remove(self, ticket: _Ticket):
+        queue = self._queues.get(ticket.user_id)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            if not len(queue):
+                del self._queues[ticket.user_id]
+                self._forget_if_idle(ticket.user_id)
+            self._notify_positions()
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        user_id: Hashable,
+        tokens: int,
+        *,
+        on_position: Optional[PositionCallback] = None,
+    ):
+        """
+        Waits for this user's turn, calling `on_position` with the number of
+        requests ahead whenever it changes while queued.
+        """
+        queue = self._queues.get(user_id)
+        if queue is not None and len(queue) >= self.max_queued_per_user:
+            raise GPTQueueFull(f"{len(queue)} requests already queued")
+
+        ticket = _Ticket(
+            user_id, tokens, on_position, asyncio.get_running_loop().create_future()
+        )
+        self._queues.setdefault(user_id, deque()).append(ticket)
+        if self._wakeup is None:
+            self._dispatch()
+        else:
+            self._notify_positions()
+        try:
+            await ticket.granted
+        except BaseException:
+            if ticket.granted.done() and not ticket.granted.cancelled():
+                # granted just as we were cancelled: hand the slot back
+                self._release(user_id)
+            else:
+                self._remove(ticket)
+            raise
+
+        try:
+            yield
+        finally:
+            self.completed += 1
+            self._release(user_id)
+
+    def stats(self) -> Dict[str, Any]:
+        granted = self.completed + self.running
+        return {
+            "running": self.running,
+            "queued": self.queued(),
+            "users_queued": len(self._queues),
+            "tokens_last_minute": self._window_tokens(time.monotonic()),
+            "completed": self.completed,
+            "avg_wait": self.total_wait / granted if granted else 0.0,
+        }
+
+
+GPT_SCHEDULER = GPTScheduler(
+    constants.GPT_MAX_CONCURRENT,
+    constants.GPT_TOKENS_PER_MINUTE,
+    constants.GPT_MAX_QUEUED_PER_USER,
+)
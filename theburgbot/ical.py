@@ -1,18 +1,28 @@
 import asyncio
 import datetime
+import functools
+import hashlib
 import logging
+import multiprocessing
+import re
 import signal
 import sys
-from typing import Dict, List, Optional
-
-import icalendar
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
+from theburgbot import constants
+from theburgbot.common import ResponseTooLarge
 from theburgbot.common import dprint as print
-from theburgbot.common import dt_to_date, http_get_cached, http_get_cached_json
+from theburgbot.common import (dt_to_date, http_cache, http_get_cached_json,
+                               lazy_import, run_blocking)
 from theburgbot.db import TheBurgBotKeyedJSONStore
+from theburgbot.occurrences import OccurrenceIndex
 
 LOGGER = logging.getLogger("discord")
 
+icalendar = lazy_import("icalendar")
+
 POLL_FREQ_MINS = 10
 MTG_SETS_URL = "https://api.scryfall.com/sets"
 
@@ -26,7 +36,206 @@ MTG_FILTER_STRINGS = [
     "Board Game",
 ]
 
-INCLUDE_PROPS_DEFAULT = [*icalendar.Event.singletons, *icalendar.Event.multiple]
+
+async def _fetch_calendar(
+    name: str, url: str, semaphore: asyncio.Semaphore
+) -> Tuple[Optional[str], Dict[str, Any]]:
+    status = {"url": url, "checked_at": datetime.datetime.now().timestamp()}
+    async with semaphore:
+        started = time.monotonic()
+        try:
+            cached = await http_cache().get(
+                url,
+                ttl_hours=constants.ICAL_CACHE_TTL_HOURS,
+                stale_hours=0,
+                max_bytes=constants.ICAL_MAX_BYTES,
+                deadline_secs=constants.ICAL_FETCH_TIMEOUT_SECS,
+            )
+            ics = await cached.read_text()
+        except Exception as e:
+            LOGGER.error(f"iCal sync failed at {url} ({name})", exc_info=True)
+            status["status"] = (
+                "too large" if isinstance(e, ResponseTooLarge) else "failed"
+            )
+            status["error"] = repr(e)
+            return (None, status)
+        finally:
+            status["secs"] = round(time.monotonic() - started, 3)
+
+    if cached.stale:
+        # the refresh failed (timed out, too large, ...) but we had it from before
+        status["status"] = "stale"
+    elif cached.meta.get("fetched_at", 0) < status["checked_at"]:
+        status["status"] = "cached"
+    else:
+        status["status"] = (
+            "not modified" if cached.meta.get("status_code") == 304 else "fetched"
+        )
+    status["bytes"] = cached.meta.get("bytes")
+    status["fetched_at"] = cached.meta.get("fetched_at")
+    return (ics, status)
+
+
+async def fetch_calendars(
+    urls: Dict[str, str],
+    status_store: Optional[TheBurgBotKeyedJSONStore] = None,
+) -> Dict[str, str]:
+    """
+    Fetches every calendar concurrently (up to ICAL_FETCH_CONCURRENCY at once),
+    each with its own deadline and size cap; a calendar that fails is left out,
+    or its previously fetched copy is used if there is one. Each calendar's
+    fetch status is recorded as "ical/status" in `status_store`.
+    """
+    semaphore = asyncio.Semaphore(constants.ICAL_FETCH_CONCURRENCY)
+    names = list(urls.keys())
+    results = await asyncio.gather(
+        *[_fetch_calendar(name, urls[name], semaphore) for name in names]
+    )
+    if status_store is not None:
+        await status_store.set(
+            "ical/status",
+            {name: status for (name, (_ics, status)) in zip(names, results)},
+        )
+    return {
+        name: ics for (name, (ics, _status)) in zip(names, results) if ics is not None
+    }
+
+
+def _trie_pattern(node: Dict[str, Dict]) -> str:
+    if "" in node:
+        # a filter string ends here, which is already a match: longer ones needn't be tried
+        return ""
+    branches = [
+        re.escape(char) + _trie_pattern(child) for (char, child) in sorted(node.items())
+    ]
+    return branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+
+
+@functools.lru_cache(maxsize=8)
+def summary_matcher(filter_strings: Tuple[str, ...]) -> Optional[re.Pattern]:
+    """
+    One regex that finds any of the filter strings in a single pass: built from
+    a trie of them, so at each position only the strings sharing a prefix with
+    the text are tried. None (matching nothing) if there are no filter strings.
+    """
+    if not len(filter_strings):
+        return None
+    trie: Dict[str, Dict] = {}
+    for f_str in filter_strings:
+        node = trie
+        for char in f_str:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    return re.compile(_trie_pattern(trie))
+
+
+def _parse_calendar(
+    ics: str, summary_filter_strings: Tuple[str, ...]
+) -> List["icalendar.Event"]:
+    # runs in a worker process: see parse_calendar
+    matcher = summary_matcher(summary_filter_strings)
+    cal = icalendar.Calendar.from_ical(ics)
+    cal_events = []
+    for event in cal.walk():
+        ev_summary = event.get("SUMMARY")
+        if ev_summary is None or matcher is None:
+            continue
+        if matcher.search(ev_summary):
+            cal_events.append(event)
+    return cal_events
+
+
+_PARSE_POOL: Optional[ProcessPoolExecutor] = None
+# (calendar name, digest of the filter strings) -> (digest of its ICS, the events
+# they parsed to); every caller's filter strings get their own, least recent first
+_PARSED: Dict[Tuple[str, str], Tuple[str, List["icalendar.Event"]]] = {}
+
+
+def _parse_pool() -> ProcessPoolExecutor:
+    global _PARSE_POOL
+    if _PARSE_POOL is None:
+        # spawned, not forked: forking a process with running threads isn't safe
+        _PARSE_POOL = ProcessPoolExecutor(
+            max_workers=constants.ICAL_PARSE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _PARSE_POOL
+
+
+def shutdown_parse_pool():
+    global _PARSE_POOL
+    if _PARSE_POOL is not None:
+        _PARSE_POOL.shutdown(wait=False)
+        _PARSE_POOL = None
+
+
+def filters_digest(summary_filter_strings: List[str]) -> str:
+    return hashlib.sha256("\0".join(summary_filter_strings).encode("utf-8")).hexdigest()
+
+
+def _ics_digest(ics: str) -> str:
+    return hashlib.sha256(ics.encode("utf-8")).hexdigest()
+
+
+def prune_parsed(names: Iterable[str]):
+    """
+    Forgets the parsed events of calendars that aren't in `names`.
+    """
+    names = set(names)
+    for key in [key for key in _PARSED.keys() if key[0] not in names]:
+        del _PARSED[key]
+
+
+def parsed_version(
+    name: str, summary_filter_strings: List[str]
+) -> Optional[Tuple[str, str]]:
+    # changes whenever parse_calendar would give different events
+    key = (name, filters_digest(summary_filter_strings))
+    return (key[1], _PARSED[key][0]) if key in _PARSED else None
+
+
+async def parse_calendar(
+    name: str, ics: str, summary_filter_strings: List[str]
+) -> List["icalendar.Event"]:
+    """
+    The calendar's events with a summary matching any of the filter strings.
+    Parsing is done in a worker process, so a large calendar can't block the
+    loop, and only when the calendar has changed since it was last parsed with
+    these filter strings; the events parsed with the ICAL_FILTER_SETS_KEPT
+    most recently used sets of filter strings are kept.
+    """
+    key = (name, filters_digest(summary_filter_strings))
+    digest = await run_blocking(_ics_digest, ics)
+    cached = _PARSED.pop(key, None)
+    if cached is not None and cached[0] == digest:
+        _PARSED[key] = cached
+        return cached[1]
+    cal_events = await asyncio.get_running_loop().run_in_executor(
+        _parse_pool(), _parse_calendar, ics, tuple(summary_filter_strings)
+    )
+    _PARSED[key] = (digest, cal_events)
+    kept = [other for other in _PARSED.keys() if other[0] == name]
+    for other in kept[: -constants.ICAL_FILTER_SETS_KEPT]:
+        del _PARSED[other]
+    return cal_events
+
+
+# digest of the filter strings -> every upcoming occurrence of the events of each
+# calendar that they match, updated as they change; least recently used first
+_OCCURRENCES: Dict[str, OccurrenceIndex] = {}
+
+
+def occurrence_index(summary_filter_strings: List[str]) -> OccurrenceIndex:
+    """
+    The occurrence index of the events matching these filter strings: callers
+    with different filter strings never see (or update) each other's.
+    """
+    key = filters_digest(summary_filter_strings)
+    index = _OCCURRENCES.pop(key, None) or OccurrenceIndex()
+    _OCCURRENCES[key] = index
+    for other in list(_OCCURRENCES.keys())[: -constants.ICAL_FILTER_SETS_KEPT]:
+        del _OCCURRENCES[other]
+    return index
 
 
 async def get_current_events_from_ICS_urls(
@@ -34,72 +243,55 @@ async def get_current_events_from_ICS_urls(
     post_hours_before: int,
     summary_filter_strings: Optional[List[str]] = None,
     include_properties: Optional[List[str]] = None,
-) -> List[icalendar.Event]:
+    status_store: Optional[TheBurgBotKeyedJSONStore] = None,
+) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+    """
+    Each calendar's event occurrences that are running now or start within
+    `post_hours_before`, split into one-time and recurring ones; an occurrence
+    of a recurring event has its own DTSTART & DTEND.
+    """
     if not summary_filter_strings:
         summary_filter_strings = list()
     if not include_properties:
-        include_properties = INCLUDE_PROPS_DEFAULT
-
-    fetched = {}
-    now_date = datetime.date.today()
+        include_properties = [*icalendar.Event.singletons, *icalendar.Event.multiple]
 
-    for name, url in urls.items():
-        try:
-            fetched[name] = await http_get_cached(url)
-        except:
-            LOGGER.error(f"iCal sync failed at {url} ({name})", exc_info=True)
-            continue
+    fetched = await fetch_calendars(urls, status_store)
+    now = datetime.datetime.now(datetime.timezone.utc)
 
-    phb_timedelta = datetime.timedelta(hours=post_hours_before)
-    all_events = {}
+    occurrences = occurrence_index(summary_filter_strings)
+    prune_parsed(urls.keys())
+    for name in [name for name in occurrences.calendars() if name not in urls]:
+        occurrences.remove_calendar(name)
     for name, ics in fetched.items():
-        cal = icalendar.Calendar.from_ical(ics)
-        cal_events = []
-        for event in cal.walk():
-            ev_summary = event.get("SUMMARY")
-            if ev_summary is None:
-                continue
-            if any([f_str in ev_summary for f_str in summary_filter_strings]):
-                cal_events.append(event)
-
-        current_events = {
+        cal_events = await parse_calendar(name, ics, summary_filter_strings)
+        # unchanged calendars (the same parse digest) aren't even compared
+        occurrences.update_calendar(
+            name,
+            cal_events,
+            now,
+            version=parsed_version(name, summary_filter_strings),
+        )
+
+    all_events = {
+        name: {
             "onetime": [],
             "recurring": [],
         }
-        for event in cal_events:
-            start_dt = dt_to_date(event.get("DTSTART").dt - phb_timedelta)
-            end_dt = dt_to_date(event.get("DTEND").dt)
-
-            # one time events
-            if now_date > start_dt and now_date < end_dt:
-                current_events["onetime"].append(event)
-            else:
-                # recurring events
-                rrule = event.get("RRULE")
-                if rrule and isinstance(rrule, icalendar.prop.vRecur):
-                    # if UNTIL is in the future, the event is valid
-                    # otherwise with no UNTIL, the event is still valid
-                    until_rrules = rrule.get("UNTIL")
-                    if until_rrules and len(until_rrules):
-                        until_dt = until_rrules[0]
-                        if now_date < dt_to_date(until_dt):
-                            current_events["recurring"].append(event)
-                    else:
-                        current_events["recurring"].append(event)
-
-        return_list = {
-            "onetime": [],
-            "recurring": [],
-        }
-        for ev_type, cur_events in current_events.items():
-            for cur_event in cur_events:
-                ev_dict = {}
-                for prop_name in include_properties:
-                    prop_val = cur_event.get(prop_name)
-                    if prop_val:
-                        ev_dict[prop_name] = prop_val
-                return_list[ev_type].append(ev_dict)
-        all_events[name] = return_list
+        for name in fetched.keys()
+    }
+    for occurrence in occurrences.upcoming(
+        now, datetime.timedelta(hours=post_hours_before)
+    ):
+        if occurrence.calendar not in all_events:
+            continue
+        ev_dict = {}
+        for prop_name in include_properties:
+            prop_val = occurrence.event.get(prop_name)
+            if prop_val:
+                ev_dict[prop_name] = prop_val
+        all_events[occurrence.calendar][
+            "recurring" if occurrence.recurring else "onetime"
+        ].append(ev_dict)
     return all_events
 
 
@@ -107,16 +299,20 @@ async def mtg_current_events(
     urls: Dict[str, str],
     post_hours_before: int = 48,
     filter_strings: Optional[List[str]] = None,
+    status_store: Optional[TheBurgBotKeyedJSONStore] = None,
 ):
-    if not filter_strings:
-        filter_strings = list(MTG_FILTER_STRINGS)
+    # never extend the caller's list: it would grow by every set name on every sync
+    filter_strings = list(filter_strings or MTG_FILTER_STRINGS)
     sets = await http_get_cached_json(MTG_SETS_URL)
-    filter_strings.extend([i["name"] for i in sets["data"]])
+    filter_strings = list(
+        dict.fromkeys(filter_strings + [i["name"] for i in sets["data"]])
+    )
 
     return await get_current_events_from_ICS_urls(
         urls=urls,
         summary_filter_strings=filter_strings,
         post_hours_before=post_hours_before,
+        status_store=status_store,
     )
 
 
@@ -149,13 +345,14 @@ class iCalSyncer:
                 urls=urls,
                 post_hours_before=self.post_hours_before,
                 filter_strings=self.filter_strings,
+                status_store=self.kv_store,
             )
             sync_events = []
             print(f"iCal sync checking {len(mtg_events)} events...")
             for cal_name, events_dict in mtg_events.items():
                 for event in events_dict["onetime"]:
-                    std = event["DTSTART"].dt
-                    etd = event["DTEND"].dt
+                    std = dt_to_date(event["DTSTART"].dt)
+                    etd = dt_to_date(event["DTEND"].dt)
                     if dt_to_date(datetime.datetime.today()) > std:
                         std = None
 
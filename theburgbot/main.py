@@ -1,11 +1,8 @@
+from theburgbot.startup import STARTUP  # isort: skip (first, to time everything else)
+
 import argparse
 import os
 
-import discord
-
-from theburgbot.client import TheBurgBotClient
-from theburgbot.commands import register_slash_commands
-
 
 def parse_args() -> argparse.Namespace:
     args = argparse.ArgumentParser(description="")
@@ -14,12 +11,35 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Sync slash commands with the server.",
     )
-    args.set_defaults(sync_commands=False)
+    args.add_argument(
+        "--rebuild_wordlist",
+        action="store_true",
+        help="Rebuild the passphrase word list from its sources before starting.",
+    )
+    args.add_argument(
+        "--profile_startup",
+        "--profile-startup",
+        action="store_true",
+        help="Print how long each phase of startup took once the bot is ready.",
+    )
+    args.set_defaults(
+        sync_commands=False, rebuild_wordlist=False, profile_startup=False
+    )
     return args.parse_args()
 
 
 def main():
     args = parse_args()
+    STARTUP.enabled = args.profile_startup
+
+    with STARTUP.phase("config"):
+        import theburgbot.config
+
+    with STARTUP.phase("imports"):
+        import discord
+
+        from theburgbot.client import TheBurgBotClient
+        from theburgbot.commands import register_slash_commands
 
     client = register_slash_commands(
         TheBurgBotClient(
@@ -27,7 +47,8 @@ def main():
             sync_commands=args.sync_commands,
             command_prefix="/",
             intents=discord.Intents.all(),
-        )
+        ),
+        rebuild_wordlist=args.rebuild_wordlist,
     )
 
     client.run(os.getenv("THEBURGBOT_DISCORD_TOKEN"))
@@ -0,0 +1,254 @@
+import asyncio
+import datetime
+import functools
+import gc
+import logging
+import os
+import resource
+import sys
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from theburgbot import constants
+from theburgbot.common import run_blocking
+from theburgbot.db import TheBurgBotDB, TheBurgBotKeyedJSONStore
+
+LOGGER = logging.getLogger("discord")
+
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+@dataclass
+class MemoryBaseline:
+    taken: datetime.datetime
+    snapshot: tracemalloc.Snapshot
+    type_counts: Counter
+
+
+@dataclass
+class MemoryDiff:
+    baseline_taken: datetime.datetime
+    taken: datetime.datetime
+    rss_bytes: int
+    traced_bytes: int
+    top_sites: List[str] = field(default_factory=list)
+    top_types: List[Tuple[str, int, int]] = field(default_factory=list)
+
+
+_BASELINE: Optional[MemoryBaseline] = None
+_WATCHER: Optional[asyncio.Task] = None
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # not linux: only the peak is available, in KiB everywhere except macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def fmt_bytes(num: float) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if abs(num) < 1024:
+            return f"{num:.1f}{unit}"
+        num /= 1024
+    return f"{num:.1f}TiB"
+
+
+def type_counts() -> Counter:
+    return Counter([type(obj).__name__ for obj in gc.get_objects()])
+
+
+def is_tracing() -> bool:
+    return tracemalloc.is_tracing()
+
+
+def start_tracing(frames: int = constants.MEMORY_TRACE_FRAMES) -> bool:
+    if tracemalloc.is_tracing():
+        return False
+    tracemalloc.start(frames)
+    LOGGER.info(f"tracemalloc started ({frames} frames)")
+    return True
+
+
+def stop_tracing():
+    global _BASELINE
+    _BASELINE = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+        LOGGER.info("tracemalloc stopped")
+
+
+def _take_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+
+
+def take_baseline() -> MemoryBaseline:
+    global _BASELINE
+    start_tracing()
+    _BASELINE = MemoryBaseline(
+        taken=datetime.datetime.now(),
+        snapshot=_take_snapshot(),
+        type_counts=type_counts(),
+    )
+    return _BASELINE
+
+
+def diff_against_baseline(
+    limit: int = constants.MEMORY_TOP_SITES,
+    *,
+    baseline: Optional[MemoryBaseline] = None,
+    with_types: bool = True,
+) -> Optional[MemoryDiff]:
+    if baseline is None:
+        baseline = _BASELINE
+    if baseline is None or not tracemalloc.is_tracing():
+        return None
+
+    snapshot = _take_snapshot()
+    stat_diffs = [
+        s for s in snapshot.compare_to(baseline.snapshot, "lineno") if s.size_diff > 0
+    ]
+    cur_types = type_counts() if with_types else Counter()
+    type_growth = sorted(
+        [
+            (type_name, count, count - baseline.type_counts.get(type_name, 0))
+            for (type_name, count) in cur_types.items()
+        ],
+        key=lambda t: t[2],
+        reverse=True,
+    )
+    return MemoryDiff(
+        baseline_taken=baseline.taken,
+        taken=datetime.datetime.now(),
+        rss_bytes=rss_bytes(),
+        traced_bytes=tracemalloc.get_traced_memory()[0],
+        top_sites=[
+            f"{fmt_bytes(s.size_diff)} (+{s.count_diff} blocks) at {s.traceback[0]}"
+            for s in stat_diffs[:limit]
+        ],
+        top_types=[t for t in type_growth[:limit] if t[2] > 0],
+    )
+
+
+async def publish_memory_report(db_path: str, from_user_id, diff: MemoryDiff) -> str:
+    title = f"Memory growth since {diff.baseline_taken.isoformat()}"
+    return await TheBurgBotDB(db_path).add_http_static(
+        from_user_id,
+        "admin",
+        "admin_report",
+        {
+            "title": title,
+            "sections": [
+                {
+                    "heading": "Process",
+                    "body": f"RSS: {fmt_bytes(diff.rss_bytes)}\n"
+                    f"Traced: {fmt_bytes(diff.traced_bytes)}",
+                },
+                {
+                    "heading": "Top growing allocation sites",
+                    "body": "\n".join(diff.top_sites),
+                },
+                {
+                    "heading": "Object counts by type (count, growth)",
+                    "body": "\n".join(
+                        [
+                            f"{name}: {count} (+{growth})"
+                            for (name, count, growth) in diff.top_types
+                        ]
+                    ),
+                },
+            ],
+            "hasDownloads": False,
+            "captureTimestamp": diff.taken.isoformat(),
+        },
+        title,
+    )
+
+
+def _kv_store(db_path: str) -> TheBurgBotKeyedJSONStore:
+    return TheBurgBotKeyedJSONStore(db_path=db_path, namespace="memory")
+
+
+async def _record_watch_sample(db_path: str, baseline: MemoryBaseline):
+    # snapshotting and comparing every traced block is too slow for the event loop
+    diff = await run_blocking(
+        functools.partial(
+            diff_against_baseline,
+            constants.MEMORY_WATCH_TOP_SITES,
+            baseline=baseline,
+            with_types=False,
+        )
+    )
+    sample = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "rss": rss_bytes(),
+        "traced": diff.traced_bytes if diff else None,
+        "top_sites": diff.top_sites if diff else [],
+    }
+    kv_store = _kv_store(db_path)
+    history: List[Dict] = await kv_store.get("watch/history", default_producer=list)
+    history = [*history, sample][-constants.MEMORY_WATCH_HISTORY_LEN :]
+    await kv_store.set("watch/history", history)
+    LOGGER.info(
+        f"Memory watch: RSS {fmt_bytes(sample['rss'])}"
+        + (f", top growth {sample['top_sites'][0]}" if len(sample["top_sites"]) else "")
+    )
+
+
+async def _watcher(db_path: str, every_minutes: float):
+    start_tracing()
+    # the watcher keeps its own baseline so that admin-triggered baselines don't reset it
+    baseline = MemoryBaseline(
+        taken=datetime.datetime.now(),
+        snapshot=await run_blocking(_take_snapshot),
+        type_counts=Counter(),
+    )
+    while True:
+        await asyncio.sleep(every_minutes * 60)
+        # stop_watcher may cancel mid-sample, so that mustn't be caught here
+        try:
+            await _record_watch_sample(db_path, baseline)
+        except Exception:
+            LOGGER.error("Memory watch sample failed", exc_info=True)
+
+
+def watcher_running() -> bool:
+    return _WATCHER is not None and not _WATCHER.done()
+
+
+async def start_watcher(db_path: str, every_minutes: float):
+    global _WATCHER
+    await stop_watcher(db_path, forget=False)
+    await _kv_store(db_path).set("watch/every_minutes", every_minutes)
+    _WATCHER = asyncio.create_task(_watcher(db_path, every_minutes))
+    _WATCHER.set_name("memory_watcher")
+
+
+async def stop_watcher(db_path: str, *, forget: bool = True):
+    global _WATCHER
+    if _WATCHER is not None:
+        _WATCHER.cancel()
+        _WATCHER = None
+    if forget:
+        await _kv_store(db_path).set("watch/every_minutes", None)
+
+
+async def resume_watcher(db_path: str):
+    every_minutes = await _kv_store(db_path).get("watch/every_minutes")
+    if every_minutes:
+        LOGGER.info(f"Resuming memory watch every {every_minutes} minutes")
+        await start_watcher(db_path, every_minutes)
+
+
+async def watch_history(db_path: str) -> List[Dict]:
+    return await _kv_store(db_path).get("watch/history", default_producer=list)
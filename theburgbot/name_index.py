@@ -0,0 +1,206 @@
+import heapq
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from theburgbot import constants
+
+
+def normalize_text(text: str) -> str:
+    """
+    Case, accents and punctuation are all ignored for matching: "urzas saga",
+    "Urza's Saga" and "URZA’S SAGA" all normalize the same.
+    """
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    stripped = "".join([c for c in decomposed if not unicodedata.combining(c)])
+    return " ".join(re.sub(r"[^\w\s]", "", stripped).split())
+
+
+# below this many keys, inserting each is cheaper than merging them in
+_INSORT_MAX_BATCH = 16
+
+
+def _word_starts(norm: str) -> List[int]:
+    return [m.start() for m in re.finditer(r"(?<!\S)\S", norm)]
+
+
+class PrefixIndex:
+    """
+    Sorted-array prefix index: each name is keyed by its whole normalized form and
+    by the suffix at every later word start (so "bolt" finds "Lightning Bolt"), and
+    a query is one binary search per array plus a scan over the k matches.
+    """
+
+    def __init__(self, names: Iterable[str] = ()):
+        self.version = 0
+        self.rebuild(names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._name_set
+
+    def rebuild(self, names: Iterable[str]):
+        self._name_set = set(names)
+        self._names = sorted(self._name_set)
+        whole: List[Tuple[str, str]] = []
+        words: List[Tuple[str, str]] = []
+        for name in self._names:
+            norm = normalize_text(name)
+            whole.append((norm, name))
+            words.extend([(norm[pos:], name) for pos in _word_starts(norm)[1:]])
+        whole.sort()
+        words.sort()
+        self._whole = whole
+        self._words = words
+        self.version += 1
+
+    def add(self, names: Iterable[str]) -> int:
+        """
+        Adds the names not already indexed: a large batch is sorted on its own and
+        then merged into each array, so adding m names to n costs O(n + m log m)
+        rather than a binary insertion (and shifting the array) per name.
+        """
+        new_names = sorted(set(names) - self._name_set)
+        if not len(new_names):
+            return 0
+        whole: List[Tuple[str, str]] = []
+        words: List[Tuple[str, str]] = []
+        for name in new_names:
+            norm = normalize_text(name)
+            whole.append((norm, name))
+            words.extend([(norm[pos:], name) for pos in _word_starts(norm)[1:]])
+        self._name_set.update(new_names)
+        for keys, added in [
+            (self._names, new_names),
+            (self._whole, whole),
+            (self._words, words),
+        ]:
+            if len(added) <= _INSORT_MAX_BATCH:
+                for key in added:
+                    insort(keys, key)
+            else:
+                # timsort finds the two sorted runs and merges them in one linear pass
+                keys.extend(added)
+                keys.sort()
+        self.version += 1
+        return len(new_names)
+
+    def names(self) -> List[str]:
+        return list(self._names)
+
+    @staticmethod
+    def _scan(keys: List[Tuple[str, str]], prefix: str, limit: int, found: List[str]):
+        idx = bisect_left(keys, (prefix, ""))
+        while idx < len(keys) and len(found) < limit:
+            (key, name) = keys[idx]
+            if not key.startswith(prefix):
+                return
+            if name not in found:
+                found.append(name)
+            idx += 1
+
+    def complete(self, prefix: str, limit: int = 25) -> List[str]:
+        norm = normalize_text(prefix)
+        if not len(norm):
+            return []
+        found: List[str] = []
+        # names that start with the query rank above those with a word that does
+        self._scan(self._whole, norm, limit, found)
+        self._scan(self._words, norm, limit, found)
+        return found
+
+
+def _trigrams(norm: str) -> Set[str]:
+    padded = f"  {norm} "
+    return set([padded[i : i + 3] for i in range(len(padded) - 2)])
+
+
+def levenshtein(a: str, b: str, max_dist: Optional[int] = None) -> int:
+    """
+    Edit distance; when it's certain to exceed `max_dist`, returns early with
+    something larger than `max_dist` instead.
+    """
+    if max_dist is not None and abs(len(a) - len(b)) > max_dist:
+        return max_dist + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if max_dist is not None and min(cur) > max_dist:
+            return max_dist + 1
+        prev = cur
+    return prev[-1]
+
+
+class FuzzyIndex:
+    """
+    Trigram index for typo-tolerant name lookups. Candidates are gathered from the
+    postings of the query's trigrams and only the best few by trigram overlap are
+    compared by edit distance, so a query costs about the same no matter how close
+    (or far) it is from every name.
+    """
+
+    def __init__(
+        self,
+        names: Iterable[str] = (),
+        *,
+        max_candidates: int = constants.FUZZY_MAX_CANDIDATES,
+        min_similarity: float = constants.FUZZY_MIN_SIMILARITY,
+        max_edit_ratio: float = constants.FUZZY_MAX_EDIT_RATIO,
+    ):
+        self.max_candidates = max_candidates
+        self.min_similarity = min_similarity
+        self.max_edit_ratio = max_edit_ratio
+        self._names: List[str] = []
+        self._norms: List[str] = []
+        self._gram_counts: List[int] = []
+        self._postings: Dict[str, List[int]] = {}
+        for name in sorted(set(names)):
+            norm = normalize_text(name)
+            if not len(norm):
+                continue
+            grams = _trigrams(norm)
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(len(self._names))
+            self._names.append(name)
+            self._norms.append(norm)
+            self._gram_counts.append(len(grams))
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def match(self, query: str) -> Optional[Tuple[str, int]]:
+        """
+        The closest name and its edit distance from `query` (after normalization),
+        or None if nothing is close enough.
+        """
+        norm = normalize_text(query)[: constants.FUZZY_MAX_QUERY_LEN]
+        if not len(norm):
+            return None
+        grams = _trigrams(norm)
+        shared: Counter = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+
+        def similarity(idx: int) -> float:
+            return 2 * shared[idx] / (len(grams) + self._gram_counts[idx])
+
+        max_dist = max(1, int(len(norm) * self.max_edit_ratio))
+        # the closest, then the most similar by trigrams
+        (best_dist, best_sim, best_idx) = (max_dist + 1, 0.0, None)
+        for idx in heapq.nlargest(self.max_candidates, shared, key=similarity):
+            sim = similarity(idx)
+            if sim < self.min_similarity:
+                break
+            dist = levenshtein(norm, self._norms[idx], max_dist)
+            if dist <= max_dist and (dist, -sim) < (best_dist, -best_sim):
+                (best_dist, best_sim, best_idx) = (dist, sim, idx)
+                max_dist = dist
+        if best_idx is None:
+            return None
+        return (self._names[best_idx], best_dist)
@@ -0,0 +1,318 @@
+import datetime
+import hashlib
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from dateutil.rrule import rruleset, rrulestr
+
+from theburgbot import constants
+from theburgbot.common import lazy_import
+
+icalendar = lazy_import("icalendar")
+
+DateOrDateTime = Union[datetime.date, datetime.datetime]
+
+# ends before anything, for the empty leaves of the max-of-ends tree
+_NEVER = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+# ends after anything, so a search key sorts after every occurrence starting with it
+_FOREVER = datetime.datetime.max.replace(tzinfo=datetime.timezone.utc)
+
+
+@dataclass
+class Occurrence:
+    calendar: str
+    start: datetime.datetime
+    end: datetime.datetime
+    # the event's properties, with DTSTART & DTEND being this occurrence's
+    event: Dict[str, Any] = field(repr=False)
+    recurring: bool
+
+
+def _wall_clock(value: DateOrDateTime, tz, *, end_of_day: bool = False):
+    # a naive datetime on the event's own clock: the only way to expand across DST correctly
+    if not isinstance(value, datetime.datetime):
+        return datetime.datetime.combine(
+            value, datetime.time.max if end_of_day else datetime.time()
+        )
+    if value.tzinfo is not None:
+        # into the event's zone, or local time for a floating or all-day event
+        value = value.astimezone(tz)
+    return value.replace(tzinfo=None)
+
+
+def _localize(naive: datetime.datetime, tz) -> datetime.datetime:
+    if tz is None:
+        # "floating" times and all-day events are in local time
+        return naive.astimezone()
+    if hasattr(tz, "localize"):
+        # pytz zones (as icalendar uses) only get the right offset this way
+        return tz.localize(naive)
+    return naive.replace(tzinfo=tz)
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _prop_dts(event, name: str) -> List[DateOrDateTime]:
+    return [d.dt for prop in _as_list(event.get(name)) for d in prop.dts]
+
+
+def _event_tz(event):
+    dtstart = event.get("DTSTART").dt
+    return dtstart.tzinfo if isinstance(dtstart, datetime.datetime) else None
+
+
+def _duration(event) -> datetime.timedelta:
+    dtstart = event.get("DTSTART").dt
+    if event.get("DTEND") is not None:
+        tz = _event_tz(event)
+        return _wall_clock(event.get("DTEND").dt, tz) - _wall_clock(dtstart, tz)
+    if event.get("DURATION") is not None:
+        return event.get("DURATION").dt
+    if isinstance(dtstart, datetime.datetime):
+        return datetime.timedelta()
+    return datetime.timedelta(days=1)
+
+
+def expand_starts(
+    event,
+    after: datetime.datetime,
+    before: datetime.datetime,
+    exclude: Tuple[DateOrDateTime, ...] = (),
+) -> List[datetime.datetime]:
+    """
+    The (naive, wall clock) start of every occurrence of `event` between the
+    (naive, wall clock) `after` and `before`, honouring RRULE, RDATE & EXDATE;
+    a non-recurring event has just the one. `exclude` are further EXDATEs.
+    """
+    tz = _event_tz(event)
+    dtstart = _wall_clock(event.get("DTSTART").dt, tz)
+    rset = rruleset()
+    rset.rdate(dtstart)
+    for rrule in _as_list(event.get("RRULE")):
+        rrule = icalendar.prop.vRecur(rrule)
+        if "UNTIL" in rrule:
+            rrule["UNTIL"] = [
+                _wall_clock(until, tz, end_of_day=True) for until in rrule["UNTIL"]
+            ]
+        rset.rrule(rrulestr(rrule.to_ical().decode("utf-8"), dtstart=dtstart))
+    for rdate in _prop_dts(event, "RDATE"):
+        if not isinstance(rdate, tuple):  # PERIODs aren't supported
+            rset.rdate(_wall_clock(rdate, tz))
+    for exdate in [*_prop_dts(event, "EXDATE"), *exclude]:
+        rset.exdate(_wall_clock(exdate, tz))
+    return rset.between(after, before, inc=True)
+
+
+def _series_digest(events: list) -> str:
+    digest = hashlib.sha256()
+    for event in events:
+        digest.update(event.to_ical())
+    return digest.hexdigest()
+
+
+class OccurrenceIndex:
+    """
+    Every occurrence, up to a horizon, of the events of each calendar, kept
+    sorted by start time. A max-of-ends tree over that order (rebuilt on the
+    first query after a change) finds the occurrences overlapping a window
+    without scanning those that ended before it, so a query costs
+    O((k + 1) log n) however long the longest occurrence is. Calendars are
+    updated series by series (events sharing a UID, including overridden
+    instances): only new or changed series are expanded, and every series only
+    when the horizon moves.
+    """
+
+    def __init__(
+        self,
+        horizon: datetime.timedelta = datetime.timedelta(
+            days=constants.ICAL_OCCURRENCE_HORIZON_DAYS
+        ),
+    ):
+        self.horizon = horizon
+        self.expanded_from: Optional[datetime.datetime] = None
+        self.expanded_until: Optional[datetime.datetime] = None
+        # (start, end, seq), sorted
+        self._by_start: List[Tuple[datetime.datetime, datetime.datetime, int]] = []
+        self._occurrences: Dict[int, Occurrence] = {}
+        self._seq = 0
+        # calendar -> series key -> (digest, [events], [occurrence seq])
+        self._series: Dict[str, Dict[str, Tuple[str, list, List[int]]]] = {}
+        self._calendar_versions: Dict[str, Any] = {}
+        # the latest end under each node of a binary tree over `_by_start`
+        self._max_ends: Optional[List[datetime.datetime]] = None
+
+    def __len__(self) -> int:
+        return len(self._by_start)
+
+    def _add(self, occurrence: Occurrence) -> int:
+        self._seq += 1
+        self._occurrences[self._seq] = occurrence
+        insort(self._by_start, (occurrence.start, occurrence.end, self._seq))
+        self._max_ends = None
+        return self._seq
+
+    def _remove(self, seq: int):
+        occurrence = self._occurrences.pop(seq)
+        idx = bisect_left(self._by_start, (occurrence.start, occurrence.end, seq))
+        del self._by_start[idx]
+        self._max_ends = None
+
+    def _occurrence(
+        self, calendar: str, event, naive_start: datetime.datetime, recurring: bool
+    ) -> Occurrence:
+        tz = _event_tz(event)
+        naive_end = naive_start + _duration(event)
+        is_date = not isinstance(event.get("DTSTART").dt, datetime.datetime)
+        (start, end) = (_localize(naive_start, tz), _localize(naive_end, tz))
+        ev_dict = {
+            k: v
+            for (k, v) in event.items()
+            if k not in ["DTSTART", "DTEND", "DURATION"]
+        }
+        ev_dict["DTSTART"] = icalendar.prop.vDDDTypes(
+            naive_start.date() if is_date else start
+        )
+        ev_dict["DTEND"] = icalendar.prop.vDDDTypes(
+            naive_end.date() if is_date else end
+        )
+        return Occurrence(calendar, start, end, ev_dict, recurring)
+
+    def _expand_series(self, calendar: str, events: list) -> List[int]:
+        master = next((ev for ev in events if "RECURRENCE-ID" not in ev), None)
+        overrides = [ev for ev in events if "RECURRENCE-ID" in ev]
+        recurring = (
+            master is not None
+            and (master.get("RRULE") is not None or master.get("RDATE") is not None)
+        ) or len(overrides) > 0
+        seqs = []
+        for event, exclude in [
+            *(
+                [(master, [ev["RECURRENCE-ID"].dt for ev in overrides])]
+                if master
+                else []
+            ),
+            *[(override, []) for override in overrides],
+        ]:
+            tz = _event_tz(event)
+            duration = _duration(event)
+            after = _wall_clock(self.expanded_from.astimezone(tz), tz) - duration
+            before = _wall_clock(self.expanded_until.astimezone(tz), tz)
+            for naive_start in expand_starts(event, after, before, tuple(exclude)):
+                seqs.append(
+                    self._add(self._occurrence(calendar, event, naive_start, recurring))
+                )
+        return seqs
+
+    def _reset_horizon(self, now: datetime.datetime):
+        self.expanded_from = now
+        self.expanded_until = now + self.horizon
+        self._by_start = []
+        self._occurrences = {}
+        self._max_ends = None
+        for calendar, series in self._series.items():
+            for key, (digest, events, _seqs) in list(series.items()):
+                series[key] = (digest, events, self._expand_series(calendar, events))
+
+    def update_calendar(
+        self,
+        calendar: str,
+        events: list,
+        now: datetime.datetime,
+        *,
+        version: Any = None,
+    ) -> int:
+        """
+        Makes the index reflect `events` as the calendar's events, returning how
+        many series were (re-)expanded. Given the same `version` as last time,
+        the events are assumed unchanged and not even compared.
+        """
+        if self.expanded_until is None or now + self.horizon / 2 > self.expanded_until:
+            self._reset_horizon(now)
+
+        if version is not None and self._calendar_versions.get(calendar) == version:
+            return 0
+        self._calendar_versions[calendar] = version
+
+        grouped: Dict[str, list] = {}
+        for event in events:
+            key = str(event.get("UID") or _series_digest([event]))
+            grouped.setdefault(key, []).append(event)
+
+        series = self._series.setdefault(calendar, {})
+        for key in [key for key in series.keys() if key not in grouped]:
+            for seq in series.pop(key)[2]:
+                self._remove(seq)
+
+        expanded = 0
+        for key, series_events in grouped.items():
+            digest = _series_digest(series_events)
+            if key in series:
+                if series[key][0] == digest:
+                    continue
+                for seq in series[key][2]:
+                    self._remove(seq)
+            series[key] = (
+                digest,
+                series_events,
+                self._expand_series(calendar, series_events),
+            )
+            expanded += 1
+        return expanded
+
+    def calendars(self) -> List[str]:
+        return list(self._series.keys())
+
+    def remove_calendar(self, calendar: str):
+        for _digest, _events, seqs in self._series.pop(calendar, {}).values():
+            for seq in seqs:
+                self._remove(seq)
+        self._calendar_versions.pop(calendar, None)
+
+    def _max_end_tree(self) -> Tuple[List[datetime.datetime], int]:
+        leaves = 1
+        while leaves < len(self._by_start):
+            leaves *= 2
+        if self._max_ends is None:
+            tree = [_NEVER] * (2 * leaves)
+            for idx, (_start, occ_end, _seq) in enumerate(self._by_start):
+                tree[leaves + idx] = occ_end
+            for node in range(leaves - 1, 0, -1):
+                tree[node] = max(tree[2 * node], tree[2 * node + 1])
+            self._max_ends = tree
+        return (self._max_ends, leaves)
+
+    def overlapping(
+        self, start: datetime.datetime, end: datetime.datetime
+    ) -> List[Occurrence]:
+        """
+        Every occurrence running at any point between `start` and `end`, by start.
+        """
+        hi = bisect_right(self._by_start, (end, _FOREVER))
+        (tree, leaves) = self._max_end_tree()
+        found = []
+        # (node, index of its first leaf, leaves under it), leftmost first
+        stack = [(1, 0, leaves)]
+        while stack:
+            (node, first, width) = stack.pop()
+            if first >= hi or tree[node] <= start:
+                continue
+            if width == 1:
+                found.append(self._occurrences[self._by_start[first][2]])
+                continue
+            half = width // 2
+            stack.append((2 * node + 1, first + half, half))
+            stack.append((2 * node, first, half))
+        return found
+
+    def upcoming(
+        self, now: datetime.datetime, within: datetime.timedelta
+    ) -> List[Occurrence]:
+        """
+        Occurrences that are running now, or that start within `within` of now.
+        """
+        return self.overlapping(now, now + within)
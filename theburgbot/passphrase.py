@@ -0,0 +1,70 @@
+import asyncio
+import json
+import math
+import random
+from typing import Iterable, List, Optional, Sequence, Set
+
+from theburgbot.db import TheBurgBotDB
+from theburgbot.wordlist import WordList
+
+_RNG = random.SystemRandom()
+
+
+class PassphraseGenerator:
+    """
+    Picks distinct words by sampling indices into a fixed word tuple with the OS
+    CSPRNG, so a passphrase costs O(num_words) no matter how long the list is.
+    Uniqueness is checked against an in-memory set of every issued passphrase,
+    loaded from `invites` once and added to as invites are created.
+    """
+
+    def __init__(self, words: Iterable[str]):
+        # a WordList artifact is already deduplicated, and is best left mapped
+        self.words: Sequence[str] = (
+            words if isinstance(words, WordList) else tuple(dict.fromkeys(words))
+        )
+        self._issued: Set[str] = set()
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def entropy_bits(self, num_words: int) -> float:
+        # words aren't repeated within a passphrase, so each pick has one fewer choice
+        return sum(
+            [math.log2(len(self.words) - i) for i in range(min(num_words, len(self)))]
+        )
+
+    async def load_issued(self, db_path: str):
+        async with self._load_lock:
+            if self._loaded:
+                return
+            self._issued.update(await TheBurgBotDB(db_path).get_invite_passphrases())
+            self._loaded = True
+
+    def mark_issued(self, passphrase_json: str):
+        self._issued.add(passphrase_json)
+
+    def is_issued(self, passphrase_json: str) -> bool:
+        return passphrase_json in self._issued
+
+    def generate(self, num_words: int) -> List[str]:
+        if num_words > len(self.words):
+            raise ValueError(f"Only {len(self.words)} words to choose from")
+        while True:
+            phrase = [
+                self.words[idx]
+                for idx in _RNG.sample(range(len(self.words)), num_words)
+            ]
+            if not self.is_issued(json.dumps(phrase)):
+                return phrase
+
+
+PASSPHRASES: Optional[PassphraseGenerator] = None
+
+
+def init_passphrase_generator(words: Iterable[str]) -> PassphraseGenerator:
+    global PASSPHRASES
+    PASSPHRASES = PassphraseGenerator(words)
+    return PASSPHRASES
@@ -0,0 +1,150 @@
+import asyncio
+import base64
+import cProfile
+import datetime
+import io
+import logging
+import pstats
+import sys
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from theburgbot import constants
+from theburgbot.db import TheBurgBotDB
+
+LOGGER = logging.getLogger("discord")
+
+# nothing is installed (no profile hook, no sampler thread) unless a profile is running
+_RUNNING = False
+
+
+@dataclass
+class ProfileResult:
+    seconds: float
+    started: datetime.datetime
+    by_cumulative: str
+    by_self: str
+    collapsed: str
+    num_samples: int
+    num_calls: int
+
+
+class _StackSampler(threading.Thread):
+    """
+    cProfile only gives us caller/callee pairs, so collapsed stacks (as consumed by
+    flamegraph.pl, speedscope, etc.) come from periodically sampling the loop thread.
+    Samples can only be taken when the loop thread gives up the GIL, so work shorter
+    than `sys.getswitchinterval()` is under-represented; the cProfile tables are exact.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True, name="tbb-stack-sampler")
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_evt = threading.Event()
+
+    def run(self):
+        while not self._stop_evt.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            if len(stack):
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_evt.set()
+        self.join()
+
+    def collapsed(self) -> str:
+        return "\n".join(
+            [f"{stack} {count}" for (stack, count) in self.stacks.most_common()]
+        )
+
+
+def _stats_str(prof: cProfile.Profile, sort_key: str, limit: int) -> str:
+    out = io.StringIO()
+    pstats.Stats(prof, stream=out).strip_dirs().sort_stats(sort_key).print_stats(limit)
+    return out.getvalue()
+
+
+async def profile_event_loop(
+    seconds: float,
+    *,
+    limit: int = constants.PROFILE_TOP_FUNCTIONS,
+    sample_interval: float = constants.PROFILE_SAMPLE_INTERVAL_SECS,
+) -> Optional[ProfileResult]:
+    """
+    Profiles everything that runs on the current event loop's thread for `seconds`.
+    Returns None if a profile is already in progress.
+    """
+    global _RUNNING
+    if _RUNNING:
+        return None
+    _RUNNING = True
+
+    started = datetime.datetime.now()
+    prof = cProfile.Profile()
+    sampler = _StackSampler(threading.get_ident(), sample_interval)
+    try:
+        sampler.start()
+        prof.enable()
+        await asyncio.sleep(seconds)
+    finally:
+        prof.disable()
+        sampler.stop()
+        _RUNNING = False
+
+    stats = pstats.Stats(prof)
+    LOGGER.info(f"Profiled event loop for {seconds}s ({stats.total_calls} calls)")
+    return ProfileResult(
+        seconds=seconds,
+        started=started,
+        by_cumulative=_stats_str(prof, "cumulative", limit),
+        by_self=_stats_str(prof, "tottime", limit),
+        collapsed=sampler.collapsed(),
+        num_samples=sum(sampler.stacks.values()),
+        num_calls=stats.total_calls,
+    )
+
+
+async def publish_profile_report(
+    db_path: str, from_user_id, result: ProfileResult
+) -> str:
+    title = f"Event loop profile: {result.seconds}s at {result.started.isoformat()}"
+    return await TheBurgBotDB(db_path).add_http_static(
+        from_user_id,
+        "admin",
+        "admin_report",
+        {
+            "title": title,
+            "sections": [
+                {
+                    "heading": "Top functions by cumulative time",
+                    "body": result.by_cumulative,
+                },
+                {"heading": "Top functions by self time", "body": result.by_self},
+                {"heading": "Collapsed stacks", "body": result.collapsed},
+            ],
+            "hasDownloads": True,
+            "downloads": [
+                {
+                    "name": f"profile-{result.started.strftime('%Y%m%d%H%M%S')}.folded",
+                    "mimeType": "text/plain",
+                    "b64": base64.b64encode(result.collapsed.encode("utf-8")).decode(
+                        "ascii"
+                    ),
+                },
+            ],
+            "captureTimestamp": datetime.datetime.now().isoformat(),
+        },
+        title,
+    )
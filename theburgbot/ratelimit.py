@@ -0,0 +1,122 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+import httpx
+
+from theburgbot import constants
+
+
+class TokenBucket:
+    """
+    Async token bucket. Waiters are served strictly in arrival order (asyncio.Lock
+    wakes its waiters FIFO), so a burst from one caller can't starve the others.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._recent_waits: Deque[float] = deque(
+            maxlen=constants.RATE_LIMIT_RECENT_WAITS
+        )
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        if self._lock is None:
+            # created lazily so that it belongs to the loop that first uses it
+            self._lock = asyncio.Lock()
+        start = time.monotonic()
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            async with self._lock:
+                self._refill()
+                if self._tokens < 1:
+                    await asyncio.sleep((1 - self._tokens) / self.rate)
+                    self._refill()
+                self._tokens -= 1
+        finally:
+            self.queue_depth -= 1
+        waited = time.monotonic() - start
+        self.acquired += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self._recent_waits.append(waited)
+
+    def stats(self) -> Dict[str, Any]:
+        recent = sorted(self._recent_waits)
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "acquired": self.acquired,
+            "avg_wait": self.total_wait / self.acquired if self.acquired else 0.0,
+            "p95_wait": recent[int(len(recent) * 0.95)] if len(recent) else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+class RequestCoalescer:
+    """
+    Identical requests made while one is already in flight wait for, and share,
+    that request's result instead of making their own.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, coro_fn: Callable[[], Awaitable[Any]]) -> Any:
+        if key in self._inflight:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(coro_fn())
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+            self._inflight[key] = task
+        return await asyncio.shield(self._inflight[key])
+
+    def stats(self) -> Dict[str, Any]:
+        return {"inflight": len(self._inflight), "coalesced": self.coalesced}
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, bucket: TokenBucket):
+        self.transport = transport
+        self.bucket = bucket
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await self.bucket.acquire()
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+HOST_BUCKETS: Dict[str, TokenBucket] = {
+    host: TokenBucket(rate, burst)
+    for (host, (rate, burst)) in constants.HTTP_HOST_RATE_LIMITS.items()
+}
+HOST_COALESCERS: Dict[str, RequestCoalescer] = {
+    host: RequestCoalescer() for host in constants.HTTP_HOST_RATE_LIMITS.keys()
+}
+
+
+def host_stats() -> Dict[str, Dict[str, Any]]:
+    return {
+        host: {**bucket.stats(), **HOST_COALESCERS[host].stats()}
+        for (host, bucket) in HOST_BUCKETS.items()
+    }
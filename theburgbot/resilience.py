@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+
+from theburgbot import constants
+
+LOGGER = logging.getLogger("discord")
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class UpstreamUnavailable(Exception):
+    pass
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures, failing calls fast for
+    `reset_secs`; then a single trial call is let through (half-open), which
+    either closes the breaker again or re-opens it.
+    """
+
+    def __init__(self, host: str, failure_threshold: int, reset_secs: float):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_secs = reset_secs
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.times_opened = 0
+        self.rejected = 0
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_secs:
+            return "open"
+        return "half-open"
+
+    def before_call(self) -> bool:
+        """
+        Raises CircuitOpenError if the call can't be made; True if it's the trial.
+        """
+        state = self.state
+        if state == "open" or (state == "half-open" and self._trial_running):
+            self.rejected += 1
+            raise CircuitOpenError(f"{self.host} is unavailable (circuit open)")
+        if state == "half-open":
+            self._trial_running = True
+        return state == "half-open"
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_running or (
+            self.opened_at is None and self.failures >= self.failure_threshold
+        ):
+            if self.opened_at is None:
+                LOGGER.warning(f"Circuit opened for {self.host}")
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+        self._trial_running = False
+
+    def abandon_trial(self):
+        # neither a success nor a failure (e.g. cancelled): the next call can be the trial
+        self._trial_running = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+BREAKERS: Dict[str, CircuitBreaker] = {}
+
+
+def breaker_for(host: str) -> CircuitBreaker:
+    if host not in BREAKERS:
+        BREAKERS[host] = CircuitBreaker(
+            host, constants.BREAKER_FAILURE_THRESHOLD, constants.BREAKER_RESET_SECS
+        )
+    return BREAKERS[host]
+
+
+def breaker_stats() -> Dict[str, Dict[str, Any]]:
+    return {host: breaker.stats() for (host, breaker) in BREAKERS.items()}
+
+
+def backoff_delay(attempt: int) -> float:
+    # "full jitter": spreads retries out so callers that failed together don't retry together
+    return random.uniform(
+        0,
+        min(
+            constants.RETRY_MAX_DELAY_SECS,
+            constants.RETRY_BASE_DELAY_SECS * 2**attempt,
+        ),
+    )
+
+
+def is_retryable_http_error(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+def _retry_after(res: httpx.Response) -> Optional[float]:
+    try:
+        return float(res.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+async def resilient_call(
+    host: str,
+    coro_fn: Callable[[], Awaitable[T]],
+    *,
+    attempts: Optional[int] = None,
+    deadline_secs: Optional[float] = None,
+    is_retryable: Callable[[Exception], bool] = is_retryable_http_error,
+    on_retry: Optional[Callable[[int, Any, float], Awaitable[None]]] = None,
+) -> T:
+    """
+    Calls `coro_fn` through `host`'s circuit breaker, retrying retryable errors
+    (and httpx responses with retryable statuses) with jittered exponential
+    backoff, for no longer than the deadline in total. Once out of attempts or
+    time, a retryable response is returned as-is but a retryable error becomes
+    UpstreamUnavailable; errors that aren't retryable are raised immediately.
+    """
+    if attempts is None:
+        attempts = constants.RETRY_ATTEMPTS
+    if deadline_secs is None:
+        deadline_secs = constants.HOST_CALL_DEADLINE_SECS.get(
+            host, constants.CALL_DEADLINE_SECS
+        )
+    breaker = breaker_for(host)
+    deadline = time.monotonic() + deadline_secs
+    for attempt in range(attempts):
+        is_trial = breaker.before_call()
+        failed_with = None
+        try:
+            result = await asyncio.wait_for(coro_fn(), deadline - time.monotonic())
+        except Exception as e:
+            if not is_retryable(e):
+                # the upstream answered, so it isn't down
+                breaker.record_success()
+                raise
+            failed_with = e
+            delay = backoff_delay(attempt)
+        except BaseException:
+            if is_trial:
+                breaker.abandon_trial()
+            raise
+        else:
+            if not (
+                isinstance(result, httpx.Response)
+                and result.status_code in RETRYABLE_STATUS_CODES
+            ):
+                breaker.record_success()
+                return result
+            failed_with = result
+            delay = _retry_after(result) or backoff_delay(attempt)
+
+        breaker.record_failure()
+        if attempt + 1 == attempts or time.monotonic() + delay >= deadline:
+            break
+        if on_retry is not None:
+            await on_retry(attempt, failed_with, delay)
+        await asyncio.sleep(delay)
+
+    if isinstance(failed_with, httpx.Response):
+        return failed_with
+    raise UpstreamUnavailable(f"{host}: {failed_with!r}") from failed_with
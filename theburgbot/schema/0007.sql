@@ -0,0 +1,9 @@
+create table gpt_cache (
+    created date not null,
+    cache_key text not null primary key,
+    model text not null,
+    prompt text not null,
+    shortened integer not null,
+    response text not null,
+    url_id text
+);
\ No newline at end of file
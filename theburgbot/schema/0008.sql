@@ -0,0 +1 @@
+alter table http_static add column rendered_version text;
\ No newline at end of file
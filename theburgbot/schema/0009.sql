@@ -0,0 +1,5 @@
+create table invite_inflight (
+    interaction_id text not null primary key,
+    expires_at real not null,
+    state_json text not null
+);
\ No newline at end of file
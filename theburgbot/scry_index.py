@@ -0,0 +1,279 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from theburgbot import constants
+from theburgbot.common import http_cache, http_get_cached_json, run_blocking
+from theburgbot.name_index import FuzzyIndex, PrefixIndex
+
+LOGGER = logging.getLogger("discord")
+
+BULK_DATA_URL = "https://api.scryfall.com/bulk-data"
+CARD_NAMES_CATALOG_URL = "https://api.scryfall.com/catalog/card-names"
+BULK_DATA_TYPE = "oracle_cards"
+INDEX_FILE_NAME = "index.json"
+INDEX_FORMAT_VERSION = 1
+
+# only what scry.embed_from_card renders is kept, which is a small fraction of each card
+_KEEP_FIELDS = ["name", "scryfall_uri", "image_uris", "prices", "related_uris"]
+
+CARD_INDEX: Optional["ScryCardIndex"] = None
+# replaced wholesale when the name list changes, so always reference these via the module
+CARD_NAMES = PrefixIndex()
+CARD_FUZZY = FuzzyIndex()
+_CARD_NAMES_DIGEST: Optional[str] = None
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(name.casefold().split())
+
+
+def _compact_card(card: Dict[str, Any]) -> Dict[str, Any]:
+    compact = {k: card[k] for k in _KEEP_FIELDS if k in card}
+    if "image_uris" in compact:
+        compact["image_uris"] = {
+            k: v for (k, v) in compact["image_uris"].items() if k == "png"
+        }
+    if "related_uris" in compact:
+        compact["related_uris"] = {
+            k: v for (k, v) in compact["related_uris"].items() if k == "gatherer"
+        }
+    if "prices" in compact:
+        compact["prices"] = {
+            k: v for (k, v) in compact["prices"].items() if k.startswith("usd") and v
+        }
+    if "card_faces" in card:
+        compact["card_faces"] = [_compact_card(face) for face in card["card_faces"]]
+    return compact
+
+
+def iter_bulk_cards(
+    src_path: Union[str, Path], chunk_size: int = 1024 * 1024
+) -> Iterator[Dict[str, Any]]:
+    """
+    Streams the objects out of a (potentially very large) top-level JSON array,
+    without ever holding more than a chunk and one object in memory.
+    """
+    decoder = json.JSONDecoder()
+    with open(src_path, "r", encoding="utf-8") as src_f:
+        buf = ""
+        pos = 0
+        eof = False
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n[,]":
+                pos += 1
+            if pos == len(buf):
+                if eof:
+                    return
+                buf = src_f.read(chunk_size)
+                pos = 0
+                eof = len(buf) == 0
+                continue
+            try:
+                (obj, end) = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                more = src_f.read(chunk_size)
+                if not len(more):
+                    raise
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+            yield obj
+            pos = end
+
+
+class ScryCardIndex:
+    """
+    Exact-name card lookups from disk: compact card records are stored one per
+    line in a data file, and the index maps each normalized card (and face) name
+    to the record's offset and length.
+    """
+
+    def __init__(self, index_dir: Union[str, Path], header: Dict[str, Any]):
+        self.index_dir = Path(index_dir)
+        self.header = header
+        self.entries: Dict[str, List] = header["entries"]
+        self._data_f = open(self.index_dir / header["data_file"], "rb")
+
+    def __len__(self) -> int:
+        return self.header["count"]
+
+    @property
+    def source(self) -> Dict[str, Any]:
+        return self.header["source"]
+
+    def names(self) -> List[str]:
+        return sorted(set([entry[2] for entry in self.entries.values()]))
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(normalize_name(name))
+        if entry is None:
+            return None
+        (offset, length, _name) = entry
+        return json.loads(os.pread(self._data_f.fileno(), length, offset))
+
+    def close(self):
+        self._data_f.close()
+
+    @classmethod
+    def load(cls, index_dir: Union[str, Path]) -> Optional["ScryCardIndex"]:
+        try:
+            with open(Path(index_dir) / INDEX_FILE_NAME, "r") as idx_f:
+                header = json.load(idx_f)
+            if header.get("version") != INDEX_FORMAT_VERSION:
+                return None
+            return cls(index_dir, header)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @classmethod
+    def build(
+        cls,
+        src_path: Union[str, Path],
+        index_dir: Union[str, Path],
+        source: Optional[Dict[str, Any]] = None,
+    ) -> "ScryCardIndex":
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+        data_file = f"cards-{stamp}.jsonl"
+
+        entries = {}
+        count = 0
+        with open(index_dir / data_file, "wb") as data_f:
+            for card in iter_bulk_cards(src_path):
+                if "name" not in card:
+                    continue
+                record = json.dumps(_compact_card(card), separators=(",", ":")).encode(
+                    "utf-8"
+                )
+                entry = [data_f.tell(), len(record), card["name"]]
+                data_f.write(record + b"\n")
+                count += 1
+                # a card's full name always wins over another card's face name
+                for face in card.get("card_faces", []):
+                    if "name" in face:
+                        entries.setdefault(normalize_name(face["name"]), entry)
+                entries[normalize_name(card["name"])] = entry
+
+        header = {
+            "version": INDEX_FORMAT_VERSION,
+            "built_at": datetime.datetime.now().isoformat(),
+            "source": source or {},
+            "data_file": data_file,
+            "count": count,
+            "entries": entries,
+        }
+        tmp_path = index_dir / f"{INDEX_FILE_NAME}.tmp"
+        with open(tmp_path, "w") as idx_f:
+            json.dump(header, idx_f, separators=(",", ":"))
+        os.replace(tmp_path, index_dir / INDEX_FILE_NAME)
+
+        for stale_data in index_dir.glob("cards-*.jsonl"):
+            if stale_data.name != data_file:
+                stale_data.unlink()
+
+        LOGGER.info(f"Built Scryfall card index of {count} cards at {index_dir}")
+        return cls(index_dir, header)
+
+
+def card_index_dir() -> Path:
+    return Path(os.getenv("THEBURGBOT_SCRY_INDEX_DIR", "data/scry_index"))
+
+
+async def load_card_index() -> Optional[ScryCardIndex]:
+    global CARD_INDEX
+    loaded = await run_blocking(ScryCardIndex.load, card_index_dir())
+    if loaded is not None:
+        if CARD_INDEX is not None:
+            CARD_INDEX.close()
+        CARD_INDEX = loaded
+        LOGGER.info(f"Loaded Scryfall card index of {len(loaded)} cards")
+    return CARD_INDEX
+
+
+async def refresh_card_index() -> Optional[ScryCardIndex]:
+    global CARD_INDEX
+    bulk_list = await http_get_cached_json(
+        BULK_DATA_URL, ttl_hours=constants.SCRY_INDEX_REFRESH_HOURS
+    )
+    bulk = next((b for b in bulk_list["data"] if b["type"] == BULK_DATA_TYPE), None)
+    if bulk is None:
+        LOGGER.warning(f"No '{BULK_DATA_TYPE}' in Scryfall bulk data listing")
+        return CARD_INDEX
+
+    source = {"updated_at": bulk["updated_at"], "download_uri": bulk["download_uri"]}
+    if CARD_INDEX is not None and CARD_INDEX.source == source:
+        return CARD_INDEX
+
+    # download_uri changes with every update, so the cached copy never needs revalidating
+    cached = await http_cache().get(
+        bulk["download_uri"], ttl_hours=24 * 365, stale_hours=0, ext=".json"
+    )
+    built = await run_blocking(
+        ScryCardIndex.build, cached.path, card_index_dir(), source
+    )
+    (previous, CARD_INDEX) = (CARD_INDEX, built)
+    if previous is not None:
+        # lookups are synchronous, so nothing can be reading from it past the swap
+        previous.close()
+    # the index has everything we need from it and the next update will have a new URI
+    await http_cache().evict(bulk["download_uri"], ext=".json")
+    return CARD_INDEX
+
+
+def _names_digest(names: List[str]) -> str:
+    return hashlib.sha256("\n".join(names).encode("utf-8")).hexdigest()
+
+
+async def refresh_card_names() -> PrefixIndex:
+    global CARD_NAMES, CARD_FUZZY, _CARD_NAMES_DIGEST
+    if CARD_INDEX is not None:
+        names = await run_blocking(CARD_INDEX.names)
+    else:
+        catalog = await http_get_cached_json(
+            CARD_NAMES_CATALOG_URL, ttl_hours=constants.SCRY_INDEX_REFRESH_HOURS
+        )
+        names = catalog["data"]
+
+    digest = await run_blocking(_names_digest, names)
+    if digest != _CARD_NAMES_DIGEST:
+        CARD_NAMES = await run_blocking(PrefixIndex, names)
+        CARD_FUZZY = await run_blocking(FuzzyIndex, _with_face_names(names))
+        _CARD_NAMES_DIGEST = digest
+        LOGGER.info(f"Rebuilt card name indices ({len(CARD_NAMES)} names)")
+    return CARD_NAMES
+
+
+def _with_face_names(names: List[str]) -> List[str]:
+    # "Fire // Ice" is also findable as "Fire" and "Ice", as it is by exact lookup
+    return names + [
+        face for name in names if " // " in name for face in name.split(" // ")
+    ]
+
+
+def resolve_card_name(name: str) -> Optional[str]:
+    """
+    The card name that `name` was most likely meant to be, tolerating case,
+    punctuation and small typos; None if there's no plausible match.
+    """
+    if CARD_INDEX is not None and normalize_name(name) in CARD_INDEX.entries:
+        return name
+    found = CARD_FUZZY.match(name)
+    return found[0] if found else None
+
+
+async def card_index_refresher():
+    await load_card_index()
+    while True:
+        for refresher in [refresh_card_names, refresh_card_index, refresh_card_names]:
+            try:
+                await refresher()
+            except:
+                LOGGER.error(f"Scryfall {refresher.__name__} failed", exc_info=True)
+        await asyncio.sleep(constants.SCRY_INDEX_REFRESH_HOURS * 60 * 60)
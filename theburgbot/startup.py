@@ -0,0 +1,54 @@
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
+# deliberately imports nothing else of ours: it's imported first so that it can time the rest
+_STARTED = time.perf_counter()
+
+
+class StartupProfiler:
+    """
+    Wall-clock time of each named startup phase; phases are only recorded
+    once enabled, and may be entered more than once (their times add up).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.phases: List[Tuple[str, float]] = []
+        self.finished_at = None
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.enabled:
+                self.phases.append((name, time.perf_counter() - started))
+
+    def finish(self) -> str:
+        self.finished_at = time.perf_counter()
+        return self.report()
+
+    def report(self) -> str:
+        total = (self.finished_at or time.perf_counter()) - _STARTED
+        by_phase = {}
+        for name, secs in self.phases:
+            by_phase[name] = by_phase.get(name, 0.0) + secs
+        # everything not in a phase: interpreter start, Discord login & gateway connect, etc.
+        by_phase["(other)"] = total - sum(by_phase.values())
+        width = max([len(name) for name in by_phase])
+        lines = [
+            f"{name.ljust(width)}  {secs * 1000:9.1f}ms  {100 * secs / total:5.1f}%"
+            for (name, secs) in by_phase.items()
+        ]
+        return "\n".join(
+            [
+                "Startup profile:",
+                *lines,
+                f"{'total'.ljust(width)}  {total * 1000:9.1f}ms",
+            ]
+        )
+
+
+STARTUP = StartupProfiler()
@@ -0,0 +1,217 @@
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+from theburgbot import constants
+
+LOGGER = logging.getLogger("discord")
+
+WORDLIST_MAGIC = b"TBBWORDS"
+WORDLIST_FORMAT_VERSION = 1
+# magic, format version, word count, min & max word length, then the sha256s of
+# the word corpus, the bad words list and everything after this header
+_HEADER = struct.Struct("<8sIIHH32s32s32s")
+_OFFSET = struct.Struct("<I")
+
+
+def wordlist_path() -> Path:
+    return Path(os.getenv("THEBURGBOT_WORDLIST_PATH", "data/wordlist.bin"))
+
+
+def _sha256(data: Union[str, bytes]) -> bytes:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).digest()
+
+
+def filter_words(
+    corpus_words: Iterable[str],
+    badwords: Iterable[str],
+    min_word_length: int,
+    max_word_length: int,
+) -> List[str]:
+    badwords = set(badwords)
+    return list(
+        dict.fromkeys(
+            [
+                word
+                for word in corpus_words
+                if min_word_length <= len(word) <= max_word_length
+                and not word[0].isupper()
+                and not word in badwords
+            ]
+        )
+    )
+
+
+def write_wordlist(
+    path: Union[str, Path],
+    corpus_words: Iterable[str],
+    badwords: Iterable[str],
+    min_word_length: int = constants.MIN_WORD_LENGTH,
+    max_word_length: int = constants.MAX_WORD_LENGTH,
+) -> int:
+    """
+    Filters the corpus and writes the result as a packed string table: a table
+    of (count + 1) offsets followed by the UTF-8 words back-to-back.
+    """
+    corpus_words = list(corpus_words)
+    badwords = list(badwords)
+    words = filter_words(corpus_words, badwords, min_word_length, max_word_length)
+    encoded = [word.encode("utf-8") for word in words]
+
+    offsets = bytearray()
+    pos = 0
+    for word in encoded:
+        offsets += _OFFSET.pack(pos)
+        pos += len(word)
+    offsets += _OFFSET.pack(pos)
+    body = bytes(offsets) + b"".join(encoded)
+
+    header = _HEADER.pack(
+        WORDLIST_MAGIC,
+        WORDLIST_FORMAT_VERSION,
+        len(encoded),
+        min_word_length,
+        max_word_length,
+        _sha256("\n".join(corpus_words)),
+        _sha256("\n".join(badwords)),
+        _sha256(body),
+    )
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "wb") as out_f:
+        out_f.write(header + body)
+    os.replace(tmp_path, path)
+    return len(encoded)
+
+
+class WordList:
+    """
+    Read-only, memory-mapped view of a word list artifact; indexing reads just
+    the one word, so nothing is decoded up front.
+    """
+
+    def __init__(self, path: Union[str, Path], mapped: mmap.mmap, header: tuple):
+        self.path = Path(path)
+        self._mm = mapped
+        (
+            _magic,
+            self.format_version,
+            self._count,
+            self.min_word_length,
+            self.max_word_length,
+            self.corpus_sha256,
+            self.badwords_sha256,
+            self.body_sha256,
+        ) = header
+        self._blob_start = _HEADER.size + (self._count + 1) * _OFFSET.size
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, idx: int) -> str:
+        if idx < 0:
+            idx += self._count
+        if not 0 <= idx < self._count:
+            raise IndexError("word index out of range")
+        (start,) = _OFFSET.unpack_from(self._mm, _HEADER.size + idx * _OFFSET.size)
+        (end,) = _OFFSET.unpack_from(self._mm, _HEADER.size + (idx + 1) * _OFFSET.size)
+        return self._mm[self._blob_start + start : self._blob_start + end].decode(
+            "utf-8"
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        for idx in range(self._count):
+            yield self[idx]
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "words": self._count,
+            "word_lengths": (self.min_word_length, self.max_word_length),
+            "corpus_sha256": self.corpus_sha256.hex(),
+            "badwords_sha256": self.badwords_sha256.hex(),
+        }
+
+    @classmethod
+    def load(
+        cls,
+        path: Union[str, Path],
+        min_word_length: int = constants.MIN_WORD_LENGTH,
+        max_word_length: int = constants.MAX_WORD_LENGTH,
+    ) -> Optional["WordList"]:
+        """
+        None if the artifact is missing, corrupt, in an older format or was
+        built for other word lengths.
+        """
+        try:
+            with open(path, "rb") as wl_f:
+                mapped = mmap.mmap(wl_f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        try:
+            header = _HEADER.unpack_from(mapped)
+        except struct.error:
+            return None
+        (magic, version, count, min_len, max_len, _c, _b, body_sha256) = header
+        if (
+            magic != WORDLIST_MAGIC
+            or version != WORDLIST_FORMAT_VERSION
+            or (min_len, max_len) != (min_word_length, max_word_length)
+            or len(mapped) < _HEADER.size + (count + 1) * _OFFSET.size
+            or _sha256(mapped[_HEADER.size :]) != body_sha256
+        ):
+            return None
+        return cls(path, mapped, header)
+
+
+def build_wordlist(
+    path: Union[str, Path],
+    min_word_length: int = constants.MIN_WORD_LENGTH,
+    max_word_length: int = constants.MAX_WORD_LENGTH,
+) -> int:
+    # only needed to build, which is rare: don't pay for importing them otherwise
+    import nltk
+    import requests
+
+    nltk.download("words", quiet=True)
+    badwords = requests.get(constants.LDNOOBW_URL, timeout=30).text.split("\n")
+    return write_wordlist(
+        path,
+        nltk.corpus.words.words(),
+        badwords,
+        min_word_length,
+        max_word_length,
+    )
+
+
+def load_wordlist(
+    path: Union[str, Path],
+    min_word_length: int = constants.MIN_WORD_LENGTH,
+    max_word_length: int = constants.MAX_WORD_LENGTH,
+    *,
+    rebuild: bool = False,
+) -> WordList:
+    """
+    Loads the word list artifact, building it first when asked to or when
+    there's no usable one at `path`.
+    """
+    started = time.perf_counter()
+    loaded = None if rebuild else WordList.load(path, min_word_length, max_word_length)
+    if loaded is None:
+        LOGGER.info(f"Building word list at {path}...")
+        count = build_wordlist(path, min_word_length, max_word_length)
+        LOGGER.info(f"Built word list of {count} words")
+        loaded = WordList.load(path, min_word_length, max_word_length)
+        if loaded is None:
+            raise Exception(f"Word list at {path} is unusable right after building")
+    LOGGER.info(
+        f"Loaded word list of {len(loaded)} words in {time.perf_counter() - started:.3f}s"
+    )
+    return loaded